@@ -0,0 +1,82 @@
+"""
+Measures decoding of a `Done` message with large traces.
+
+Compares the table-driven decoder in quickstrom.protocol with the
+previous approach of running a decoding hook on every JSON object.
+
+    python -m benchmarks.decode [--tests N] [--states N] [--elements N]
+"""
+
+import argparse
+import json
+import timeit
+from typing import Any
+
+import quickstrom.protocol as protocol
+from benchmarks.protocol import make_state
+
+
+def object_hook(d: Any) -> Any:
+    """The decoding hook used before, run on every nested object."""
+    if 'tag' not in d:
+        if 'id' in d and 'args' in d and 'isEvent' in d and 'timeout' in d:
+            return protocol.Action(d['id'], d['args'], d['isEvent'],
+                                   d['timeout'])
+        else:
+            return d
+    tag = d['tag']
+    if tag == 'RunResult':
+        return protocol.RunResult(d['valid'], d['trace'])
+    elif tag == 'Done':
+        return protocol.Done(results=d['results'])
+    elif tag == 'Definitely':
+        return protocol.Validity('Definitely', d['contents'])
+    elif tag == 'TraceAction':
+        return protocol.TraceActions(actions=d['contents'])
+    elif tag == 'TraceState':
+        return protocol.TraceState(state=d['contents'])
+    else:
+        raise Exception(f"Unsupported tagged JSON type: {tag}")
+
+
+def make_done(tests: int, states: int, elements: int) -> bytes:
+    action = {'id': 'click', 'args': ['el-1-1'], 'isEvent': False, 'timeout': None}
+    trace = []
+    for _ in range(states):
+        trace.append({'tag': 'TraceAction', 'contents': [action]})
+        trace.append({'tag': 'TraceState', 'contents': make_state(elements)})
+    return json.dumps({
+        'tag': 'Done',
+        'results': [{
+            'tag': 'RunResult',
+            'valid': {'tag': 'Definitely', 'contents': True},
+            'trace': trace
+        } for _ in range(tests)]
+    }).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--tests', type=int, default=10)
+    parser.add_argument('--states', type=int, default=50)
+    parser.add_argument('--elements', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    data = make_done(args.tests, args.states, args.elements)
+    print(f"Done message of {len(data) / 1024 / 1024:.1f} MiB")
+
+    # Parsing is the same for both, so it is measured separately.
+    codec = protocol.Codec()
+    decoders = {
+        'parse only': lambda: codec.loads(data),
+        'object hook (before)': lambda: json.loads(data, object_hook=object_hook),
+        'table-driven': lambda: protocol._decode(codec.loads(data)),
+    }
+    for name, decode in decoders.items():
+        seconds = min(timeit.repeat(decode, number=1, repeat=args.repeat))
+        print(f"{name:>22}: {seconds * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
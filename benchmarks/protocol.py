@@ -0,0 +1,114 @@
+"""
+Measures the throughput of the Specstrom protocol transport.
+
+Writes and reads back a stream of large `Performed` messages over an OS
+pipe with each available codec, and compares it to the previous transport
+(jsonlines over an unbuffered text pipe) when jsonlines is installed.
+
+    python -m benchmarks.protocol [--messages N] [--elements N]
+"""
+
+import argparse
+import io
+import json
+import os
+import threading
+import time
+
+import quickstrom.protocol as protocol
+
+
+def make_state(elements: int) -> protocol.State:
+    return {
+        f'.item-{i % 10}': [{
+            'ref': f'el-{i}-{j}',
+            'text': f'Item {i} with some text — {j}',
+            'visible': True,
+            'enabled': j % 2 == 0,
+            'position': {'x': i, 'y': j, 'width': 100, 'height': 20},
+        } for j in range(elements // 10)]
+        for i in range(10)
+    }
+
+
+def pipe_throughput(write, read, messages):
+    """Returns the seconds taken to send all messages through a pipe."""
+    r, w = os.pipe()
+    start = time.perf_counter()
+    reader = threading.Thread(target=read, args=(r, len(messages)))
+    reader.start()
+    write(w, messages)
+    reader.join()
+    return time.perf_counter() - start
+
+
+def codec_transport(codec: protocol.Codec):
+    def write(fd, messages):
+        with os.fdopen(fd, 'wb', buffering=io.DEFAULT_BUFFER_SIZE) as f:
+            writer = protocol.message_writer(f, codec)
+            for msg in messages:
+                writer.write(msg)
+
+    def read(fd, count):
+        with os.fdopen(fd, 'rb', buffering=io.DEFAULT_BUFFER_SIZE) as f:
+            reader = protocol.message_reader(f, codec)
+            for _ in range(count):
+                reader.read_frame()
+
+    return write, read
+
+
+def jsonlines_transport():
+    import jsonlines
+
+    def encode(o):
+        return {'tag': 'Performed', 'contents': o.state}
+
+    def write(fd, messages):
+        with os.fdopen(fd, 'w', buffering=1) as f:
+            writer = jsonlines.Writer(
+                f, dumps=lambda obj: json.dumps(obj, default=encode), flush=True)
+            for msg in messages:
+                writer.write(msg)
+
+    def read(fd, count):
+        with os.fdopen(fd, 'r') as f:
+            reader = jsonlines.Reader(f)
+            for _ in range(count):
+                reader.read()
+
+    return write, read
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--elements', type=int, default=500)
+    args = parser.parse_args()
+
+    messages = [
+        protocol.Performed(make_state(args.elements))
+        for _ in range(args.messages)
+    ]
+    size = len(protocol.Codec().dumps({'contents': messages[0].state}))
+    print(f"{args.messages} messages of {size / 1024:.0f} KiB each")
+
+    transports = []
+    try:
+        transports.append(('jsonlines (baseline)', jsonlines_transport()))
+    except ImportError:
+        pass
+    for name in protocol.codecs:
+        try:
+            transports.append((name, codec_transport(protocol.codec_by_name(name))))
+        except ImportError:
+            print(f"{name}: not installed")
+
+    for name, (write, read) in transports:
+        seconds = pipe_throughput(write, read, messages)
+        print(f"{name:>22}: {seconds:.3f}s "
+              f"({args.messages / seconds:.0f} messages/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Runs the case studies repeatedly and records where the time goes, per
+# phase of each check (browser start, page load, actions, queries,
+# screenshots, Specstrom), with percentiles per app and browser.
+
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import click
+
+import shared
+from measure import all_apps as todomvc_apps
+from quickstrom.timings import load_samples, summarize
+
+timer_app = shared.TestApp("timer", "timer",
+                           str(shared.case_studies_dir / "timer.html"),
+                           'passed')
+
+all_apps = todomvc_apps + [timer_app]
+
+results_file = shared.case_studies_dir / "runtimes" / "phases.json"
+
+
+def benchmark(apps: List[shared.TestApp], runs: int) -> List[dict]:
+    browsers: List[shared.Browser] = [
+        # "chrome",
+        "firefox",
+    ]
+    results = []
+    with shared.todomvc_server() as server, \
+            tempfile.TemporaryDirectory(prefix='quickstrom-benchmark-') as tmp:
+        try:
+            for app in apps:
+                for browser in browsers:
+                    click.echo(shared.heading1(f"{app.name}"))
+                    click.echo(f"Browser: {browser}")
+                    samples: Dict[str, List[float]] = {}
+                    per_run: Dict[str, List[float]] = {}
+                    durations: List[float] = []
+                    outcomes: Dict[str, int] = {}
+                    for n in range(runs):
+                        timings_file = os.path.join(
+                            tmp, f"{app.name}.{browser}.{n}.json")
+                        start_time = time.time()
+                        r = shared.check(app=app,
+                                         browser=browser,
+                                         timings_file=timings_file,
+                                         stdout=sys.stderr,
+                                         stderr=sys.stderr)
+                        durations.append(time.time() - start_time)
+                        outcomes[r] = outcomes.get(r, 0) + 1
+                        if not os.path.exists(timings_file):
+                            click.echo(shared.failure(f"Run {n} wrote no timings"))
+                            continue
+                        for phase, s in load_samples(timings_file).items():
+                            samples.setdefault(phase, []).extend(s)
+                            per_run.setdefault(phase, []).append(sum(s))
+                    results.append({
+                        'app': app.name,
+                        'browser': browser,
+                        'expected': app.expected,
+                        'outcomes': outcomes,
+                        'duration': summarize(durations),
+                        'phases': {
+                            phase: {
+                                'samples': summarize(s),
+                                'per_run': summarize(per_run[phase]),
+                            }
+                            for phase, s in sorted(samples.items())
+                        }
+                    })
+                    for phase, s in sorted(samples.items()):
+                        summary = summarize(s)
+                        click.echo(f"  {phase}: p50 {summary['p50'] * 1000:.1f}ms, "
+                                   f"p90 {summary['p90'] * 1000:.1f}ms, "
+                                   f"{len(s)} samples")
+                    click.echo("")
+        finally:
+            server.kill()
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        click.echo(f"Usage: {sys.argv[0]} RUNS [APPS]")
+        exit(1)
+    runs = int(sys.argv[1])
+    apps_to_run = sys.argv[2:]
+    selected_apps = all_apps
+    if len(apps_to_run) > 0:
+        selected_apps = [a for a in all_apps if a.name in apps_to_run]
+    results = benchmark(selected_apps, runs)
+    with open(results_file, "w") as f:
+        json.dump({'runs': runs, 'results': results}, f, indent=2)
+    click.echo(f"Results: {results_file}")
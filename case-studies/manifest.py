@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+
+# Writes a manifest of the TodoMVC apps for `quickstrom check-many`.
+
+import json
+import sys
+
+from run import all_apps
+
+if __name__ == "__main__":
+    json.dump([{
+        'name': app.name,
+        'module': app.module,
+        'origin': app.origin_url(),
+        'expected': app.expected,
+    } for app in all_apps],
+              sys.stdout,
+              indent=2)
+    sys.stdout.write("\n")
@@ -164,6 +164,8 @@ all_apps = [
     todomvc_app("vanilla-es6", expected='failed'),
     todomvc_app("vanillajs", expected='failed'),
     todomvc_app("vue"),
+    shared.TestApp("countdown", "countdown",
+                   str(shared.case_studies_dir / "countdown.html"), 'passed'),
 ]
 
 if __name__ == "__main__":
@@ -81,6 +81,7 @@ def check(app: TestApp,
           interpreter_log_file: Optional[str] = None,
           driver_log_file: Optional[str] = None,
           headful: bool = False,
+          timings_file: Optional[str] = None,
           stdout: TextIO = sys.stdout,
           stderr: TextIO = sys.stderr):
 
@@ -104,7 +105,8 @@ def check(app: TestApp,
     ] + optional("--reporter", "html" if html_report_dir is not None else None) \
         + optional("--html-report-directory", html_report_dir) \
             + optional("--interpreter-log-file", interpreter_log_file) \
-            + optional("--driver-log-file", driver_log_file)
+            + optional("--driver-log-file", driver_log_file) \
+            + optional("--timings-file", timings_file)
 
     click.echo(f"Command: {' '.join(args)}")
     click.echo("")
@@ -0,0 +1,57 @@
+import { deepEqual } from "./equality";
+import { currentSeq, Seq } from "./eventQueue";
+import { ElementState, QueriedState } from "./queries";
+
+export type SnapshotId = number;
+
+// An element is either sent in full, or as the index of an equal element
+// in the previous snapshot's list for the same selector.
+type ElementDelta = ElementState | number;
+
+export interface StateDelta {
+    base: SnapshotId | null;
+    id: SnapshotId;
+    // The latest queued event that the state reflects.
+    seq: Seq;
+    unchanged: string[];
+    queries: { [selector: string]: ElementDelta[] };
+}
+
+let snapshot: { id: SnapshotId; state: QueriedState } | null = null;
+
+let nextId: SnapshotId = Math.floor(Math.random() * 1000000000);
+
+// Encodes the state relative to the snapshot with the given id, if that is
+// the latest snapshot in this document. Otherwise, the full state is sent.
+export function encodeDelta(state: QueriedState, base: SnapshotId | null): StateDelta {
+    const previous = snapshot !== null && snapshot.id === base ? snapshot.state : null;
+    const id = nextId++;
+    const seq = currentSeq();
+    snapshot = { id, state };
+
+    if (previous === null) {
+        return { base: null, id, seq, unchanged: [], queries: state };
+    }
+
+    const unchanged: string[] = [];
+    const queries: { [selector: string]: ElementDelta[] } = {};
+    Object.entries(state).forEach(([selector, elements]) => {
+        const previousElements = previous[selector];
+        if (previousElements === undefined) {
+            queries[selector] = elements;
+            return;
+        }
+        const previousIndices = new Map<any, number>();
+        previousElements.forEach((element, i) => previousIndices.set(element.ref, i));
+        const deltas: ElementDelta[] = elements.map((element) => {
+            const i = previousIndices.get(element.ref);
+            return i !== undefined && deepEqual(previousElements[i], element) ? i : element;
+        });
+        if (deltas.length === previousElements.length && deltas.every((d, i) => d === i)) {
+            unchanged.push(selector);
+        } else {
+            queries[selector] = deltas;
+        }
+    });
+    return { base, id, seq, unchanged, queries };
+}
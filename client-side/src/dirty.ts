@@ -0,0 +1,111 @@
+// Tracks whether anything that could affect queried element states has
+// happened since the last query. Element states include positions, which
+// depend on the layout of the whole page, so any change marks all
+// selectors as dirty. Not every change is observable, e.g. a timer setting
+// an input's value, so callers also mark everything dirty whenever time
+// may have passed without any observed changes.
+
+const events = [
+  "load",
+  "readystatechange",
+  "resize",
+  "scroll",
+  "input",
+  "change",
+  "focusin",
+  "focusout",
+  "keydown",
+  "keyup",
+  "mousedown",
+  "mouseup",
+  "mouseover",
+  "mouseout",
+  "click",
+  "dblclick",
+  "transitionrun",
+  "transitionstart",
+  "transitionend",
+  "transitioncancel",
+  "animationstart",
+  "animationiteration",
+  "animationend",
+  "animationcancel",
+  "play",
+  "pause",
+  "ended",
+  "seeked",
+  "timeupdate",
+  "volumechange",
+  "ratechange",
+  "durationchange",
+  "loadedmetadata",
+];
+
+let observer: MutationObserver | null = null;
+
+let dirty = true;
+
+type MutationListener = (mutations: MutationRecord[]) => void;
+
+// Others observing the document share this observer, as every observer
+// adds to the work the browser does on each mutation.
+const listeners: MutationListener[] = [];
+
+// Marks everything as changed, so that the next query reads it all again.
+export function markDirty() {
+  dirty = true;
+}
+
+function onMutations(mutations: MutationRecord[]) {
+  markDirty();
+  listeners.forEach((listener) => listener(mutations));
+}
+
+function startObserving(): MutationObserver {
+  if (observer === null) {
+    observer = new MutationObserver(onMutations);
+    observer.observe(document, {
+      childList: true,
+      subtree: true,
+      attributes: true,
+      characterData: true,
+    });
+    // Listening in the capture phase also catches events that don't bubble.
+    events.forEach((name) => window.addEventListener(name, markDirty, true));
+  }
+  return observer;
+}
+
+// Calls the listener with all mutations of the document from now on.
+export function addMutationListener(listener: MutationListener) {
+  startObserving();
+  listeners.push(listener);
+}
+
+// Delivers pending mutations right away, instead of when the browser
+// next calls the observer.
+export function flushMutations() {
+  if (observer !== null) {
+    const records = observer.takeRecords();
+    if (records.length > 0) {
+      onMutations(records);
+    }
+  }
+}
+
+function hasRunningAnimations(): boolean {
+  const doc = document as any;
+  return typeof doc.getAnimations === "function" && doc.getAnimations().length > 0;
+}
+
+// Returns whether anything might have changed since the previous call.
+export function takeChanges(): boolean {
+  startObserving();
+  flushMutations();
+  if (hasRunningAnimations()) {
+    dirty = true;
+  }
+  const changed = dirty;
+  dirty = false;
+  return changed;
+}
@@ -0,0 +1,146 @@
+// A queue of the events in this document that are relevant to the queried
+// dependencies, fed by listeners installed once per document. Events are
+// numbered in sequence, and the executor drains them from the last
+// sequence number it has seen, so that no event is lost between scripts.
+
+import { toArray } from "./arrays";
+import { addMutationListener, flushMutations } from "./dirty";
+import { ChangedEvent, LoadedEvent, matchesSelector, matchingAnySelector } from "./events";
+import { Dependencies } from "./queries";
+
+export type Seq = number;
+
+type QueuedEvent = { seq: Seq; event: LoadedEvent | ChangedEvent };
+
+// Events not drained by then are dropped, oldest first.
+const maxQueueLength = 10000;
+
+const queue: QueuedEvent[] = [];
+
+// Like snapshot ids, sequence numbers start at random, so that one from
+// another document is very unlikely to be valid in this one.
+const firstSeq: Seq = Math.floor(Math.random() * 1000000000);
+
+let nextSeq: Seq = firstSeq;
+
+let dependencies: Dependencies = {};
+
+let selectors: string[] = [];
+
+let started = false;
+
+const waiters: Array<() => void> = [];
+
+function push(event: LoadedEvent | ChangedEvent) {
+    queue.push({ seq: nextSeq++, event });
+    if (queue.length > maxQueueLength) {
+        queue.shift();
+    }
+    waiters.splice(0).forEach((wake) => wake());
+}
+
+function onMutations(mutations: MutationRecord[]) {
+    const nodes = mutations.flatMap((mutation) => [
+        [mutation.target],
+        toArray(mutation.addedNodes) as Node[],
+        toArray(mutation.removedNodes) as Node[],
+    ].flat());
+    matchingAnySelector(nodes, selectors).forEach((element) =>
+        push({ tag: "changed", element })
+    );
+}
+
+function onStyleEnd(e: Event) {
+    const target = e.target;
+    if (!(target instanceof Element)) {
+        return;
+    }
+    const anyMatching = Object.entries(dependencies).find(([selector, schema]) => {
+        if (e instanceof TransitionEvent) {
+            return schema.css && schema.css[e.propertyName] && matchesSelector(target, selector);
+        } else {
+            return matchesSelector(target, selector);
+        }
+    }) !== undefined;
+    if (anyMatching) {
+        push({ tag: "changed", element: target });
+    }
+}
+
+// Queues events relevant to the dependencies from now on. The listeners
+// are installed on the first call only, later calls just update the
+// dependencies.
+export function watch(deps: Dependencies) {
+    dependencies = deps;
+    selectors = Object.keys(deps);
+    if (started) {
+        return;
+    }
+    started = true;
+    if (document.readyState === "complete") {
+        push({ tag: "loaded" });
+    } else {
+        window.addEventListener("load", () => push({ tag: "loaded" }));
+    }
+    addMutationListener(onMutations);
+    ["transitionend", "transitioncancel", "animationend", "animationcancel"].forEach((name) =>
+        document.addEventListener(name, onStyleEnd)
+    );
+}
+
+// The sequence number of the latest queued event, which a state queried
+// now reflects.
+export function currentSeq(): Seq {
+    flushMutations();
+    return nextSeq - 1;
+}
+
+// Drops events up to and including `since`, and returns those after it.
+// A sequence number not from this document drains all events.
+function drain(since: Seq | null): QueuedEvent[] {
+    flushMutations();
+    const fromThisDocument = since !== null && since >= firstSeq - 1 && since < nextSeq;
+    if (fromThisDocument) {
+        while (queue.length > 0 && queue[0].seq <= since!) {
+            queue.shift();
+        }
+    }
+    return queue.slice();
+}
+
+function distinctEvents(events: QueuedEvent[]): Array<LoadedEvent | ChangedEvent> {
+    const seen = new Set<Element | string>();
+    const r: Array<LoadedEvent | ChangedEvent> = [];
+    events.forEach(({ event }) => {
+        const key = event.tag === "loaded" ? "loaded" : event.element;
+        if (!seen.has(key)) {
+            seen.add(key);
+            r.push(event);
+        }
+    });
+    return r;
+}
+
+// Resolves with the events after `since`, as soon as there are any, or
+// with none after the timeout.
+export function nextEvents(since: Seq | null, timeoutMs: number): Promise<Array<LoadedEvent | ChangedEvent>> {
+    return new Promise((resolve) => {
+        const available = drain(since);
+        if (available.length > 0) {
+            resolve(distinctEvents(available));
+            return;
+        }
+        function wake() {
+            clearTimeout(timer);
+            resolve(distinctEvents(drain(since)));
+        }
+        const timer = setTimeout(() => {
+            const i = waiters.indexOf(wake);
+            if (i >= 0) {
+                waiters.splice(i, 1);
+            }
+            resolve([]);
+        }, timeoutMs);
+        waiters.push(wake);
+    });
+}
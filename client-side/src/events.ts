@@ -1,26 +1,29 @@
-import { distinct, toArray } from "./arrays";
-import { Dependencies } from "./queries";
+import { distinct } from "./arrays";
+import { Ref, refOf } from "./refs";
 
-type LoadedEvent = { tag: "loaded" };
+export type LoadedEvent = { tag: "loaded" };
 
-type ChangedEvent = { tag: "changed"; element: Element };
+export type ChangedEvent = { tag: "changed"; element: Element };
 
 type DetachedEvent = { tag: "detached"; markup: string };
 
-export function toDetached(event: LoadedEvent | ChangedEvent): LoadedEvent | ChangedEvent | DetachedEvent {
+// A changed event as sent to the executor, with the element's ref.
+type ChangedRefEvent = { tag: "changed"; element: Ref };
+
+export function toDetached(event: LoadedEvent | ChangedEvent): LoadedEvent | ChangedRefEvent | DetachedEvent {
   switch (event.tag) {
     case "loaded":
       return event;
     case "changed":
       if (event.element.isConnected) {
-        return event;
+        return { tag: "changed", element: refOf(event.element) };
       } else {
         return { tag: "detached", markup: renderMarkupSummary(event.element) };
       }
   }
 }
 
-function matchesSelector(node: Node, selector: string): boolean {
+export function matchesSelector(node: Node, selector: string): boolean {
   return node instanceof Element && node.matches(selector);
 }
 
@@ -30,96 +33,13 @@ function matchesAnySelector(node: Node, selectors: string[]): boolean {
   );
 }
 
-function matchingAnySelector(nodes: Node[], selectors: string[]): Element[] {
+export function matchingAnySelector(nodes: Node[], selectors: string[]): Element[] {
   const elements = nodes.filter((node) =>
     matchesAnySelector(node, selectors)
   ) as Element[];
   return distinct(elements);
 }
 
-export async function awaitLoaded(): Promise<LoadedEvent[]> {
-  return new Promise((resolve) => {
-    // @ts-ignore
-    const alreadyFired = window.quickstromLoadedFired;
-    if (document.readyState === "complete" && !alreadyFired) {
-      // @ts-ignore
-      window.quickstromLoadedFired = true;
-      resolve([{ tag: "loaded" }]);
-    } else {
-      window.addEventListener("load", () => {
-        resolve([{ tag: "loaded" }]);
-      });
-    }
-  });
-}
-
-export async function awaitStyleChanged(
-  deps: Dependencies
-): Promise<ChangedEvent[]> {
-  const events: Array<keyof DocumentEventMap> = [
-    "transitionend",
-    "transitioncancel",
-    "animationend",
-    "animationcancel",
-  ];
-  return new Promise((resolve) => {
-    function remove() {
-      events.forEach((name) =>
-        document.removeEventListener(name, onEnd as EventListener)
-      );
-    }
-    function onEnd(e: AnimationEvent | TransitionEvent) {
-      if (e.target && e.target instanceof Element) {
-        const anyMatching =
-          Object.entries(deps).find(([selector, schema]) => {
-            if (e instanceof TransitionEvent) {
-              return (
-                schema.css &&
-                schema.css[e.propertyName] &&
-                matchesSelector(e.target as Element, selector)
-              );
-            } else {
-              return matchesSelector(e.target as Element, selector);
-            }
-          }) !== undefined;
-        if (anyMatching) {
-          remove();
-          resolve([{ tag: "changed", element: e.target }]);
-        }
-      }
-    }
-    events.forEach((name) =>
-      document.addEventListener(name, onEnd as EventListener)
-    );
-  });
-}
-
-export async function awaitChanged(
-  selectors: string[]
-): Promise<ChangedEvent[]> {
-  return new Promise((resolve) => {
-    new MutationObserver((mutations, observer) => {
-      const nodes = mutations.flatMap((mutation) => {
-        return [
-          [mutation.target],
-          toArray(mutation.addedNodes) as Node[],
-          toArray(mutation.removedNodes) as Node[],
-        ].flat();
-      });
-
-      const matching = matchingAnySelector(nodes, selectors);
-      if (matching.length > 0) {
-        observer.disconnect();
-        resolve(matching.map((e) => ({ tag: "changed", element: e })));
-      }
-    }).observe(document, {
-      childList: true,
-      subtree: true,
-      attributes: true,
-    });
-  });
-}
-
 function renderMarkupSummary(element: Element) {
   const tag = element.tagName;
   let attrs: string[] = [];
@@ -1,5 +1,9 @@
 import { isElementVisible } from "./visibility";
 
-export function isElementInteractable(element: HTMLElement) {
-    return isElementVisible(element) && window.getComputedStyle(element).pointerEvents !== "none";
+export function isElementInteractable(
+    element: HTMLElement,
+    cs: CSSStyleDeclaration = window.getComputedStyle(element),
+    visible: boolean = isElementVisible(element, cs)
+) {
+    return visible && cs.pointerEvents !== "none";
 }
@@ -2,8 +2,8 @@ import { isElementVisible } from "./visibility";
 
 export type Position = { x: number; y: number; width: number; height: number; }
 
-export function getPosition(element: Element): Position | undefined {
-    if (isElementVisible(element as HTMLElement)) {
+export function getPosition(element: Element, visible: boolean = isElementVisible(element as HTMLElement)): Position | undefined {
+    if (visible) {
         const rect = element.getBoundingClientRect();
         return {
             x: Math.round(rect.left),
@@ -14,4 +14,4 @@ export function getPosition(element: Element): Position | undefined {
     } else {
         return undefined;
     }
-}
\ No newline at end of file
+}
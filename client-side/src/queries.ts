@@ -1,6 +1,8 @@
 import { toArray } from "./arrays";
+import { takeChanges } from "./dirty";
 import { isElementInteractable } from "./interactability";
 import { getPosition, Position } from "./position";
+import { pruneRefs, Ref, refOf } from "./refs";
 import { isElementVisible } from "./visibility";
 
 export type Selector = string;
@@ -13,8 +15,8 @@ export interface Dependencies {
     [selector: string]: Schema,
 };
 
-interface ElementState {
-    ref?: Element,
+export interface ElementState {
+    ref?: Ref,
     position?: Position,
     [x: string]: any,
 }
@@ -23,16 +25,41 @@ export interface QueriedState {
     [selector: string]: Array<ElementState>;
 }
 
-export function runQuery(selector: Selector, schema: Schema): ElementState[] {
+// Style and layout reads for a single query of the page. Each element's
+// computed style and visibility are read once per snapshot, and shared
+// between all selectors and schema keys that need them.
+export class QuerySnapshot {
+    private styles = new Map<Element, CSSStyleDeclaration>();
+    private visibilities = new Map<Element, boolean>();
+
+    style(element: Element): CSSStyleDeclaration {
+        let style = this.styles.get(element);
+        if (style === undefined) {
+            style = window.getComputedStyle(element);
+            this.styles.set(element, style);
+        }
+        return style;
+    }
+
+    isVisible(element: HTMLElement): boolean {
+        let visible = this.visibilities.get(element);
+        if (visible === undefined) {
+            visible = isElementVisible(element, this.style(element));
+            this.visibilities.set(element, visible);
+        }
+        return visible;
+    }
+}
+
+function queryElement(element: HTMLElement, schema: Schema, snapshot: QuerySnapshot): ElementState {
     function queryCssValues(element: HTMLElement, subSchema: Schema): any {
         const css: ElementState = {};
+        const style = snapshot.style(element);
         Object.entries(subSchema).forEach(([name, subSchema]) => {
             if (Object.keys(subSchema).length > 0) {
                 throw Error("Schema for CSS value cannot contain sub-schemas: " + JSON.stringify(subSchema));
             } else {
-                css[name] = window
-                    .getComputedStyle(element)
-                    .getPropertyValue(name);
+                css[name] = style.getPropertyValue(name);
             }
         });
         return css;
@@ -59,50 +86,107 @@ export function runQuery(selector: Selector, schema: Schema): ElementState[] {
         }
     }
 
-    const elements: HTMLElement[] = toArray(document.querySelectorAll(selector) as NodeListOf<HTMLElement>);
-    return elements.map((element) => {
-        var m: ElementState = {};
-        Object.entries(schema).forEach(([key, subSchema]) => {
-            switch (key) {
-                case "enabled":
-                    // @ts-ignore
-                    m[key] = !element.disabled;
-                    break;
-                case "visible":
-                    m[key] = isElementVisible(element as HTMLElement);
-                    break;
-                case "interactable":
-                    m[key] = isElementInteractable(element);
-                    break;
-                case "active":
-                    m[key] = document.activeElement == element;
-                    break;
-                case "classList":
-                    // @ts-ignore
-                    m[key] = Array(...element.classList);
-                    break;
-                case "css":
-                    m[key] = queryCssValues(element, subSchema);
-                    break;
-                case "attributes":
-                    m[key] = queryAttributeValues(element, subSchema);
-                    break;
-                default:
-                    // @ts-ignore
-                    m[key] = queryRecursive(element[key], subSchema);
-                    break;
-            }
-        });
-        m.ref = element;
-        m.position = getPosition(element);
-        return m;
+    var m: ElementState = {};
+    Object.entries(schema).forEach(([key, subSchema]) => {
+        switch (key) {
+            case "enabled":
+                // @ts-ignore
+                m[key] = !element.disabled;
+                break;
+            case "visible":
+                m[key] = snapshot.isVisible(element);
+                break;
+            case "interactable":
+                m[key] = isElementInteractable(element, snapshot.style(element), snapshot.isVisible(element));
+                break;
+            case "active":
+                m[key] = document.activeElement == element;
+                break;
+            case "classList":
+                // @ts-ignore
+                m[key] = Array(...element.classList);
+                break;
+            case "css":
+                m[key] = queryCssValues(element, subSchema);
+                break;
+            case "attributes":
+                m[key] = queryAttributeValues(element, subSchema);
+                break;
+            default:
+                // @ts-ignore
+                m[key] = queryRecursive(element[key], subSchema);
+                break;
+        }
     });
+    m.ref = refOf(element);
+    m.position = getPosition(element, snapshot.isVisible(element));
+    return m;
+}
+
+function selectElements(selector: Selector): HTMLElement[] {
+    return toArray(document.querySelectorAll(selector) as NodeListOf<HTMLElement>);
+}
+
+export function runQuery(selector: Selector, schema: Schema, snapshot: QuerySnapshot = new QuerySnapshot()): ElementState[] {
+    return selectElements(selector).map((element) => queryElement(element, schema, snapshot));
+}
+
+// Element states of the latest query per selector, reused until anything
+// changes in the page.
+const cache = new Map<Selector, { schema: string; elements: ElementState[] }>();
+
+// Schema keys whose changes are observed: attributes, styles, and layout
+// through mutations, text through character data and child list
+// mutations, and form values through input and change events. Values set
+// by scripts without any event are caught as callers mark everything
+// dirty when time passes (see dirty.ts). Selectors querying other element
+// properties are never cached.
+const observedKeys = new Set([
+    "enabled",
+    "visible",
+    "interactable",
+    "active",
+    "classList",
+    "css",
+    "attributes",
+    "textContent",
+    "text",
+    "value",
+    "checked",
+]);
+
+function isCacheable(schema: Schema): boolean {
+    return Object.keys(schema).every((key) => observedKeys.has(key));
 }
 
 export function queryState(deps: Dependencies): QueriedState {
+    if (takeChanges()) {
+        cache.clear();
+        pruneRefs();
+    }
     var r: QueriedState = {};
+    // First, all elements are selected. Then their states are read, with
+    // no DOM writes in between, so that styles and layout are computed at
+    // most once for the whole snapshot.
+    const selected: Array<[Selector, Schema, string, HTMLElement[]]> = [];
     Object.entries(deps).forEach(([selector, schema]) => {
-        r[selector] = runQuery(selector, schema).filter((e: ElementState) => e.ref?.isConnected ?? true);
+        const schemaKey = JSON.stringify(schema);
+        const cached = cache.get(selector);
+        if (cached !== undefined && cached.schema === schemaKey) {
+            r[selector] = cached.elements;
+        } else {
+            selected.push([selector, schema, schemaKey, selectElements(selector)]);
+        }
+    });
+    const snapshot = new QuerySnapshot();
+    selected.forEach(([selector, schema, schemaKey, elements]) => {
+        const states = elements
+            .filter((element) => element.isConnected)
+            .map((element) => queryElement(element, schema, snapshot));
+        if (isCacheable(schema)) {
+            cache.set(selector, { schema: schemaKey, elements: states });
+        }
+        r[selector] = states;
     });
     return r;
 }
@@ -0,0 +1,16 @@
+// Entry point of the client-side bundle, which is installed once per
+// document. The executor then invokes these functions by name.
+import { encodeDelta, SnapshotId } from "./delta";
+import { Dependencies, queryState } from "./queries";
+import { resolveRef } from "./refs";
+import { awaitEvents } from "./scripts/awaitEvents";
+import { awaitReady } from "./scripts/awaitReady";
+import { observe } from "./scripts/observe";
+
+window.quickstrom = {
+    queryState: (queries: Dependencies, base: SnapshotId | null) => encodeDelta(queryState(queries), base),
+    awaitEvents,
+    awaitReady,
+    observe,
+    resolveRef,
+};
@@ -0,0 +1,107 @@
+export type ReadinessStrategy =
+  | { tag: "readyState"; timeout: number }
+  | { tag: "domQuiescence"; quiet: number; timeout: number }
+  | { tag: "networkIdle"; idle: number; timeout: number }
+  | { tag: "predicate"; expression: string; timeout: number };
+
+const pollInterval = 50;
+
+function withTimeout(timeoutMs: number, check: (ready: () => void) => () => void): Promise<boolean> {
+  return new Promise((resolve) => {
+    let cleanup = () => {};
+    const timer = setTimeout(() => {
+      cleanup();
+      resolve(false);
+    }, timeoutMs);
+    cleanup = check(() => {
+      clearTimeout(timer);
+      cleanup();
+      resolve(true);
+    });
+  });
+}
+
+function poll(condition: () => boolean): (ready: () => void) => () => void {
+  return (ready) => {
+    if (condition()) {
+      ready();
+      return () => {};
+    }
+    const interval = setInterval(() => {
+      if (condition()) {
+        ready();
+      }
+    }, pollInterval);
+    return () => clearInterval(interval);
+  };
+}
+
+function awaitReadyState(timeoutMs: number): Promise<boolean> {
+  return withTimeout(timeoutMs, poll(() => document.readyState === "complete"));
+}
+
+function awaitDomQuiescence(quietMs: number, timeoutMs: number): Promise<boolean> {
+  return withTimeout(timeoutMs, (ready) => {
+    let timer = setTimeout(ready, quietMs);
+    const observer = new MutationObserver(() => {
+      clearTimeout(timer);
+      timer = setTimeout(ready, quietMs);
+    });
+    observer.observe(document, {
+      childList: true,
+      subtree: true,
+      attributes: true,
+      characterData: true,
+    });
+    return () => {
+      clearTimeout(timer);
+      observer.disconnect();
+    };
+  });
+}
+
+// Resource timing entries are only added when a request completes, so the
+// network is considered idle when the document has loaded and no request
+// has completed for `idleMs`.
+function awaitNetworkIdle(idleMs: number, timeoutMs: number): Promise<boolean> {
+  let count = performance.getEntriesByType("resource").length;
+  let lastChange = Date.now();
+  return withTimeout(
+    timeoutMs,
+    poll(() => {
+      const newCount = performance.getEntriesByType("resource").length;
+      if (newCount !== count) {
+        count = newCount;
+        lastChange = Date.now();
+      }
+      return document.readyState === "complete" && Date.now() - lastChange >= idleMs;
+    })
+  );
+}
+
+function awaitPredicate(expression: string, timeoutMs: number): Promise<boolean> {
+  const predicate = new Function(`return (${expression});`);
+  return withTimeout(
+    timeoutMs,
+    poll(() => {
+      try {
+        return !!predicate();
+      } catch (e) {
+        return false;
+      }
+    })
+  );
+}
+
+export function awaitReady(strategy: ReadinessStrategy): Promise<boolean> {
+  switch (strategy.tag) {
+    case "readyState":
+      return awaitReadyState(strategy.timeout);
+    case "domQuiescence":
+      return awaitDomQuiescence(strategy.quiet, strategy.timeout);
+    case "networkIdle":
+      return awaitNetworkIdle(strategy.idle, strategy.timeout);
+    case "predicate":
+      return awaitPredicate(strategy.expression, strategy.timeout);
+  }
+}
@@ -0,0 +1,41 @@
+// Hands out short refs for elements, stable for the lifetime of the
+// document. The prefix is a random 8-digit base36 number, so that refs
+// from different documents are very unlikely to collide.
+
+export type Ref = string;
+
+const prefix = Math.random().toString(36).slice(2, 10).padEnd(8, '0');
+
+let nextRef = 0;
+
+const refsByElement = new WeakMap<Element, Ref>();
+
+const elementsByRef = new Map<Ref, Element>();
+
+export function refOf(element: Element): Ref {
+    let ref = refsByElement.get(element);
+    if (ref === undefined) {
+        ref = `${prefix}${(nextRef++).toString(36)}`;
+        refsByElement.set(element, ref);
+    }
+    // Pruned elements keep their ref, and are found again when they are
+    // attached again.
+    elementsByRef.set(ref, element);
+    return ref;
+}
+
+// Returns the element with the given ref, or null if it is no longer in
+// the document.
+export function resolveRef(ref: Ref): Element | null {
+    const element = elementsByRef.get(ref);
+    return element !== undefined && element.isConnected ? element : null;
+}
+
+// Forgets elements that have been removed from the document.
+export function pruneRefs() {
+    elementsByRef.forEach((element, ref) => {
+        if (!element.isConnected) {
+            elementsByRef.delete(ref);
+        }
+    });
+}
@@ -1,6 +1,5 @@
 interface Window {
     quickstrom: {
-        run: (...args: any) => any;
-        eventsObserver: Promise<any>
+        [name: string]: any;
     };
 }
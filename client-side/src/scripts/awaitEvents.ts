@@ -1,19 +1,20 @@
+import { encodeDelta, SnapshotId } from "../delta";
+import { markDirty } from "../dirty";
 import { toDetached } from "../events";
+import { nextEvents, Seq, watch } from "../eventQueue";
 import { queryState, Dependencies } from "../queries";
 
-function delay(ms: number): Promise<null> {
-    return new Promise((resolve) => {
-        setTimeout(resolve, ms);
-    });
-}
-
-window.quickstrom.run = function(queries: Dependencies, timeoutMs: number, done: any) {
-    Promise.race([
-        window.quickstrom.eventsObserver,
-        delay(timeoutMs),
-    ]).then((events) => {
-        if (events) {
-            done({ events: events.map(toDetached), state: queryState(queries) });
+// Resolves with the events queued after `since`, and the state after
+// them, or with null if there are none before the timeout.
+export function awaitEvents(queries: Dependencies, timeoutMs: number, since: Seq | null, base: SnapshotId | null, done: any) {
+    watch(queries);
+    nextEvents(since, timeoutMs).then((events) => {
+        // The page may have changed in ways not observed while waiting,
+        // so the state after this wait, with or without events (in which
+        // case it is queried next), is read from scratch.
+        markDirty();
+        if (events.length > 0) {
+            done({ events: events.map(toDetached), state: encodeDelta(queryState(queries), base) });
         } else {
             done(null);
         }
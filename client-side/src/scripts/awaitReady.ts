@@ -0,0 +1,5 @@
+import { awaitReady as awaitReadiness, ReadinessStrategy } from "../readiness";
+
+export function awaitReady(strategy: ReadinessStrategy, done: any) {
+    awaitReadiness(strategy).then((ready) => done({ ready }));
+};
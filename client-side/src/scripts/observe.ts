@@ -0,0 +1,10 @@
+import { encodeDelta, SnapshotId, StateDelta } from "../delta";
+import { watch } from "../eventQueue";
+import { Dependencies, queryState } from "../queries";
+
+// Queries the state after an action has been performed, making sure that
+// events from then on are queued.
+export function observe(queries: Dependencies, base: SnapshotId | null): StateDelta {
+    watch(queries);
+    return encodeDelta(queryState(queries), base);
+};
@@ -1,5 +0,0 @@
-import { queryState } from "../queries";
-
-window.quickstrom.run = function (queries) {
-    return queryState(queries)
-};
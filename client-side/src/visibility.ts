@@ -1,5 +1,4 @@
-export function isElementVisible(el: HTMLElement): boolean {
-    const cs = window.getComputedStyle(el);
+export function isElementVisible(el: HTMLElement, cs: CSSStyleDeclaration = window.getComputedStyle(el)): boolean {
     return (
         cs.getPropertyValue("display") !== "none" &&
         cs.getPropertyValue("visibility") !== "hidden" &&
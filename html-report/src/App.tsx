@@ -77,6 +77,7 @@ function uniqueElementsInState(state: State): {
 
 type Screenshot = {
   url: string;
+  thumbnailUrl?: string;
   width: number;
   height: number;
   scale: number;
@@ -527,6 +528,33 @@ const MarkerDim: FunctionComponent<{
   }
 };
 
+// Shows the thumbnail (if any) until the full-size image has loaded.
+const ProgressiveImage: FunctionComponent<{ screenshot: Screenshot }> = ({
+  screenshot,
+}) => {
+  const [loaded, setLoaded] = useState(!screenshot.thumbnailUrl);
+  useEffect(() => {
+    if (!screenshot.thumbnailUrl) {
+      setLoaded(true);
+      return;
+    }
+    setLoaded(false);
+    const image = new Image();
+    image.onload = () => setLoaded(true);
+    image.src = screenshot.url;
+    return () => {
+      image.onload = null;
+    };
+  }, [screenshot.url, screenshot.thumbnailUrl]);
+  return (
+    <img
+      src={loaded ? screenshot.url : screenshot.thumbnailUrl}
+      width={screenshot.width}
+      height={screenshot.height}
+    />
+  );
+};
+
 const MissingScreenshot: FunctionComponent = () => {
   return (
     <div class={`state-screenshot missing`}>
@@ -584,7 +612,7 @@ const Screenshot: FunctionComponent<{
     <div class={`state-screenshot ${extraClass}`}>
       <div class=" state-screenshot-inner">
         {Object.values(uniqueElementsInState(state)).map(renderQueryMarkers)}
-        <img src={s.url} width={s.width} height={s.height} />
+        <ProgressiveImage screenshot={s} />
         {dim}
       </div>
     </div>
@@ -0,0 +1,181 @@
+"""
+Runs many checks, each of a module against an origin, concurrently on a
+bounded number of job slots, sharing browsers between them.
+
+Jobs are read from a JSON manifest, a list of objects like:
+
+    {"name": "react", "module": "todomvc",
+     "origin": "http://localhost:12345/examples/react/index.html",
+     "expected": "passed"}
+
+where `name` defaults to the origin, and `expected` to `passed`. The
+longest jobs are started first, using durations recorded in previous
+runs, so that a long job started last does not hold up the whole batch.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import IO, Callable, Dict, List, Literal, Optional, Union
+
+import quickstrom.executor as executor
+import quickstrom.result as result
+
+Outcome = Union[Literal['passed'], Literal['failed'], Literal['error'],
+                Literal['specstrom-error']]
+
+outcomes = ['passed', 'failed', 'error', 'specstrom-error']
+
+
+@dataclass(frozen=True)
+class Job():
+    name: str
+    module: str
+    origin: str
+    expected: Outcome = 'passed'
+
+
+@dataclass(frozen=True)
+class JobResult():
+    job: Job
+    outcome: Outcome
+    duration: float
+    results: List[result.PlainResult]
+    message: Optional[str] = None
+
+    def is_expected(self) -> bool:
+        return self.outcome == self.job.expected
+
+
+def load_manifest(path: str) -> List[Job]:
+    with open(path) as f:
+        entries = json.load(f)
+    jobs = []
+    for entry in entries:
+        expected = entry.get('expected', 'passed')
+        if expected not in outcomes:
+            raise ValueError(
+                f"Invalid expected result `{expected}` in {path}, must be one of: {', '.join(outcomes)}"
+            )
+        jobs.append(
+            Job(entry.get('name', entry['origin']), entry['module'],
+                entry['origin'], expected))
+    names = [job.name for job in jobs]
+    duplicates = sorted(set(n for n in names if names.count(n) > 1))
+    if duplicates:
+        raise ValueError(
+            f"Duplicate job names in {path}: {', '.join(duplicates)}")
+    # Log files are named after jobs, so names must differ as file names too.
+    file_names = [safe_file_name(n) for n in names]
+    clashing = sorted(n for n, f in zip(names, file_names)
+                      if file_names.count(f) > 1)
+    if clashing:
+        raise ValueError(
+            f"Job names with the same log file name in {path}: {', '.join(clashing)}"
+        )
+    return jobs
+
+
+def load_durations(path: str) -> Dict[str, float]:
+    """Job durations in seconds by name, or none if the file is missing."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_durations(path: str, job_results: List[JobResult]):
+    """Records the durations of jobs, keeping those of jobs not run."""
+    durations = load_durations(path)
+    for r in job_results:
+        durations[r.job.name] = r.duration
+    with open(path, 'w') as f:
+        json.dump(durations, f, indent=2, sort_keys=True)
+
+
+def schedule(jobs: List[Job], durations: Dict[str, float]) -> List[Job]:
+    """
+    Orders jobs longest first. Jobs without a recorded duration go first
+    of all, as nothing is known about them.
+    """
+    return sorted(jobs,
+                  key=lambda job: -durations.get(job.name, float('inf')))
+
+
+def outcome_of(results: List[result.PlainResult]) -> Outcome:
+    if any(isinstance(r, result.Errored) for r in results):
+        return 'error'
+    elif any(isinstance(r, result.Failed) for r in results):
+        return 'failed'
+    else:
+        return 'passed'
+
+
+# Creates the check of a job, writing Specstrom's log to the file.
+MakeCheck = Callable[[Job, IO], executor.Check]
+
+
+async def run_jobs(
+    jobs: List[Job],
+    make_check: MakeCheck,
+    log_directory: str,
+    max_jobs: int = 1,
+    on_done: Callable[[JobResult], None] = lambda r: None
+) -> List[JobResult]:
+    """
+    Runs the jobs, at most `max_jobs` at a time, starting them in order.
+    Returns their results in the order they were given.
+    """
+    log = logging.getLogger('quickstrom.batch')
+    browsers = executor.SharedBrowsers()
+    queue: 'asyncio.Queue[Job]' = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+    job_results: Dict[str, JobResult] = {}
+    os.makedirs(log_directory, exist_ok=True)
+
+    async def run_job(job: Job) -> JobResult:
+        log.info("Starting %s", job.name)
+        start = time.monotonic()
+
+        def done(outcome: Outcome,
+                 results: List[result.PlainResult],
+                 message: Optional[str] = None) -> JobResult:
+            return JobResult(job, outcome, time.monotonic() - start, results,
+                             message)
+
+        ilog_path = os.path.join(log_directory,
+                                 f"{safe_file_name(job.name)}.interpreter.log")
+        try:
+            with open(ilog_path, 'w+') as ilog:
+                check = make_check(job, ilog)
+                results = await check.run(
+                    browsers.for_check(check) if check.reuse_browser else None)
+            return done(outcome_of(results), results)
+        except executor.SpecstromError as e:
+            return done('specstrom-error', [],
+                        f"{e} (see {ilog_path})")
+        except Exception as e:
+            log.exception("Job %s failed", job.name)
+            return done('error', [], str(e))
+
+    async def worker():
+        while not queue.empty():
+            job = queue.get_nowait()
+            r = await run_job(job)
+            job_results[job.name] = r
+            on_done(r)
+
+    try:
+        await asyncio.gather(*[worker() for _ in range(max_jobs)])
+    finally:
+        await asyncio.get_running_loop().run_in_executor(
+            None, browsers.close)
+    return [job_results[job.name] for job in jobs]
+
+
+def safe_file_name(name: str) -> str:
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
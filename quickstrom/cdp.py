@@ -0,0 +1,136 @@
+"""
+A minimal Chrome DevTools Protocol client over a single, persistent
+WebSocket connection.
+
+Commands are pipelined: any number of them can be in flight at once, and
+responses are matched to them as they arrive, on a reader thread of the
+client's own, so that `CdpClient` can be used from the synchronous
+WebDriver code in the executor.
+"""
+
+import concurrent.futures
+import json
+import threading
+import urllib.request
+from typing import Any, Dict
+
+import websocket
+
+
+class CdpError(Exception):
+    pass
+
+
+class CdpClient():
+    """
+    A DevTools Protocol connection to a single target, usable from any
+    thread. Use `submit` to pipeline commands.
+    """
+    def __init__(self, url: str):
+        # Chrome refuses connections with an `Origin` header that it
+        # wasn't started to allow.
+        self.socket = websocket.create_connection(url,
+                                                  enable_multithread=True,
+                                                  suppress_origin=True)
+        self.next_id = 0
+        self.pending: Dict[int, 'concurrent.futures.Future[Any]'] = {}
+        self.closed = False
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self.read_messages,
+                                       name='quickstrom-cdp',
+                                       daemon=True)
+        self.thread.start()
+
+    def submit(self, method: str,
+               **params: Any) -> 'concurrent.futures.Future[Any]':
+        result: 'concurrent.futures.Future[Any]' = concurrent.futures.Future()
+        with self._lock:
+            if self.closed:
+                raise CdpError("Connection closed")
+            self.next_id += 1
+            id = self.next_id
+            self.pending[id] = result
+        try:
+            self.socket.send(
+                json.dumps({
+                    'id': id,
+                    'method': method,
+                    'params': params
+                }))
+        except (websocket.WebSocketException, OSError) as e:
+            with self._lock:
+                self.pending.pop(id, None)
+            raise CdpError(f"Could not send {method}: {e}")
+        return result
+
+    def command(self, method: str, **params: Any) -> Any:
+        return self.submit(method, **params).result()
+
+    def evaluate(self, expression: str, await_promise: bool = False) -> Any:
+        """Evaluates a JavaScript expression in the page, returning its value."""
+        r = self.command('Runtime.evaluate',
+                         expression=expression,
+                         returnByValue=True,
+                         awaitPromise=await_promise)
+        if 'exceptionDetails' in r:
+            details = r['exceptionDetails']
+            exception = details.get('exception', {})
+            raise CdpError(
+                exception.get('description') or details.get('text'))
+        return r['result'].get('value')
+
+    def read_messages(self):
+        # Events pushed by the browser have no id, and are ignored.
+        try:
+            while True:
+                message = self.socket.recv()
+                if not message:
+                    break
+                msg = json.loads(message)
+                if 'id' not in msg:
+                    continue
+                with self._lock:
+                    result = self.pending.pop(msg['id'], None)
+                if result is None:
+                    continue
+                elif 'error' in msg:
+                    result.set_exception(
+                        CdpError(msg['error'].get('message', msg['error'])))
+                else:
+                    result.set_result(msg.get('result', {}))
+        except (websocket.WebSocketException, OSError):
+            pass
+        finally:
+            with self._lock:
+                self.closed = True
+                pending, self.pending = self.pending, {}
+            for result in pending.values():
+                result.set_exception(CdpError("Connection closed"))
+
+    def close(self, timeout: float = 5.0):
+        try:
+            self.socket.send_close()
+        except (websocket.WebSocketException, OSError):
+            pass
+        self.thread.join(timeout)
+        self.socket.shutdown()
+
+
+def page_websocket_url(debugger_address: str, window_handle: str) -> str:
+    """
+    Finds the WebSocket URL of the page shown in a WebDriver window, at a
+    DevTools endpoint. ChromeDriver's window handles are the ids of page
+    targets, in older versions prefixed with `CDwindow-`.
+    """
+    target_id = window_handle
+    if target_id.startswith('CDwindow-'):
+        target_id = target_id[len('CDwindow-'):]
+    with urllib.request.urlopen(f"http://{debugger_address}/json/list") as r:
+        targets = json.load(r)
+    for target in targets:
+        if (target.get('type') == 'page'
+                and target.get('id', '').upper() == target_id.upper()
+                and 'webSocketDebuggerUrl' in target):
+            return target['webSocketDebuggerUrl']
+    raise CdpError(
+        f"No page target for window {window_handle} at {debugger_address}")
@@ -1,15 +1,28 @@
+import asyncio
+import cProfile
+import io
 import logging
+import os
 from quickstrom.reporter import Reporter
 import click
-from typing import Tuple, cast, Dict, List, Optional
-from urllib.parse import urljoin, urlparse
+from typing import IO, Any, Tuple, cast, Dict, List, Optional
+from urllib.parse import ParseResult, urljoin, urlparse
 from pathlib import Path
+import tempfile
 
+from quickstrom.timings import PhaseTimings
+from quickstrom.tracing import Tracer
+import quickstrom.batch as batch
+import quickstrom.daemon as daemon
 import quickstrom.executor as executor
+import quickstrom.metrics as metrics
+import quickstrom.protocol as protocol
+import quickstrom.readiness as readiness
+import quickstrom.screenshots as screenshots
 import quickstrom.reporter.json as json_reporter
 import quickstrom.reporter.html as html_reporter
 import quickstrom.reporter.console as console_reporter
-from quickstrom.result import Errored, Failed, Passed
+from quickstrom.result import Errored, Failed, Passed, PlainResult
 
 
 def ordinal(n: int) -> str:
@@ -74,123 +87,491 @@ def root(ctx, color, log_level, include):
     logging.getLogger("selenium.webdriver.remote").setLevel(logging.INFO)
 
 
-@click.command()
-@click.argument('module')
-@click.argument('origin')
-@click.option('-B', '--browser', default='firefox')
-@click.option('--headless/--headful', default=True)
-@click.option('-S',
-              '--capture-screenshots/--no-capture-screenshots',
-              default=False,
-              help='capture a screenshot at each state and write to /tmp')
-@click.option('--console-report-on-success/--no-console-report-on-success',
-              default=False,
-              help='capture a screenshot at each state and write to /tmp')
-@click.option('--reporter',
-              multiple=True,
-              default=['console'],
-              help='enable a reporter by name')
-@click.option('--interpreter-log-file', default=None)
-@click.option('--driver-log-file', default=None)
-@click.option('--json-report-file', default='report.json')
-@click.option('--json-report-files-directory',
-              default='json-report-files',
-              help='directory for report assets, e.g. screenshots')
-@click.option('--html-report-directory', default='html-report')
-@click.option(
-    '--cookie',
-    multiple=True,
-    type=(str, str, str),
-    help='set a cookie based on three values, e.g. --cookie domain name value')
-def check(module: str, origin: str, browser: executor.Browser, headless: bool,
-          capture_screenshots: bool, console_report_on_success: bool,
-          reporter: List[str], interpreter_log_file: Optional[str], driver_log_file: Optional[str],
-          json_report_file: str, json_report_files_directory: str,
-          html_report_directory: str, cookie: List[Tuple[str, str, str]]):
-    """Checks the configured properties in the given module."""
+# The options of how a check runs, shared by `check`, `submit`, and
+# `check-many`.
+check_option_decorators = [
+    click.option('-B', '--browser', default='firefox'),
+    click.option('--headless/--headful', default=True),
+    click.option('-S',
+                  '--capture-screenshots/--no-capture-screenshots',
+                  default=False,
+                  help='capture a screenshot at each state and write to /tmp'),
+    click.option('--screenshot-format',
+                  default='png',
+                  type=click.Choice(screenshots.image_formats),
+                  help='image format for screenshots (webp and jpeg require Pillow)'),
+    click.option('--screenshot-quality',
+                  default=85,
+                  type=click.IntRange(1, 100),
+                  help='quality of JPEG screenshots'),
+    click.option('--screenshot-thumbnail-width',
+                  default=None,
+                  type=click.IntRange(min=1),
+                  help='also store screenshot thumbnails of this width (requires Pillow)'),
+    click.option('--driver-log-file', default=None),
+    click.option(
+        '--cookie',
+        multiple=True,
+        type=(str, str, str),
+        help='set a cookie based on three values, e.g. --cookie domain name value'),
+    click.option(
+        '--storage-state',
+        default=None,
+        type=click.Path(exists=True, dir_okay=False),
+        help='set up cookies and local/session storage from a file, as written by --save-storage-state'),
+    click.option(
+        '--save-storage-state',
+        default=None,
+        type=click.Path(dir_okay=False),
+        help='write the cookies and local/session storage after the first page load to a file'),
+    click.option(
+        '--reuse-browser/--fresh-browser',
+        default=False,
+        help='reuse browsers between sessions (resetting cookies and storage) instead of starting a new one per session'),
+    click.option(
+        '--remote-url',
+        multiple=True,
+        help='start browsers on a remote WebDriver endpoint instead of locally (repeat to spread sessions across several)'),
+    click.option(
+        '--transport',
+        default='selenium',
+        type=click.Choice(['selenium', 'cdp']),
+        help='how to talk to the browser: WebDriver requests, or a persistent DevTools Protocol connection (Chrome only)'),
+    click.option('--protocol-codec',
+                  default='auto',
+                  type=click.Choice(protocol.codec_names),
+                  help='JSON codec for talking to Specstrom (auto picks the fastest installed)'),
+    click.option(
+        '--ready-when',
+        multiple=True,
+        default=['ready-state'],
+        help='wait for the page to be ready before a session starts, as NAME[:TIMEOUT_MS] where NAME is ready-state, dom-quiescence or network-idle'),
+    click.option(
+        '--ready-predicate',
+        default=None,
+        help='wait until a JavaScript expression is truthy before a session starts'),
+    click.option('--ready-predicate-timeout',
+                  default=readiness.default_timeout,
+                  help='timeout in milliseconds for --ready-predicate'),
+]
+
+
+# The options of how the results of a check are reported, shared by
+# `check` and `submit`.
+report_option_decorators = [
+    click.option('--console-report-on-success/--no-console-report-on-success',
+                  default=False,
+                  help='capture a screenshot at each state and write to /tmp'),
+    click.option('--reporter',
+                  multiple=True,
+                  default=['console'],
+                  help='enable a reporter by name'),
+    click.option('--interpreter-log-file', default=None),
+    click.option('--json-report-file', default='report.json'),
+    click.option('--json-report-files-directory',
+                  default='json-report-files',
+                  help='directory for report assets, e.g. screenshots'),
+    click.option('--html-report-directory', default='html-report'),
+]
 
-    def reporters_by_names(names: List[str]) -> List[Reporter]:
-        all_reporters = {
-            'json':
-                json_reporter.JsonReporter(Path(json_report_file),
-                                           Path(json_report_files_directory)),
-            'html':
-                html_reporter.HtmlReporter(Path(html_report_directory)),
-            'console':
-                console_reporter.ConsoleReporter(console_report_on_success)
-        }
-        chosen_reporters = []
-        for name in names:
-            if name in all_reporters:
-                chosen_reporters.append(all_reporters[name])
-            else:
-                raise click.UsageError(f"There is no reporter called `{name}`")
-        return chosen_reporters
 
+def check_options(f):
+    for option in reversed(check_option_decorators):
+        f = option(f)
+    return f
+
+
+def report_options(f):
+    for option in reversed(report_option_decorators):
+        f = option(f)
+    return f
+
+
+def checked_origin(origin: str) -> ParseResult:
     origin_url = urlparse(urljoin("file://", origin))
     if origin_url.scheme == "file" and not Path(origin_url.path).is_file():
         print(f"File does not exist: {origin}")
         exit(1)
+    return origin_url
+
+
+def make_check(module: str,
+               origin: str,
+               options: Dict[str, Any],
+               includes: List[str],
+               ilog: IO,
+               screenshot_directory: Path,
+               working_directory: Optional[str] = None,
+               tracer: Optional[Tracer] = None) -> executor.Check:
+    """Creates a check from the options of the `check` command."""
+    try:
+        readiness_strategies = [
+            readiness.parse_strategy(s) for s in options['ready_when']
+        ]
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    if options['ready_predicate'] is not None:
+        readiness_strategies.append(
+            readiness.Predicate(options['ready_predicate'],
+                                timeout=options['ready_predicate_timeout']))
+
+    screenshot_encoding = screenshots.ImageEncoding(
+        options['screenshot_format'], options['screenshot_quality'],
+        options['screenshot_thumbnail_width'])
+    if screenshot_encoding.requires_pillow(
+    ) and not screenshots.pillow_available():
+        raise click.UsageError(
+            "Screenshot formats other than png and thumbnails require Pillow (pip install pillow)"
+        )
+
+    transport = options['transport']
+    if transport == 'cdp' and options['browser'] != 'chrome':
+        raise click.UsageError("The cdp transport requires --browser=chrome")
+    if transport == 'cdp' and options['remote_url']:
+        raise click.UsageError(
+            "The cdp transport can't be used with remote browsers")
+
+    state = executor.StorageState([
+        executor.Cookie(domain, name, value)
+        for (domain, name, value) in options['cookie']
+    ])
+    if options['storage_state'] is not None:
+        state = executor.load_storage_state(
+            options['storage_state']).merge(state)
+    return executor.Check(module,
+                          origin,
+                          options['browser'],
+                          includes,
+                          options['headless'],
+                          options['capture_screenshots'],
+                          state,
+                          interpreter_log_file=ilog,
+                          driver_log_file=options['driver_log_file'],
+                          reuse_browser=options['reuse_browser'],
+                          save_storage_state_file=options['save_storage_state'],
+                          protocol_codec=options['protocol_codec'],
+                          transport=transport,
+                          remote_urls=list(options['remote_url']),
+                          working_directory=working_directory,
+                          timings=PhaseTimings(tracer),
+                          tracer=tracer or Tracer(),
+                          readiness_strategies=readiness_strategies,
+                          screenshot_directory=screenshot_directory,
+                          screenshot_encoding=screenshot_encoding)
+
+
+def reporters_by_names(options: Dict[str, Any]) -> List[Reporter]:
+    all_reporters = {
+        'json':
+            json_reporter.JsonReporter(Path(options['json_report_file']),
+                                       Path(options['json_report_files_directory'])),
+        'html':
+            html_reporter.HtmlReporter(Path(options['html_report_directory'])),
+        'console':
+            console_reporter.ConsoleReporter(options['console_report_on_success'])
+    }
+    chosen_reporters = []
+    for name in options['reporter']:
+        if name in all_reporters:
+            chosen_reporters.append(all_reporters[name])
+        else:
+            raise click.UsageError(f"There is no reporter called `{name}`")
+    return chosen_reporters
+
+
+def report_result(result: PlainResult,
+                  chosen_reporters: List[Reporter],
+                  tracer: Optional[Tracer] = None):
+    for r in chosen_reporters:
+        with (tracer or Tracer()).span(f"report {type(r).__name__}",
+                                       'reporter'):
+            r.report(result)
+
+    click.echo("")
+
+    if isinstance(result, Passed):
+        l = len(result.passed_tests)
+        if l == 1:
+            click.echo(click.style(f"The test passed.",
+                                   fg="green"))
+        else:
+            click.echo(
+                click.style(f"All {l} tests passed.", fg="green"))
+    if isinstance(result, Failed):
+        click.echo(
+            click.style(format_after_passed_tests_str(
+                result.passed_tests,
+                f"failed with {result.failed_test.validity.certainty} {result.failed_test.validity.value}."
+            ),
+                fg="red"))
+    elif isinstance(result, Errored):
+        click.echo(
+            click.style(format_after_passed_tests_str(
+                result.passed_tests, f"errored!"),
+                fg="red"))
+
+
+def exit_on_unsuccessful(results: List[PlainResult]):
+    if any([(isinstance(r, Errored)) for r in results]):
+        exit(1)
+    elif any([(isinstance(r, Failed)) for r in results]):
+        exit(3)
+
+
+@click.command()
+@click.argument('module')
+@click.argument('origin')
+@check_options
+@report_options
+@click.option('--timings-file',
+              default=None,
+              type=click.Path(dir_okay=False),
+              help='write the durations of each phase of the check (page loads, actions, queries, etc) to a JSON file')
+@click.option('--profile',
+              'profile_file',
+              default=None,
+              type=click.Path(dir_okay=False),
+              help='trace protocol messages, WebDriver commands, scripts, screenshots and reporters to a Chrome trace event file')
+@click.option('--profile-python',
+              'profile_python_file',
+              default=None,
+              type=click.Path(dir_okay=False),
+              help='write cProfile statistics of the main thread to a file')
+@click.option('--metrics-file',
+              default=None,
+              type=click.Path(dir_okay=False),
+              help='write live metrics to a file in the OpenMetrics text format')
+@click.option('--metrics-interval',
+              default=5.0,
+              type=click.FloatRange(min=0.1),
+              help='seconds between writes of --metrics-file')
+@click.option('--metrics-port',
+              default=None,
+              type=click.IntRange(0, 65535),
+              help='serve live metrics at http://127.0.0.1:PORT/metrics')
+def check(module: str, origin: str, timings_file: Optional[str],
+          profile_file: Optional[str], profile_python_file: Optional[str],
+          metrics_file: Optional[str], metrics_interval: float,
+          metrics_port: Optional[int], **options: Any):
+    """Checks the configured properties in the given module."""
+    origin_url = checked_origin(origin)
+    chosen_reporters = reporters_by_names(options)
 
-    if interpreter_log_file is None:
-        interpreter_log_file = "interpreter.log"
+    interpreter_log_file = options['interpreter_log_file'] or "interpreter.log"
 
-    with open(str(interpreter_log_file), "w+") as ilog:
+    with open(str(interpreter_log_file), "w+") as ilog, \
+            tempfile.TemporaryDirectory(prefix='quickstrom-screenshots-') as screenshot_directory:
+        tracer = Tracer(enabled=profile_file is not None)
+        c = make_check(module,
+                       origin_url.geturl(),
+                       options,
+                       cast(List[str], global_options['includes']),
+                       ilog,
+                       Path(screenshot_directory),
+                       tracer=tracer)
+        profiler = cProfile.Profile(
+        ) if profile_python_file is not None else None
+        exporters: List[Any] = []
+        if metrics_file is not None:
+            exporters.append(
+                metrics.TextfileExporter(c.metrics, metrics_file,
+                                         metrics_interval))
+        if metrics_port is not None:
+            exporters.append(metrics.HttpExporter(c.metrics, metrics_port))
+        for exporter in exporters:
+            exporter.start()
         try:
-            cookies = [
-                executor.Cookie(domain, name, value)
-                for (domain, name, value) in cookie
-            ]
-            results = executor.Check(module,
-                                     origin_url.geturl(),
-                                     browser,
-                                     cast(List[str],
-                                          global_options['includes']),
-                                     headless,
-                                     capture_screenshots,
-                                     cookies,
-                                     interpreter_log_file=ilog,
-                                     driver_log_file=driver_log_file).execute()
-            chosen_reporters = reporters_by_names(reporter)
+            if profiler is not None:
+                profiler.enable()
+            results = c.execute()
             for result in results:
-                for r in chosen_reporters:
-                    r.report(result)
-
-                click.echo("")
-
-                if isinstance(result, Passed):
-                    l = len(result.passed_tests)
-                    if l == 1:
-                        click.echo(click.style(f"The test passed.",
-                                               fg="green"))
-                    else:
-                        click.echo(
-                            click.style(f"All {l} tests passed.", fg="green"))
-                if isinstance(result, Failed):
-                    click.echo(
-                        click.style(format_after_passed_tests_str(
-                            result.passed_tests,
-                            f"failed with {result.failed_test.validity.certainty} {result.failed_test.validity.value}."
-                        ),
-                            fg="red"))
-                elif isinstance(result, Errored):
-                    click.echo(
-                        click.style(format_after_passed_tests_str(
-                            result.passed_tests, f"errored!"),
-                            fg="red"))
-
-            if any([(isinstance(r, Errored)) for r in results]):
-                exit(1)
-            elif any([(isinstance(r, Failed)) for r in results]):
-                exit(3)
+                report_result(result, chosen_reporters, tracer)
+            if profiler is not None:
+                profiler.disable()
+            exit_on_unsuccessful(results)
             print(f"Interpreter log: {ilog.name}")
         except executor.SpecstromError as err:
             print(err)
             print(f"See interpreter log file for details: {ilog.name}")
             exit(2)
+        finally:
+            for exporter in exporters:
+                exporter.stop()
+            if timings_file is not None:
+                c.timings.save(timings_file)
+            if profile_file is not None:
+                tracer.save(profile_file)
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(profile_python_file)
+
+
+def default_socket_path() -> str:
+    try:
+        return daemon.default_socket_path()
+    except daemon.UntrustedSocket as e:
+        raise click.ClickException(str(e))
+
+
+@click.command()
+@click.option('--socket',
+              'socket_path',
+              help='path of the Unix socket to listen on '
+              '(default: quickstrom.sock in $XDG_RUNTIME_DIR, or in a private temporary directory)')
+@click.option('--max-jobs',
+              default=1,
+              type=click.IntRange(min=1),
+              help='number of checks to run at the same time')
+def serve(socket_path: Optional[str], max_jobs: int):
+    """Runs checks sent with `submit`, keeping browsers warm between them."""
+    socket_path = socket_path or default_socket_path()
+
+    def make(request: daemon.Request, ilog: IO) -> executor.Check:
+        return make_check(request['module'], request['origin'],
+                          request['options'], request['includes'], ilog,
+                          Path(request['screenshotDirectory']),
+                          request['workingDirectory'])
+
+    click.echo(f"Listening on {socket_path}")
+    try:
+        asyncio.run(daemon.Daemon(socket_path, make, max_jobs).serve())
+    except KeyboardInterrupt:
+        pass
+
+
+@click.command()
+@click.argument('module')
+@click.argument('origin')
+@click.option('--socket',
+              'socket_path',
+              help='path of the Unix socket of a running `serve` daemon '
+              '(default: the same as for `serve`)')
+@check_options
+@report_options
+def submit(module: str, origin: str, socket_path: Optional[str],
+           **options: Any):
+    """Checks the given module in a running `serve` daemon."""
+    socket_path = socket_path or default_socket_path()
+    origin_url = checked_origin(origin)
+    chosen_reporters = reporters_by_names(options)
+
+    # The daemon runs in another directory, so paths are made absolute.
+    for path_option in ['storage_state', 'save_storage_state', 'driver_log_file']:
+        if options[path_option] is not None:
+            options[path_option] = os.path.abspath(options[path_option])
+    interpreter_log_file = os.path.abspath(options['interpreter_log_file']
+                                           or "interpreter.log")
+
+    with tempfile.TemporaryDirectory(
+            prefix='quickstrom-screenshots-') as screenshot_directory:
+        request = {
+            'module': module,
+            'origin': origin_url.geturl(),
+            'includes': list(cast(List[str], global_options['includes'])),
+            'options': options,
+            'workingDirectory': os.getcwd(),
+            'interpreterLogFile': interpreter_log_file,
+            'screenshotDirectory': screenshot_directory,
+        }
+        results: List[PlainResult] = []
+        try:
+            for response in daemon.submit(socket_path, request):
+                if response['tag'] == 'result':
+                    result = daemon.decode_result(response['result'])
+                    report_result(result, chosen_reporters)
+                    results.append(result)
+                elif response['tag'] == 'specstromError':
+                    print(response['message'])
+                    print(
+                        f"See interpreter log file for details: {interpreter_log_file}"
+                    )
+                    exit(2)
+                elif response['tag'] == 'error':
+                    raise click.ClickException(response['message'])
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise click.ClickException(
+                f"No daemon is listening on {socket_path}, start one with `quickstrom serve`"
+            )
+        except daemon.UntrustedSocket as e:
+            raise click.ClickException(str(e))
+        exit_on_unsuccessful(results)
+        print(f"Interpreter log: {interpreter_log_file}")
+
+
+@click.command(name='check-many')
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('-j',
+              '--jobs',
+              default=1,
+              type=click.IntRange(min=1),
+              help='number of checks to run at the same time')
+@click.option('--durations-file',
+              default='quickstrom-durations.json',
+              help='file of job durations, used to start the longest jobs first and updated after the run')
+@click.option('--log-directory',
+              default='quickstrom-logs',
+              help='directory for the interpreter log of each job')
+@check_options
+def check_many(manifest: str, jobs: int, durations_file: str,
+               log_directory: str, **options: Any):
+    """Checks all jobs in a manifest, comparing with their expected results."""
+    try:
+        all_jobs = batch.load_manifest(manifest)
+    except (ValueError, KeyError) as e:
+        raise click.UsageError(f"Invalid manifest: {e}")
+    for job in all_jobs:
+        origin_url = urlparse(urljoin("file://", job.origin))
+        if origin_url.scheme == "file" and not Path(origin_url.path).is_file():
+            raise click.UsageError(
+                f"File does not exist for job {job.name}: {job.origin}")
+    scheduled = batch.schedule(all_jobs,
+                               batch.load_durations(durations_file))
+
+    def on_done(r: batch.JobResult):
+        line = f"{r.job.name}: {r.outcome} in {r.duration:.1f}s"
+        if r.is_expected():
+            click.echo(click.style(line, fg="green"))
+        else:
+            click.echo(
+                click.style(f"{line}, expected {r.job.expected}", fg="red"))
+        if r.message is not None:
+            click.echo(f"  {r.message}")
+
+    with tempfile.TemporaryDirectory(
+            prefix='quickstrom-screenshots-') as screenshot_directory:
+
+        def make(job: batch.Job, ilog: IO) -> executor.Check:
+            return make_check(job.module, urljoin("file://", job.origin),
+                              options,
+                              cast(List[str], global_options['includes']),
+                              ilog, Path(screenshot_directory))
+
+        # Checks are made once up front, so that invalid options stop the
+        # run before any job starts instead of failing every job.
+        for job in scheduled:
+            make(job, io.StringIO())
+
+        job_results = asyncio.run(
+            batch.run_jobs(scheduled, make, log_directory, jobs, on_done))
+
+    batch.save_durations(durations_file, job_results)
+    unexpected = [r.job.name for r in job_results if not r.is_expected()]
+    click.echo("")
+    click.echo(
+        f"{len(job_results) - len(unexpected)} of {len(job_results)} jobs had their expected results."
+    )
+    click.echo(f"Interpreter logs: {log_directory}")
+    if unexpected:
+        click.echo(
+            click.style(f"Unexpected results: {', '.join(unexpected)}",
+                        fg="red"))
+        exit(1)
 
 
 root.add_command(check)
+root.add_command(check_many)
+root.add_command(serve)
+root.add_command(submit)
 
 
 def run():
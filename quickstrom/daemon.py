@@ -0,0 +1,235 @@
+"""
+A long-running process that runs checks sent to it over a Unix socket,
+keeping browsers warm between them.
+
+Each connection carries one job: the client sends a request frame, and
+once the check has finished, the daemon answers with a frame per result,
+followed by a final frame. Frames are length-prefixed JSON, and results
+are encoded like in JSON reports.
+
+The socket is created in a directory only accessible to the user running
+the daemon, and the client refuses to connect to a socket owned by
+another user.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import stat
+import tempfile
+from pathlib import Path
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional
+
+import quickstrom.executor as executor
+import quickstrom.protocol as protocol
+import quickstrom.result as result
+import quickstrom.reporter.json as json_reporter
+
+Request = Dict[str, Any]
+
+# Creates a check from a request, writing Specstrom's log to the file.
+MakeCheck = Callable[[Request, IO], executor.Check]
+
+
+class UntrustedSocket(Exception):
+    pass
+
+
+def default_socket_path() -> str:
+    """
+    The socket in the user's runtime directory, or else in a private
+    directory in the temporary directory, which is created if needed.
+    """
+    runtime_directory = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_directory:
+        return os.path.join(runtime_directory, 'quickstrom.sock')
+    directory = os.path.join(tempfile.gettempdir(),
+                             f"quickstrom-{os.getuid()}")
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(directory)
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid()
+            or st.st_mode & 0o077):
+        raise UntrustedSocket(
+            f"{directory} must be a directory only accessible to you")
+    return os.path.join(directory, 'quickstrom.sock')
+
+
+def check_socket_owner(socket_path: str):
+    st = os.stat(socket_path)
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        raise UntrustedSocket(f"{socket_path} is not a socket owned by you")
+
+
+class _ResultEncoder(json_reporter._ReporterEncoder):
+    """Encodes results like the JSON reporter, with stored images and digests."""
+    def default(self, o: Any):
+        if isinstance(o, result.State):
+            encoded = super().default(o)
+            encoded['elementDigests'] = o.element_digests
+            return encoded
+        elif isinstance(o, result.StoredImage):
+            return {'path': str(o.path), 'digest': o.digest}
+        else:
+            return super().default(o)
+
+
+def encode_result(r: result.PlainResult) -> str:
+    return json.dumps(r, cls=_ResultEncoder)
+
+
+def decode_result(data: str) -> result.PlainResult:
+    def image(obj: Dict[str, Any]) -> result.StoredImage:
+        return result.StoredImage(Path(obj['path']), obj['digest'])
+
+    def screenshot(
+            obj: Dict[str, Any]) -> result.Screenshot[result.StoredImage]:
+        return result.Screenshot(
+            image(obj['url']), obj['width'], obj['height'], obj['scale'],
+            image(obj['thumbnailUrl'])
+            if obj['thumbnailUrl'] is not None else None)
+
+    def state(obj: Optional[Dict[str, Any]]) -> Any:
+        if obj is None:
+            return None
+        return result.State(
+            obj['hash'], obj['queries'],
+            screenshot(obj['screenshot'])
+            if obj['screenshot'] is not None else None,
+            obj['elementDigests'])
+
+    def actions(objs: List[Dict[str, Any]]) -> List[protocol.Action]:
+        return [
+            protocol.Action(a['id'], a['args'], a['isEvent'], a['timeout'])
+            for a in objs
+        ]
+
+    def transition(obj: Dict[str, Any]) -> result.Transition:
+        if obj['tag'] == 'StateTransition':
+            return result.StateTransition(state(obj['fromState']),
+                                          state(obj['toState']),
+                                          actions(obj['actions']))
+        elif obj['tag'] == 'ErrorTransition':
+            return result.ErrorTransition(state(obj['fromState']),
+                                          actions(obj['actions']),
+                                          obj['error'])
+        else:
+            raise TypeError(f"Unknown transition: {obj['tag']}")
+
+    def test(obj: Dict[str, Any]) -> result.Test:
+        validity = obj['validity']
+        return result.Test(
+            protocol.Validity(validity['certainty'], validity['value']),
+            [transition(t) for t in obj['transitions']])
+
+    obj = json.loads(data)
+    passed = [test(t) for t in obj['passedTests']]
+    if obj['tag'] == 'Passed':
+        return result.Passed(passed)
+    elif obj['tag'] == 'Failed':
+        return result.Failed(passed, test(obj['failedTest']))
+    elif obj['tag'] == 'Errored':
+        return result.Errored(passed, test(obj['erroredTest']))
+    else:
+        raise TypeError(f"Unknown result: {obj['tag']}")
+
+
+class Daemon(object):
+    def __init__(self,
+                 socket_path: str,
+                 make_check: MakeCheck,
+                 max_jobs: int = 1,
+                 codec: Optional[protocol.Codec] = None):
+        self.socket_path = socket_path
+        self.make_check = make_check
+        self.max_jobs = max_jobs
+        self.codec = codec or protocol.codec_by_name()
+        self.browsers = executor.SharedBrowsers()
+        self.log = logging.getLogger('quickstrom.daemon')
+
+    async def serve(self):
+        self.jobs = asyncio.Semaphore(self.max_jobs)
+        # The socket is only accessible to this user from the start.
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self.handle,
+                                                     path=self.socket_path)
+        finally:
+            os.umask(umask)
+        self.log.info("Listening on %s", self.socket_path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.close)
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter):
+        responses = protocol.AsyncMessageWriter(writer, self.codec,
+                                                'length-prefixed')
+        try:
+            request = await protocol.AsyncMessageReader(
+                reader, self.codec, 'length-prefixed').read_frame()
+            if request is None:
+                return
+            async with self.jobs:
+                await self.run_job(request, responses)
+        except ConnectionError as e:
+            self.log.warning("Client went away: %s", e)
+        finally:
+            writer.close()
+
+    async def run_job(self, request: Request,
+                      responses: protocol.AsyncMessageWriter):
+        self.log.info("Checking %s at %s", request['module'],
+                      request['origin'])
+        try:
+            with open(request['interpreterLogFile'], 'w+') as ilog:
+                check = self.make_check(request, ilog)
+                results = await check.run(
+                    self.browsers.for_check(check) if check.
+                    reuse_browser else None)
+        except executor.SpecstromError as e:
+            await responses.write_frame({
+                'tag': 'specstromError',
+                'message': str(e)
+            })
+            return
+        except Exception as e:
+            self.log.exception("Job failed")
+            await responses.write_frame({'tag': 'error', 'message': str(e)})
+            return
+        for r in results:
+            await responses.write_frame({
+                'tag': 'result',
+                'result': encode_result(r)
+            })
+        await responses.write_frame({'tag': 'done'})
+
+    def close(self):
+        self.browsers.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def submit(socket_path: str,
+           request: Request,
+           codec: Optional[protocol.Codec] = None) -> Iterator[Dict[str, Any]]:
+    """Sends a job to a daemon, yielding its responses as they arrive."""
+    codec = codec or protocol.codec_by_name()
+    check_socket_owner(socket_path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile('rwb') as f:
+            protocol.MessageWriter(f, codec,
+                                   'length-prefixed').write_frame(request)
+            responses = protocol.MessageReader(f, codec, 'length-prefixed')
+            response = responses.read_frame()
+            while response is not None:
+                yield response
+                response = responses.read_frame()
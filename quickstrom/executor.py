@@ -1,31 +1,46 @@
-from ast import Await
+import asyncio
+import atexit
 import dataclasses
-import io
-import subprocess
+import functools
+import json
 import logging
+import shutil
 import threading
 import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from shutil import which
 from dataclasses import dataclass
-import png
-from typing import List, Tuple, Union, Literal, Any, AnyStr
+from typing import List, Tuple, TypeVar, Union, Literal, Any, AnyStr
 from selenium import webdriver
-from selenium.common.exceptions import StaleElementReferenceException
-from selenium.webdriver.common.action_chains import ActionChains
+from selenium.common.exceptions import (JavascriptException,
+                                        StaleElementReferenceException,
+                                        TimeoutException, WebDriverException)
 from selenium.webdriver.remote.webdriver import WebDriver
-from selenium.webdriver.remote.webelement import WebElement
 import selenium.webdriver.chrome.options as chrome_options
 import selenium.webdriver.firefox.options as firefox_options
 from selenium.webdriver.firefox.firefox_binary import FirefoxBinary
 
 from quickstrom.protocol import *
-from quickstrom.hash import dict_hash
+from quickstrom.hash import StateHasher
+from quickstrom.metrics import Metrics
 import quickstrom.result as result
 import quickstrom.printer as printer
+import quickstrom.readiness as readiness
+from quickstrom.remote import EndpointPool
+from quickstrom.screenshots import ImageEncoding, ScreenshotStore
+from quickstrom.timings import PhaseTimings
+from quickstrom.tracing import Tracer, trace_commands
+from quickstrom.transport import (Transport, Transports, bundle_call_script,
+                                  connect_transport, not_installed)
 import os
+from pathlib import Path
+import tempfile
 
 Url = str
 
+T = TypeVar('T')
+
 
 @dataclass
 class SpecstromError(Exception):
@@ -73,13 +88,18 @@ class ClientSideEvents():
 @dataclass
 class Scripts():
     query_state: Callable[[WebDriver, Dict[Selector, Schema]], State]
-    install_event_listener: Callable[[WebDriver, Dict[Selector, Schema]], None]
+    observe: Callable[[WebDriver, Dict[Selector, Schema]], State]
     await_events: Callable[[WebDriver, Dict[Selector, Schema], int],
                            Optional[ClientSideEvents]]
+    await_ready: Callable[[WebDriver, JsonLike], bool]
 
 
 Browser = Union[Literal['chrome'], Literal['firefox']]
 
+# The largest message expected from Specstrom. States are sent back in
+# traces, so a `Done` message can be large.
+specstrom_message_limit = 1024 * 1024 * 1024
+
 
 @dataclass
 class Cookie():
@@ -88,6 +108,129 @@ class Cookie():
     value: str
 
 
+@dataclass
+class StorageState():
+    """Cookies and web storage to set up before a session starts."""
+    cookies: List[Cookie]
+    local_storage: Dict[str, str] = dataclasses.field(default_factory=dict)
+    session_storage: Dict[str, str] = dataclasses.field(default_factory=dict)
+
+    def is_empty(self) -> bool:
+        return (len(self.cookies) == 0 and len(self.local_storage) == 0
+                and len(self.session_storage) == 0)
+
+    def merge(self, other: 'StorageState') -> 'StorageState':
+        return StorageState(self.cookies + other.cookies, {
+            **self.local_storage,
+            **other.local_storage
+        }, {
+            **self.session_storage,
+            **other.session_storage
+        })
+
+
+def load_storage_state(path: str) -> StorageState:
+    with open(path) as f:
+        obj = json.load(f)
+    return StorageState(
+        cookies=[
+            Cookie(c['domain'], c['name'], c['value'])
+            for c in obj.get('cookies', [])
+        ],
+        local_storage=obj.get('localStorage', {}),
+        session_storage=obj.get('sessionStorage', {}),
+    )
+
+
+def save_storage_state(state: StorageState, path: str):
+    with open(path, 'w') as f:
+        json.dump(
+            {
+                'cookies': [dataclasses.asdict(c) for c in state.cookies],
+                'localStorage': state.local_storage,
+                'sessionStorage': state.session_storage,
+            },
+            f,
+            indent=2)
+
+
+def capture_storage_state(driver: WebDriver) -> StorageState:
+    storage = driver.execute_script(
+        "return [Object.assign({}, window.localStorage), Object.assign({}, window.sessionStorage)];"
+    )
+    return StorageState(
+        [Cookie(c['domain'], c['name'], c['value'])
+         for c in driver.get_cookies()], storage[0], storage[1])
+
+
+_set_storage_script = """
+var state = arguments[0];
+Object.entries(state.localStorage).forEach(function (e) { window.localStorage.setItem(e[0], e[1]); });
+Object.entries(state.sessionStorage).forEach(function (e) { window.sessionStorage.setItem(e[0], e[1]); });
+"""
+
+
+def restore_storage_state(driver: WebDriver, state: StorageState):
+    """Sets the state in the browser, which must be at a page on the origin."""
+    for cookie in state.cookies:
+        driver.add_cookie(dataclasses.asdict(cookie))
+    driver.execute_script(_set_storage_script, {
+        'localStorage': state.local_storage,
+        'sessionStorage': state.session_storage
+    })
+
+
+def navigate_with_storage_state(driver: WebDriver, origin: Url,
+                                state: StorageState):
+    """
+    Navigates a fresh browser to the origin with the state set up before
+    the page loads. Local Chromium drivers can do this through the
+    DevTools protocol in a single navigation, setting storage in the top
+    frame only. Other browsers, including remote Chromium sessions, visit
+    the origin twice, as WebDriver can only set state on a loaded page.
+    """
+    if hasattr(driver, 'execute_cdp_cmd'):
+        for cookie in state.cookies:
+            driver.execute_cdp_cmd('Network.setCookie', {
+                **dataclasses.asdict(cookie), 'url': origin
+            })
+        script = driver.execute_cdp_cmd(
+            'Page.addScriptToEvaluateOnNewDocument', {
+                'source':
+                f"if (window.top === window) {{ (function () {{ {_set_storage_script} }}).call(null, {json.dumps({'localStorage': state.local_storage, 'sessionStorage': state.session_storage})}); }}"
+            })
+        try:
+            driver.get(origin)
+        finally:
+            driver.execute_cdp_cmd('Page.removeScriptToEvaluateOnNewDocument',
+                                   {'identifier': script['identifier']})
+    else:
+        driver.get(origin)
+        restore_storage_state(driver, state)
+        driver.get(origin)
+
+
+# How many browsers a session is started in before giving up.
+session_start_attempts = 2
+
+
+def browser_failed(e: Exception) -> bool:
+    """
+    Whether an error is a failure of the browser or its WebDriver
+    endpoint, rather than an error in the page or the specification.
+    """
+    return isinstance(e, WebDriverException) and not isinstance(
+        e, (StaleElementReferenceException, JavascriptException,
+            TimeoutException))
+
+
+def temporary_screenshot_directory() -> Path:
+    """A directory for screenshots, removed when the process exits."""
+    directory = tempfile.mkdtemp(prefix='quickstrom-screenshots-')
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    return Path(directory)
+
+
 @dataclass
 class Check():
     module: str
@@ -96,238 +239,415 @@ class Check():
     include_paths: List[str]
     headless: bool
     capture_screenshots: bool
-    cookies: List[Cookie]
+    storage_state: StorageState
     driver_log_file: Optional[str]
     interpreter_log_file: IO
+    reuse_browser: bool = False
+    save_storage_state_file: Optional[str] = None
+    screenshot_directory: Optional[Path] = None
+    screenshot_encoding: ImageEncoding = ImageEncoding()
+    protocol_codec: str = 'auto'
+    transport: Transport = 'selenium'
+    remote_urls: List[str] = dataclasses.field(default_factory=list)
+    working_directory: Optional[str] = None
+    readiness_strategies: List[readiness.Strategy] = dataclasses.field(
+        default_factory=lambda: list(readiness.default_strategies))
+    timings: PhaseTimings = dataclasses.field(default_factory=PhaseTimings)
+    tracer: Tracer = dataclasses.field(default_factory=Tracer)
+    metrics: Metrics = dataclasses.field(default_factory=Metrics)
     log: logging.Logger = logging.getLogger('quickstrom.executor')
 
     def execute(self) -> List[result.PlainResult]:
-        scripts = self.load_scripts()
-
-        with self.launch_specstrom(self.interpreter_log_file) as p:
-            assert p.stdout is not None
-            assert p.stdin is not None
-            input_messages = message_reader(p.stdout)
-            output_messages = message_writer(p.stdin)
-            screenshots: Dict[str, result.Screenshot[bytes]] = {}
-
-            def receive():
-                msg = input_messages.read()
-                exit_code = p.poll()
-                if msg is None and exit_code is not None:
-                    if exit_code == 0:
-                        return None
-                    else:
-                        raise SpecstromError("Specstrom invocation failed",
-                                             exit_code,
-                                             self.interpreter_log_file.name)
+        return asyncio.run(self.run())
+
+    def browsers(self, shared: bool = False) -> 'Browsers':
+        """
+        Creates the browsers for this check. Shared browsers are always
+        reused between sessions, and can be used by any check with the same
+        `browsers_key`.
+        """
+        transports = Transports(
+            lambda driver: connect_transport(driver, self.transport))
+        endpoints = EndpointPool(
+            self.remote_urls,
+            self.new_remote_driver) if self.remote_urls else None
+
+        def new_driver() -> WebDriver:
+            driver = endpoints.new_driver(
+            ) if endpoints is not None else self.new_driver()
+            trace_commands(driver, self.tracer)
+            return driver
+
+        def dispose(driver: WebDriver, failed: bool):
+            transports.close(driver)
+            if endpoints is not None:
+                endpoints.released(driver, failed)
+
+        pool = DriverPool(new_driver,
+                          reuse=shared or self.reuse_browser,
+                          dispose=dispose)
+        return Browsers(pool, transports)
+
+    def browsers_key(self) -> Tuple[Any, ...]:
+        return (self.browser, self.headless, self.transport,
+                tuple(self.remote_urls), self.driver_log_file)
+
+    async def run(self,
+                  browsers: Optional['Browsers'] = None
+                  ) -> List[result.PlainResult]:
+        """
+        Runs the check. Browsers passed in are left open afterwards, so
+        that they can be used again.
+        """
+        owned = browsers is None
+        if browsers is None:
+            browsers = self.browsers()
+        pool, transports = browsers.pool, browsers.transports
+        scripts = self.load_scripts(transports)
+        storage_state_saved = threading.Event()
+        # Screenshots are spilled to disk as they're captured. They must
+        # outlive this check, as reporters read them from the store.
+        screenshots = ScreenshotStore(
+            self.screenshot_directory or temporary_screenshot_directory(),
+            self.screenshot_encoding) if self.capture_screenshots else None
+
+        try:
+            with self.timings.measure('check'):
+                return await self.run_specstrom(scripts, transports, pool,
+                                                storage_state_saved,
+                                                screenshots)
+        finally:
+            if owned:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, pool.close)
+            if screenshots is not None:
+                screenshots.close()
+
+    async def run_specstrom(
+            self, scripts: Scripts, transports: Transports,
+            pool: 'DriverPool', storage_state_saved: threading.Event,
+            screenshots: Optional[ScreenshotStore]
+    ) -> List[result.PlainResult]:
+        p = await self.launch_specstrom(self.interpreter_log_file)
+        assert p.stdout is not None
+        assert p.stdin is not None
+        codec = codec_by_name(self.protocol_codec)
+        input_messages = AsyncMessageReader(p.stdout, codec, 'lines')
+        output_messages = AsyncMessageWriter(p.stdin, codec, 'lines')
+        window_sizes: 'weakref.WeakKeyDictionary[WebDriver, Tuple[int, int]]' = weakref.WeakKeyDictionary(
+        )
+        loop = asyncio.get_running_loop()
+        # WebDriver calls block, so they're made on a thread of this
+        # worker's own, one at a time and in order, while the event loop
+        # keeps reading from Specstrom.
+        session_thread = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='quickstrom-session')
+
+        def call(f: Callable[..., T], *args: Any) -> 'asyncio.Future[T]':
+            return loop.run_in_executor(session_thread,
+                                        functools.partial(f, *args))
+
+        timings = self.timings
+        tracer = self.tracer
+        metrics = self.metrics
+
+        async def receive():
+            start = tracer.now()
+            msg = await input_messages.read()
+            timings.record('specstrom', tracer.now() - start)
+            tracer.complete(
+                f"receive {type(msg).__name__}"
+                if msg is not None else "receive end", 'protocol', start)
+            if msg is None:
+                exit_code = await p.wait()
+                if exit_code == 0:
+                    return None
                 else:
-                    self.log.debug("Received %s", msg)
-                    return msg
-
-            def send(msg):
-                if p.poll() is None:
-                    self.log.debug("Sending %s", msg)
-                    output_messages.write(msg)
+                    raise SpecstromError("Specstrom invocation failed",
+                                         exit_code,
+                                         self.interpreter_log_file.name)
+            else:
+                self.log.debug("Received %s", msg)
+                return msg
+
+        async def send(msg):
+            if p.returncode is None:
+                self.log.debug("Sending %s", msg)
+                with tracer.span(f"send {type(msg).__name__}", 'protocol'):
+                    await output_messages.write(msg)
+            else:
+                self.log.warning("Done, can't send.")
+
+        @timings.timed('action')
+        def perform_action(driver, action):
+            transport = transports.get(driver)
+            start = time.perf_counter()
+            try:
+                if action.id == 'noop':
+                    pass
+                elif action.id == 'click':
+                    transport.click(action.args[0])
+                elif action.id == 'doubleClick':
+                    transport.double_click(action.args[0])
+                elif action.id == 'focus':
+                    transport.focus(action.args[0])
+                elif action.id == 'keyPress':
+                    transport.send_keys(action.args[0])
+                elif action.id == 'enterText':
+                    transport.send_keys(action.args[0])
+                elif action.id == 'enterTextInto':
+                    transport.send_keys_to(action.args[1], action.args[0])
+                elif action.id == 'clear':
+                    transport.clear(action.args[0])
                 else:
-                    self.log.warning("Done, can't send.")
-
-            def perform_action(driver, action):
-                try:
-                    if action.id == 'noop':
-                        pass
-                    elif action.id == 'click':
-                        id = action.args[0]
-                        element = WebElement(driver, id)
-                        ActionChains(driver).move_to_element(element).click(
-                            element).perform()
-                    elif action.id == 'doubleClick':
-                        id = action.args[0]
-                        element = WebElement(driver, id)
-                        ActionChains(driver).move_to_element(
-                            element).double_click(element).perform()
-                    elif action.id == 'focus':
-                        id = action.args[0]
-                        element = WebElement(driver, id)
-                        element.send_keys("")
-                    elif action.id == 'keyPress':
-                        char = action.args[0]
-                        element = driver.switch_to.active_element
-                        element.send_keys(char)
-                    elif action.id == 'enterText':
-                        element = driver.switch_to.active_element
-                        element.send_keys(action.args[0])
-                    elif action.id == 'enterTextInto':
-                        id = action.args[1]
-                        element = WebElement(driver, id)
-                        element.send_keys(action.args[0])
-                    elif action.id == 'clear':
-                        id = action.args[0]
-                        element = WebElement(driver, id)
-                        element.clear()
-                    else:
-                        raise UnsupportedActionError(action)
-                except Exception as e:
-                    raise PerformActionError(action, e)
-
-            def screenshot(driver: WebDriver, hash: str):
-                if self.capture_screenshots:
-                    bs: bytes = driver.get_screenshot_as_png(
-                    )    # type: ignore
-                    (width, height, _, _) = png.Reader(io.BytesIO(bs)).read()
-                    window_size = driver.get_window_size()
-                    scale = round(width / window_size['width'])
-                    if scale != round(height / window_size['height']):
-                        self.log.warn(
-                            "Width and height scales do not match for screenshot"
-                        )
-                    screenshots[hash] = result.Screenshot(image=bs,
-                                                          width=width,
-                                                          height=height,
-                                                          scale=scale)
-
-            def attach_screenshots(
-                    r: result.PlainResult) -> result.PlainResult:
-                def on_state(state):
-                    return result.State(screenshot=screenshots.get(
-                        state.hash, None),
-                                        queries=state.queries,
-                                        hash=state.hash)
-
-                return result.map_states(r, on_state)
-
-            def await_events(driver, deps, state_version, timeout: int):
-                def on_no_events():
-                    state = scripts.query_state(driver, deps)
-                    screenshot(driver, dict_hash(state))
+                    raise UnsupportedActionError(action)
+            except Exception as e:
+                raise PerformActionError(action, e)
+            metrics.actions.inc()
+            metrics.action_seconds.observe(time.perf_counter() - start)
+
+        hasher = StateHasher()
+
+        # Screenshots are taken right after a state is queried and before
+        # it is sent, so that they show that state and not a later one.
+        def screenshot(driver: WebDriver, state: State):
+            if screenshots is None:
+                return
+            hash = hasher.digests(state).state
+            if screenshots.should_capture(hash):
+                with timings.measure('screenshot'):
+                    bs = transports.get(driver).screenshot()
+                    metrics.screenshot_bytes.observe(len(bs))
+                    window_size = window_sizes.get(driver)
+                    if window_size is None:
+                        size = driver.get_window_size()
+                        window_size = (size['width'], size['height'])
+                        window_sizes[driver] = window_size
+                    screenshots.add(hash, bs, window_size)
+
+        def attach_screenshots(r: result.PlainResult) -> result.PlainResult:
+            if screenshots is None:
+                return r
+
+            def on_state(state):
+                return dataclasses.replace(
+                    state, screenshot=screenshots.get(state.hash))
+
+            return result.map_states(r, on_state)
+
+        def observe_state(state: State):
+            metrics.state_elements.observe(
+                sum(len(elements) for elements in state.values()))
+
+        query_state = timings.timed('query')(scripts.query_state)
+        observe = timings.timed('query')(scripts.observe)
+        await_client_events = timings.timed('await-events')(
+            scripts.await_events)
+
+        async def await_events(driver, deps, state_version, timeout: int):
+            async def on_no_events():
+                state = await call(query_state, driver, deps)
+                await call(screenshot, driver, state)
+                state_version.increment()
+                await send(Timeout(state=state))
+                observe_state(state)
+
+            try:
+                self.log.debug(f"Awaiting events with timeout {timeout}")
+                events = await call(await_client_events, driver, deps,
+                                    timeout)
+                self.log.debug(f"Change: {events}")
+
+                if events is None:
+                    self.log.info(f"Timed out!")
+                    metrics.event_timeouts.inc()
+                    await on_no_events()
+                else:
+                    await call(screenshot, driver, events.state)
                     state_version.increment()
-                    send(Timeout(state=state))
-
+                    await send(Events(events.events, events.state))
+                    observe_state(events.state)
+            except StaleElementReferenceException as e:
+                self.log.error(f"Stale element reference: {e}")
+                await on_no_events()
+
+        def await_ready(driver: WebDriver):
+            for strategy in self.readiness_strategies:
+                start = time.perf_counter()
+                if scripts.await_ready(driver, readiness.to_json(strategy)):
+                    self.log.debug("Ready according to %s after %.3fs",
+                                   strategy,
+                                   time.perf_counter() - start)
+                else:
+                    self.log.warning(
+                        f"Timed out waiting for readiness: {strategy}")
+
+        def acquire_driver() -> WebDriver:
+            start = time.perf_counter()
+            driver, reused = pool.acquire()
+            timings.record('driver-reuse' if reused else 'driver-start',
+                           time.perf_counter() - start)
+            return driver
+
+        release_driver = timings.timed('driver-release')(pool.release)
+
+        @timings.timed('page-load')
+        def start_session(driver: WebDriver):
+            driver.set_window_size(1200, 1200)
+            window_sizes.pop(driver, None)
+
+            # Reused browsers are reset to `about:blank`, so they get the
+            # storage state set up here like fresh ones.
+            if self.storage_state.is_empty():
+                driver.get(self.origin)
+            else:
+                self.log.debug(f"Setting {self.storage_state}")
+                navigate_with_storage_state(driver, self.origin,
+                                            self.storage_state)
+            await_ready(driver)
+
+            if self.save_storage_state_file is not None and not storage_state_saved.is_set(
+            ):
+                storage_state_saved.set()
+                save_storage_state(capture_storage_state(driver),
+                                   self.save_storage_state_file)
+
+        def acquire_started_driver() -> WebDriver:
+            """
+            Acquires a browser with the origin loaded. A browser failing to
+            load it is released as failed, and the session is started once
+            more in another browser, e.g. on another remote endpoint. Once
+            started, a session can't be moved, as Specstrom can't replay it.
+            """
+            attempts = 0
+            while True:
+                attempts += 1
+                driver = acquire_driver()
                 try:
-                    self.log.debug(f"Awaiting events with timeout {timeout}")
-                    events = scripts.await_events(driver, deps, timeout)
-                    self.log.debug(f"Change: {events}")
-
-                    if events is None:
-                        self.log.info(f"Timed out!")
-                        on_no_events()
-                    else:
-                        screenshot(driver, dict_hash(events.state))
-                        state_version.increment()
-                        send(Events(events.events, events.state))
-                except StaleElementReferenceException as e:
-                    self.log.error(f"Stale element reference: {e}")
-                    on_no_events()
-
-            def run_sessions() -> List[result.PlainResult]:
-                while True:
-                    msg = receive()
-                    assert msg is not None
-                    if isinstance(msg, Start):
+                    start_session(driver)
+                    return driver
+                except Exception as e:
+                    failed = browser_failed(e)
+                    release_driver(driver, failed)
+                    if not failed or attempts == session_start_attempts:
+                        raise
+                    self.log.warning(
+                        "Could not start session, retrying in another browser: %s",
+                        e)
+
+        async def run_sessions() -> List[result.PlainResult]:
+            while True:
+                msg = await receive()
+                assert msg is not None
+                if isinstance(msg, Start):
+                    try:
+                        self.log.info("Starting session")
+                        driver = await call(acquire_started_driver)
+                        failed = False
                         try:
-                            self.log.info("Starting session")
-                            driver = self.new_driver()
-                            driver.set_window_size(1200, 1200)
-
-                            if len(self.cookies) > 0:
-                                # First we need to visit the page in order to set cookies.
-                                driver.get(self.origin)
-                                for cookie in self.cookies:
-                                    self.log.debug(f"Setting {cookie}")
-                                    driver.add_cookie(dataclasses.asdict(cookie))
-                            # Now that cookies are set, we have to visit the origin again.
-                            driver.get(self.origin)
-                            # Hacky sleep to allow page load.
-                            time.sleep(1)
+                            metrics.sessions_started.inc()
 
                             state_version = Counter(initial_value=0)
 
-                            scripts.install_event_listener(
-                                driver, msg.dependencies)
-                            await_events(driver, msg.dependencies, state_version, 10000)
+                            await await_events(driver, msg.dependencies,
+                                               state_version, 10000)
 
-                            await_session_commands(driver, msg.dependencies,
-                                                   state_version)
+                            await await_session_commands(
+                                driver, msg.dependencies, state_version)
                         except Exception as e:
-                            send(Error(str(e)))
-                    elif isinstance(msg, Done):
-                        return [
-                            attach_screenshots(result.from_protocol_result(r))
-                            for r in msg.results
-                        ]
-                    elif isinstance(msg, AwaitEvents):
-                        raise Exception(f"AwaitEvents in run_sessions: {msg}")
-
-            def await_session_commands(driver: WebDriver, deps, state_version):
-                try:
-                    while True:
-                        msg = receive()
-
-                        if not msg:
-                            raise Exception(
-                                "No more messages from Specstrom, expected RequestAction or End."
-                            )
-                        elif isinstance(msg, RequestAction):
-                            if msg.version == state_version.value:
-                                self.log.info(
-                                    f"Performing action in state {state_version.value}: {printer.pretty_print_action(msg.action)}"
-                                )
-
-                                perform_action(driver, msg.action)
-
-                                if msg.action.timeout is not None:
-                                    self.log.debug(
-                                        "Installing change observer")
-                                    scripts.install_event_listener(
-                                        driver, deps)
-
-                                state = scripts.query_state(driver, deps)
-                                screenshot(driver, dict_hash(state))
-                                state_version.increment()
-                                send(Performed(state=state))
-
-                                if msg.action.timeout is not None:
-                                    await_events(driver, deps, state_version,
-                                                 msg.action.timeout)
-                            else:
-                                self.log.warn(
-                                    f"Got stale message ({msg}) in state {state_version.value}"
-                                )
-                                send(Stale())
-                        elif isinstance(msg, AwaitEvents):
-                            if msg.version == state_version.value:
-                                self.log.info(
-                                    f"Awaiting events in state {state_version.value} with timeout {msg.await_timeout}"
-                                )
-                                scripts.install_event_listener(driver, deps)
-                                await_events(driver, deps, state_version,
-                                             msg.await_timeout)
-                            else:
-                                self.log.warn(
-                                    f"Got stale message ({msg}) in state {state_version.value}"
-                                )
-                                send(Stale())
-                        elif isinstance(msg, End):
-                            self.log.info("Ending session")
-                            return
-                        else:
-                            raise Exception(f"Unexpected message: {msg}")
-                finally:
-                    driver.close()
-
-            return run_sessions()
-
-    def launch_specstrom(self, ilog):
+                            failed = browser_failed(e)
+                            raise
+                        finally:
+                            await call(release_driver, driver, failed)
+                    except Exception as e:
+                        await send(Error(str(e)))
+                elif isinstance(msg, Done):
+                    if screenshots is not None:
+                        await loop.run_in_executor(None, screenshots.flush)
+                    return [
+                        attach_screenshots(result.from_protocol_result(r))
+                        for r in msg.results
+                    ]
+                elif isinstance(msg, AwaitEvents):
+                    raise Exception(f"AwaitEvents in run_sessions: {msg}")
+
+        async def await_session_commands(driver: WebDriver, deps,
+                                         state_version):
+            while True:
+                msg = await receive()
+
+                if not msg:
+                    raise Exception(
+                        "No more messages from Specstrom, expected RequestAction or End."
+                    )
+                elif isinstance(msg, RequestAction):
+                    if msg.version == state_version.value:
+                        self.log.info(
+                            f"Performing action in state {state_version.value}: {printer.pretty_print_action(msg.action)}"
+                        )
+
+                        await call(perform_action, driver, msg.action)
+
+                        # Events after this state are queued client-side,
+                        # and drained when awaiting events.
+                        state = await call(observe, driver, deps)
+                        await call(screenshot, driver, state)
+                        state_version.increment()
+                        await send(Performed(state=state))
+                        observe_state(state)
+
+                        if msg.action.timeout is not None:
+                            await await_events(driver, deps, state_version,
+                                               msg.action.timeout)
+                    else:
+                        self.log.warning(
+                            f"Got stale message ({msg}) in state {state_version.value}"
+                        )
+                        metrics.stale.inc()
+                        await send(Stale())
+                elif isinstance(msg, AwaitEvents):
+                    if msg.version == state_version.value:
+                        self.log.info(
+                            f"Awaiting events in state {state_version.value} with timeout {msg.await_timeout}"
+                        )
+                        await await_events(driver, deps, state_version,
+                                           msg.await_timeout)
+                    else:
+                        self.log.warning(
+                            f"Got stale message ({msg}) in state {state_version.value}"
+                        )
+                        metrics.stale.inc()
+                        await send(Stale())
+                elif isinstance(msg, End):
+                    self.log.info("Ending session")
+                    metrics.sessions_finished.inc()
+                    return
+                else:
+                    raise Exception(f"Unexpected message: {msg}")
+
+        try:
+            return await run_sessions()
+        except BaseException:
+            if p.returncode is None:
+                p.kill()
+            raise
+        finally:
+            p.stdin.close()
+            await p.wait()
+            session_thread.shutdown()
+
+    async def launch_specstrom(self, ilog) -> asyncio.subprocess.Process:
         includes = list(map(lambda i: "-I" + i, self.include_paths))
         cmd = ["specstrom", "check", self.module
                ] + includes    # + ["+RTS", "-p"]
         self.log.debug("Invoking Specstrom with: %s", " ".join(cmd))
-        return subprocess.Popen(cmd,
-                                text=True,
-                                stdout=subprocess.PIPE,
-                                stderr=ilog,
-                                stdin=subprocess.PIPE,
-                                bufsize=0)
+        return await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=ilog,
+            stdin=asyncio.subprocess.PIPE,
+            cwd=self.working_directory,
+            limit=specstrom_message_limit)
 
     def new_driver(self):
         if self.browser == 'chrome':
@@ -355,15 +675,47 @@ class Check():
         else:
             raise Exception(f"Unsupported browser: {self.browser}")
 
-    def load_scripts(self) -> Scripts:
-        def map_query_state(r):
+    def new_remote_driver(self, url: str) -> WebDriver:
+        if self.browser == 'chrome':
+            options: Any = chrome_options.Options()
+        elif self.browser == 'firefox':
+            options = firefox_options.Options()
+        else:
+            raise Exception(f"Unsupported browser: {self.browser}")
+        options.headless = self.headless
+        return webdriver.Remote(command_executor=url, options=options)
+
+    def load_scripts(self, transports: Transports) -> Scripts:
+        # The latest state snapshot (id, state, and the sequence number of
+        # the latest client-side event it reflects) per browser. The
+        # client-side sends state deltas relative to it, and events queued
+        # after it.
+        snapshots: 'weakref.WeakKeyDictionary[WebDriver, Tuple[int, State, Optional[int]]]' = weakref.WeakKeyDictionary(
+        )
+
+        def snapshot_base(driver: WebDriver) -> Optional[int]:
+            snapshot = snapshots.get(driver)
+            return snapshot[0] if snapshot is not None else None
+
+        def snapshot_seq(driver: WebDriver) -> Optional[int]:
+            snapshot = snapshots.get(driver)
+            return snapshot[2] if snapshot is not None else None
+
+        def decode_state(driver: WebDriver, delta: Dict[str, Any]) -> State:
+            snapshot = snapshots.get(driver)
+            state = apply_state_delta(
+                snapshot[1] if snapshot is not None else None, delta)
+            snapshots[driver] = (delta['id'], state, delta.get('seq'))
+            return state
+
+        def map_query_state(driver: WebDriver, r):
             if r is None:
                 raise Exception(
                     "WebDriver script invocation failed with unexpected None result. This might be caused by an unexpected page navigation in the browser. Consider adding a timeout to the corresponding action."
                 )
-            return elements_to_refs(r)
+            return decode_state(driver, r)
 
-        def map_client_side_events(r):
+        def map_client_side_events(driver: WebDriver, r):
             def map_event(e: dict):
                 if e['tag'] == 'loaded':
                     return Action(id='loaded',
@@ -372,7 +724,7 @@ class Check():
                                   timeout=None)
                 elif e['tag'] == 'changed':
                     return Action(id='changed',
-                                  args=[elements_to_refs(e['element'])],
+                                  args=[e['element']],
                                   isEvent=True,
                                   timeout=None)
                 elif e['tag'] == 'detached':
@@ -384,29 +736,59 @@ class Check():
                     raise Exception(f"Invalid event tag in: {e}")
 
             return ClientSideEvents([map_event(e) for e in r['events']],
-                                    elements_to_refs(
+                                    decode_state(
+                                        driver,
                                         r['state'])) if r is not None else None
 
         result_mappers = {
             'queryState': map_query_state,
-            'installEventListener': lambda r: r,
+            'observe': map_query_state,
             'awaitEvents': map_client_side_events,
+            'awaitReady': lambda _, r: r is not None and bool(r['ready']),
         }
+        # Scripts returning states take the base snapshot id as their last
+        # argument. Awaiting events also takes the sequence number of the
+        # last event seen before that.
+        stateful_scripts = {'queryState', 'observe', 'awaitEvents'}
+
+        key = 'QUICKSTROM_CLIENT_SIDE_DIRECTORY'
+        client_side_dir = os.getenv(key)
+        if not client_side_dir:
+            raise Exception(f'Environment variable {key} must be set')
+        bundle = read_client_side_bundle(client_side_dir)
+
+        # The bundle is installed once per document. Scripts invoke the
+        # installed functions by name, and the bundle is installed again
+        # whenever a script finds it missing, e.g. after a page navigation.
+        def is_not_installed(r: Any) -> bool:
+            return isinstance(r, dict) and r.get('quickstromNotInstalled',
+                                                 False)
 
         def load_script(name: str, is_async: bool = False) -> Any:
-            key = 'QUICKSTROM_CLIENT_SIDE_DIRECTORY'
-            client_side_dir = os.getenv(key)
-            if not client_side_dir:
-                raise Exception(f'Environment variable {key} must be set')
-            file = open(f'{client_side_dir}/{name}.js')
-            script = file.read()
+            script = bundle_call_script(name, is_async)
+
+            def invoke(driver: WebDriver, *args: Any) -> Any:
+                transport = transports.get(driver)
+                return transport.execute_async_script(
+                    script, *args) if is_async else transport.execute_script(
+                        script, *args)
 
             def f(driver: WebDriver, *args: Any) -> JsonLike:
+                with self.tracer.span(name, 'script'):
+                    return call_script(driver, *args)
+
+            def call_script(driver: WebDriver, *args: Any) -> JsonLike:
                 try:
-                    r = driver.execute_async_script(
-                        script, *args) if is_async else driver.execute_script(
-                            script, *args)
-                    return result_mappers[name](r)
+                    if name == 'awaitEvents':
+                        args = args + (snapshot_seq(driver), )
+                    if name in stateful_scripts:
+                        args = args + (snapshot_base(driver), )
+                    r = invoke(driver, *args)
+                    if is_not_installed(r):
+                        self.log.debug("Installing client-side scripts")
+                        transports.get(driver).execute_script(bundle)
+                        r = invoke(driver, *args)
+                    return result_mappers[name](driver, r)
                 except StaleElementReferenceException as e:
                     raise e
                 except Exception as e:
@@ -416,20 +798,157 @@ class Check():
 
         return Scripts(
             query_state=load_script('queryState'),
-            install_event_listener=load_script('installEventListener'),
+            observe=load_script('observe'),
             await_events=load_script('awaitEvents', is_async=True),
+            await_ready=load_script('awaitReady', is_async=True),
         )
 
 
-def elements_to_refs(obj: Any) -> Any:
-    if isinstance(obj, dict):
-        return {key: elements_to_refs(value) for (key, value) in obj.items()}
-    elif isinstance(obj, list):
-        return [elements_to_refs(value) for value in obj]
-    elif isinstance(obj, WebElement):
-        return obj.id
-    else:
-        return obj
+@functools.lru_cache()
+def read_client_side_bundle(directory: str) -> str:
+    with open(f'{directory}/quickstrom.js') as file:
+        return file.read()
+
+
+def apply_state_delta(previous: Optional[State], delta: Dict[str, Any]) -> State:
+    """
+    Rebuilds the full state from a client-side delta. Elements are either
+    sent in full or as indices into the previous state's list for the same
+    selector, and selectors listed as unchanged are not sent at all.
+    """
+    if delta['base'] is None:
+        return delta['queries']
+    if previous is None:
+        raise Exception(
+            f"Got a state delta relative to {delta['base']} without a previous state"
+        )
+    state: State = {sel: previous[sel] for sel in delta['unchanged']}
+    for sel, elements in delta['queries'].items():
+        previous_elements = previous.get(sel, [])
+        state[sel] = [
+            previous_elements[e] if isinstance(e, int) else e
+            for e in elements
+        ]
+    return state
+
+
+@dataclass
+class Browsers():
+    """Browsers to run sessions in, and the transports to talk to them."""
+    pool: 'DriverPool'
+    transports: Transports
+
+    def close(self):
+        self.pool.close()
+
+
+class SharedBrowsers(object):
+    """
+    Browsers shared by the checks run in one process, one set for each
+    `browsers_key`, created on first use.
+    """
+    def __init__(self):
+        self.browsers: Dict[Tuple[Any, ...], Browsers] = {}
+        self._lock = threading.Lock()
+
+    def for_check(self, check: Check) -> Browsers:
+        key = check.browsers_key()
+        with self._lock:
+            browsers = self.browsers.get(key)
+            if browsers is None:
+                browsers = check.browsers(shared=True)
+                self.browsers[key] = browsers
+            return browsers
+
+    def close(self):
+        with self._lock:
+            browsers, self.browsers = list(self.browsers.values()), {}
+        for b in browsers:
+            b.close()
+
+
+class DriverPool(object):
+    """
+    Hands out WebDriver sessions for Specstrom sessions. When reusing, a
+    released browser is reset (storage and cookies cleared, navigated to
+    `about:blank`) and kept alive for the next session, instead of being
+    closed and started again.
+    """
+    def __init__(self,
+                 new_driver: Callable[[], WebDriver],
+                 reuse: bool = False,
+                 dispose: Optional[Callable[[WebDriver, bool], None]] = None):
+        self.new_driver = new_driver
+        self.reuse = reuse
+        self.dispose = dispose
+        self.idle: List[WebDriver] = []
+        self.log = logging.getLogger('quickstrom.executor.pool')
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Tuple[WebDriver, bool]:
+        """Returns a browser, and whether it was reused."""
+        start = time.perf_counter()
+        with self._lock:
+            driver = self.idle.pop() if len(self.idle) > 0 else None
+        reused = driver is not None
+        if driver is None:
+            driver = self.new_driver()
+        self.log.info("Acquired %s browser in %.3fs",
+                      "reused" if reused else "new",
+                      time.perf_counter() - start)
+        return (driver, reused)
+
+    def release(self, driver: WebDriver, failed: bool = False):
+        """
+        Releases a browser after a session. A browser that failed is quit
+        instead of being reset, as it may not respond any more.
+        """
+        if failed:
+            self.quit(driver, failed=True)
+            return
+        if not self.reuse:
+            self.disposed(driver)
+            driver.close()
+            return
+        try:
+            start = time.perf_counter()
+            self.reset(driver)
+            self.log.debug("Reset browser in %.3fs",
+                           time.perf_counter() - start)
+            with self._lock:
+                self.idle.append(driver)
+        except Exception as e:
+            self.log.warning(f"Could not reset browser, closing it: {e}")
+            self.quit(driver)
+
+    def reset(self, driver: WebDriver):
+        # Storage is scoped to the current document's origin, so it must be
+        # cleared before leaving the page.
+        driver.execute_script(
+            "try { window.localStorage.clear(); window.sessionStorage.clear(); } catch (e) {}"
+        )
+        driver.delete_all_cookies()
+        driver.get("about:blank")
+
+    def disposed(self, driver: WebDriver, failed: bool = False):
+        if self.dispose is not None:
+            try:
+                self.dispose(driver, failed)
+            except Exception as e:
+                self.log.warning(f"Could not dispose of browser: {e}")
+
+    def quit(self, driver: WebDriver, failed: bool = False):
+        self.disposed(driver, failed)
+        try:
+            driver.quit()
+        except Exception as e:
+            self.log.warning(f"Could not quit browser: {e}")
+
+    def close(self):
+        with self._lock:
+            drivers, self.idle = self.idle, []
+        for driver in drivers:
+            self.quit(driver)
 
 
 class Counter(object):
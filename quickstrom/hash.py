@@ -1,14 +1,74 @@
-# From https://www.doc.ic.ac.uk/~nuric/coding/how-to-hash-a-dictionary-in-python.html
-from typing import Dict, Any
+from dataclasses import dataclass
+from typing import Dict, Any, List, Tuple
 import hashlib
 import json
 
 
-def dict_hash(dictionary: Dict[str, Any]) -> str:
-    """MD5 hash of a dictionary."""
-    dhash = hashlib.md5()
-    # We need to sort arguments so {'a': 1, 'b': 2} is
-    # the same as {'b': 2, 'a': 1}
-    encoded = json.dumps(dictionary, sort_keys=True).encode()
-    dhash.update(encoded)
-    return dhash.hexdigest()
+def _digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def element_digest(element: Any) -> str:
+    """Digest of a single element state, independent of key order."""
+    return _digest(
+        json.dumps(element, sort_keys=True,
+                   separators=(',', ':')).encode())
+
+
+@dataclass(frozen=True)
+class StateDigests():
+    """
+    Digests of a state, per element, per selector, and for the whole
+    state. Each level is computed from the one below it.
+    """
+    state: str
+    selectors: Dict[str, str]
+    elements: Dict[str, List[str]]
+
+
+def combine_digests(elements: Dict[str, List[str]]) -> StateDigests:
+    selectors = {
+        sel: _digest(' '.join(digests).encode())
+        for sel, digests in elements.items()
+    }
+    state = _digest(' '.join(f'{json.dumps(sel)}:{digest}'
+                             for sel, digest in sorted(
+                                 selectors.items())).encode())
+    return StateDigests(state, selectors, elements)
+
+
+def state_digests(state: Dict[str, List[Any]]) -> StateDigests:
+    return combine_digests({
+        sel: [element_digest(element) for element in elements]
+        for sel, elements in state.items()
+    })
+
+
+class StateHasher():
+    """
+    Computes state digests, reusing the digests of element objects that
+    were part of the previously hashed state. States built from deltas
+    share unchanged element objects with the state before them, so only
+    changed elements are hashed.
+    """
+    def __init__(self):
+        self.previous: Dict[int, Tuple[Any, str]] = {}
+
+    def digests(self, state: Dict[str, List[Any]]) -> StateDigests:
+        seen: Dict[int, Tuple[Any, str]] = {}
+
+        def digest(element: Any) -> str:
+            key = id(element)
+            entry = self.previous.get(key) or seen.get(key)
+            if entry is None or entry[0] is not element:
+                entry = (element, element_digest(element))
+            seen[key] = entry
+            return entry[1]
+
+        elements = {
+            sel: [digest(element) for element in elements]
+            for sel, elements in state.items()
+        }
+        # Holding on to the elements keeps their ids from being reused.
+        self.previous = seen
+        return combine_digests(elements)
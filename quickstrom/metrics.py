@@ -0,0 +1,196 @@
+"""
+Live metrics of a running check, exported in the OpenMetrics text format,
+either to a file periodically (e.g. for the node exporter's textfile
+collector) or over HTTP for scraping.
+"""
+
+import bisect
+import http.server
+import logging
+import os
+import threading
+from typing import List, Sequence, Tuple, Union
+
+
+class Counter(object):
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            value = self.value
+        return [
+            f"# TYPE {self.name} counter",
+            f"# HELP {self.name} {self.help}",
+            f"{self.name}_total {format_value(value)}",
+        ]
+
+
+class Histogram(object):
+    def __init__(self, name: str, help: str, buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines = [
+            f"# TYPE {self.name} histogram",
+            f"# HELP {self.name} {self.help}",
+        ]
+        cumulative = 0
+        for bound, count in zip(self.buckets + [float('inf')], counts):
+            cumulative += count
+            lines.append(
+                f'{self.name}_bucket{{le="{format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_count {cumulative}")
+        lines.append(f"{self.name}_sum {format_value(total)}")
+        return lines
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    elif value == int(value):
+        return str(int(value))
+    else:
+        return repr(value)
+
+
+def exponential_buckets(start: float, factor: float,
+                        count: int) -> List[float]:
+    return [start * factor**i for i in range(count)]
+
+
+class Metrics(object):
+    """The metrics of a check, updated by the executor from any thread."""
+    def __init__(self):
+        self.sessions_started = Counter('quickstrom_sessions_started',
+                                        'Sessions started in a browser.')
+        self.sessions_finished = Counter('quickstrom_sessions_finished',
+                                         'Sessions ended by Specstrom.')
+        self.actions = Counter('quickstrom_actions',
+                               'Actions performed in a browser.')
+        self.stale = Counter(
+            'quickstrom_stale',
+            'Requests from Specstrom answered as stale, as the state had changed.'
+        )
+        self.event_timeouts = Counter(
+            'quickstrom_event_timeouts',
+            'Waits for client-side events that timed out.')
+        self.action_seconds = Histogram(
+            'quickstrom_action_seconds',
+            'Time to perform an action in the browser.',
+            exponential_buckets(0.005, 2, 12))
+        self.state_elements = Histogram(
+            'quickstrom_state_elements',
+            'Number of elements in each state sent to Specstrom.',
+            exponential_buckets(1, 4, 10))
+        self.screenshot_bytes = Histogram(
+            'quickstrom_screenshot_bytes', 'Size of captured screenshots.',
+            exponential_buckets(4096, 4, 10))
+
+    def all(self) -> List[Union[Counter, Histogram]]:
+        return [
+            self.sessions_started, self.sessions_finished, self.actions,
+            self.stale, self.event_timeouts, self.action_seconds,
+            self.state_elements, self.screenshot_bytes
+        ]
+
+    def render(self) -> str:
+        lines = [line for m in self.all() for line in m.render()]
+        return "\n".join(lines + ["# EOF"]) + "\n"
+
+
+content_type = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+def write_textfile(metrics: Metrics, path: str):
+    """Writes the metrics atomically, so that readers never see a partial file."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(metrics.render())
+    os.replace(tmp, path)
+
+
+class TextfileExporter(object):
+    """Writes the metrics to a file every `interval` seconds, and when stopped."""
+    def __init__(self, metrics: Metrics, path: str, interval: float = 5.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run,
+                                       name='quickstrom-metrics',
+                                       daemon=True)
+        self.log = logging.getLogger('quickstrom.metrics')
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                write_textfile(self.metrics, self.path)
+            except OSError as e:
+                self.log.warning("Could not write metrics to %s: %s",
+                                 self.path, e)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        write_textfile(self.metrics, self.path)
+
+
+class HttpExporter(object):
+    """Serves the metrics at `/metrics` on a local port."""
+    def __init__(self,
+                 metrics: Metrics,
+                 port: int,
+                 host: str = '127.0.0.1'):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='quickstrom-metrics-http',
+                                       daemon=True)
+
+    def address(self) -> Tuple[str, int]:
+        return self.server.server_address    # type: ignore
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
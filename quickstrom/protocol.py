@@ -1,6 +1,7 @@
+import asyncio
 import json
-import jsonlines
-from typing import Any, Callable, IO, List, Dict, Optional, Literal, Union
+import struct
+from typing import Any, Callable, IO, List, Dict, Optional, Literal, TypeVar, Union
 from dataclasses import dataclass
 
 Selector = str
@@ -12,9 +13,12 @@ JsonLike = Union[str, int, float, List['JsonLike'], Dict[str, 'JsonLike'],
 
 State = Dict[Selector, List[JsonLike]]
 
+T = TypeVar('T')
+
 
 @dataclass
 class Action():
+    __slots__ = ('id', 'args', 'isEvent', 'timeout')
     id: str
     args: List[object]
     isEvent: bool
@@ -23,15 +27,18 @@ class Action():
 
 @dataclass
 class TraceActions():
+    __slots__ = ('actions',)
     actions: List[Action]
 
 
 @dataclass
 class TraceState():
+    __slots__ = ('state',)
     state: State
 
 @dataclass
 class TraceError():
+    __slots__ = ('error',)
     error: str
 
 TraceElement = Union[TraceActions, TraceState, TraceError]
@@ -43,18 +50,21 @@ Certainty = Union[Literal['Definitely'], Literal['Probably']]
 
 @dataclass
 class Validity():
+    __slots__ = ('certainty', 'value')
     certainty: Certainty
     value: bool
 
 
 @dataclass
 class RunResult():
+    __slots__ = ('valid', 'trace')
     valid: Validity
     trace: Trace
 
 
 @dataclass
 class ErrorResult():
+    __slots__ = ('trace',)
     trace: Trace
 
 
@@ -63,121 +73,326 @@ Result = Union[RunResult, ErrorResult]
 
 @dataclass
 class Start():
+    __slots__ = ('dependencies',)
     dependencies: Dict[Selector, Schema]
 
 
 @dataclass
 class AwaitEvents():
+    __slots__ = ('await_timeout', 'version')
     await_timeout: int
     version: int
 
 
 @dataclass
 class End():
-    pass
+    __slots__ = ()
 
 
 @dataclass
 class Done():
+    __slots__ = ('results',)
     results: List[Result]
 
 
 @dataclass
 class RequestAction():
+    __slots__ = ('action', 'version')
     action: Action
     version: int
 
 
 @dataclass
 class Performed():
+    __slots__ = ('state',)
     state: State
 
 
 @dataclass
 class Timeout():
+    __slots__ = ('state',)
     state: State
 
 
 @dataclass
 class Stale():
-    pass
+    __slots__ = ()
 
 
 @dataclass
 class Events():
+    __slots__ = ('events', 'state')
     events: List[Action]
     state: State
 
 @dataclass
 class Error():
+    __slots__ = ('error_message',)
     error_message: str
 
-def message_writer(fp: IO[str]):
-    dumps: Callable[[Any],
-                    str] = lambda obj: json.dumps(obj, cls=_ProtocolEncoder)
-    return jsonlines.Writer(fp, dumps=dumps, flush=True)
-
-
-def message_reader(fp: IO[str]):
-    def loads(s: str):
-        return json.loads(s, object_hook=_decode_hook)
-
-    return jsonlines.Reader(fp, loads=loads)
-
-
-class _ProtocolEncoder(json.JSONEncoder):
-    def default(self, o: Any):
-        if isinstance(o, Performed):
-            return {'tag': 'Performed', 'contents': o.state}
-        elif isinstance(o, Stale):
-            return {'tag': 'Stale'}
-        elif isinstance(o, Timeout):
-            return {'tag': 'Timeout', 'contents': o.state}
-        elif isinstance(o, Events):
-            events: Any = [self.default(event) for event in o.events]
-            return {'tag': 'Events', 'contents': [events, o.state]}
-        elif isinstance(o, Error):
-            return {'tag': 'Error', 'errorMessage': o.error_message}
-        elif isinstance(o, Action):
-            return {
-                'id': o.id,
-                'args': o.args,
-                'isEvent': o.isEvent,
-                'timeout': o.timeout
-            }
-        else:
-            return json.JSONEncoder.default(self, o)
+class Codec():
+    """Encodes and decodes JSON values to and from bytes."""
+    name = 'json'
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.orjson.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self.orjson.loads(data)
+
+
+class MsgspecCodec(Codec):
+    name = 'msgspec'
+
+    def __init__(self):
+        import msgspec
+        self.encoder = msgspec.json.Encoder()
+        self.decoder = msgspec.json.Decoder()
 
+    def dumps(self, obj: Any) -> bytes:
+        return self.encoder.encode(obj)
 
-def _decode_hook(d: Any) -> Any:
-    if 'tag' not in d:
-        if 'id' in d and 'args' in d and 'isEvent' in d and 'timeout' in d:
-            return Action(d['id'], d['args'], d['isEvent'], d['timeout'])
+    def loads(self, data: bytes) -> Any:
+        return self.decoder.decode(data)
+
+
+codecs: Dict[str, Callable[[], Codec]] = {
+    'orjson': OrjsonCodec,
+    'msgspec': MsgspecCodec,
+    'json': Codec,
+}
+
+codec_names = ['auto'] + list(codecs.keys())
+
+
+def codec_by_name(name: str = 'auto') -> Codec:
+    """
+    Returns the named codec. The `auto` codec is the first accelerated
+    codec that is installed, falling back to the standard library.
+    """
+    if name == 'auto':
+        for codec in codecs.values():
+            try:
+                return codec()
+            except ImportError:
+                pass
+        return Codec()
+    elif name in codecs:
+        return codecs[name]()
+    else:
+        raise ValueError(f"Unknown codec: {name}")
+
+
+Framing = Union[Literal['lines'], Literal['length-prefixed']]
+
+
+class MessageWriter():
+    """
+    Writes messages as frames to a binary stream, either as JSON lines or
+    as JSON documents prefixed by their length (a 32-bit big-endian
+    integer). Specstrom reads JSON lines.
+    """
+    def __init__(self, fp: IO[bytes], codec: Codec, framing: Framing):
+        self.fp = fp
+        self.codec = codec
+        self.framing = framing
+
+    def write(self, msg: Any):
+        self.write_frame(_encode_message(msg))
+
+    def write_frame(self, obj: Any):
+        """Writes plain JSON values as a frame, without encoding messages."""
+        self.fp.write(_frame(self.codec, self.framing, obj))
+        self.fp.flush()
+
+
+class MessageReader():
+    """Reads messages written by a `MessageWriter` with the same framing."""
+    def __init__(self, fp: IO[bytes], codec: Codec, framing: Framing):
+        self.fp = fp
+        self.codec = codec
+        self.framing = framing
+
+    def read(self) -> Any:
+        """Returns the next message, or `None` at the end of the stream."""
+        frame = self.read_frame()
+        return None if frame is None else _decode(frame)
+
+    def read_frame(self) -> Any:
+        """Returns the next frame as plain JSON values, without decoding messages."""
+        if self.framing == 'lines':
+            data = self.fp.readline()
+            if not data:
+                return None
         else:
-            return d
-    if d['tag'] == 'RunResult':
-        return RunResult(d['valid'], d['trace'])
-    if d['tag'] == 'ErrorResult':
-        return ErrorResult(d['trace'])
-    if d['tag'] == 'Start':
-        return Start(dependencies=d['dependencies'])
-    if d['tag'] == 'RequestAction':
-        return RequestAction(action=d['action'], version=d['version'])
-    if d['tag'] == 'AwaitEvents':
-        return AwaitEvents(await_timeout=d['awaitTimeout'], version=d['version'])
-    elif d['tag'] == 'End':
-        return End()
-    elif d['tag'] == 'Done':
-        return Done(results=d['results'])
-    elif d['tag'] == 'Definitely':
+            header = self.fp.read(4)
+            if len(header) < 4:
+                return None
+            (length, ) = struct.unpack('>I', header)
+            data = self.fp.read(length)
+        return self.codec.loads(data)
+
+
+class AsyncMessageWriter():
+    """Writes messages like `MessageWriter`, to an asyncio stream."""
+    def __init__(self, writer: asyncio.StreamWriter, codec: Codec,
+                 framing: Framing):
+        self.writer = writer
+        self.codec = codec
+        self.framing = framing
+
+    async def write(self, msg: Any):
+        await self.write_frame(_encode_message(msg))
+
+    async def write_frame(self, obj: Any):
+        self.writer.write(_frame(self.codec, self.framing, obj))
+        await self.writer.drain()
+
+
+class AsyncMessageReader():
+    """Reads messages like `MessageReader`, from an asyncio stream."""
+    def __init__(self, reader: asyncio.StreamReader, codec: Codec,
+                 framing: Framing):
+        self.reader = reader
+        self.codec = codec
+        self.framing = framing
+
+    async def read(self) -> Any:
+        frame = await self.read_frame()
+        return None if frame is None else _decode(frame)
+
+    async def read_frame(self) -> Any:
+        try:
+            if self.framing == 'lines':
+                data = await self.reader.readuntil(b'\n')
+            else:
+                header = await self.reader.readexactly(4)
+                (length, ) = struct.unpack('>I', header)
+                data = await self.reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            return None
+        return self.codec.loads(data)
+
+
+def _frame(codec: Codec, framing: Framing, obj: Any) -> bytes:
+    data = codec.dumps(obj)
+    if framing == 'lines':
+        return data + b'\n'
+    else:
+        return struct.pack('>I', len(data)) + data
+
+
+def message_writer(fp: IO[bytes],
+                   codec: Optional[Codec] = None,
+                   framing: Framing = 'lines') -> MessageWriter:
+    return MessageWriter(fp, codec or codec_by_name(), framing)
+
+
+def message_reader(fp: IO[bytes],
+                   codec: Optional[Codec] = None,
+                   framing: Framing = 'lines') -> MessageReader:
+    return MessageReader(fp, codec or codec_by_name(), framing)
+
+
+def _encode_action(action: Action) -> Dict[str, Any]:
+    return {
+        'id': action.id,
+        'args': action.args,
+        'isEvent': action.isEvent,
+        'timeout': action.timeout
+    }
+
+
+def _encode_message(o: Any) -> Any:
+    if isinstance(o, Performed):
+        return {'tag': 'Performed', 'contents': o.state}
+    elif isinstance(o, Stale):
+        return {'tag': 'Stale'}
+    elif isinstance(o, Timeout):
+        return {'tag': 'Timeout', 'contents': o.state}
+    elif isinstance(o, Events):
+        events = [_encode_action(event) for event in o.events]
+        return {'tag': 'Events', 'contents': [events, o.state]}
+    elif isinstance(o, Error):
+        return {'tag': 'Error', 'errorMessage': o.error_message}
+    else:
+        raise TypeError(f"Cannot encode message: {o}")
+
+
+def _decode_action(d: Dict[str, Any]) -> Action:
+    return Action(d['id'], d['args'], d['isEvent'], d['timeout'])
+
+
+def _decode_validity(d: Dict[str, Any]) -> Validity:
+    if d['tag'] == 'Definitely':
         return Validity('Definitely', d['contents'])
     elif d['tag'] == 'Probably':
         return Validity('Probably', d['contents'])
-    elif d['tag'] == 'TraceAction':
-        return TraceActions(actions=d['contents'])
-    elif d['tag'] == 'TraceState':
-        return TraceState(state=d['contents'])
-    elif d['tag'] == 'TraceError':
-        return TraceError(error=d['contents'])
     else:
-        raise (Exception(f"Unsupported tagged JSON type: {d['tag']}"))
+        raise Exception(f"Unsupported validity: {d['tag']}")
+
+
+_trace_element_decoders: Dict[str, Callable[[Dict[str, Any]], TraceElement]] = {
+    'TraceAction':
+    lambda d: TraceActions([_decode_action(a) for a in d['contents']]),
+    'TraceState': lambda d: TraceState(d['contents']),
+    'TraceError': lambda d: TraceError(d['contents']),
+}
+
+
+def _decode_trace(trace: List[Dict[str, Any]]) -> Trace:
+    return [_decode_tagged(_trace_element_decoders, e) for e in trace]
+
+
+_result_decoders: Dict[str, Callable[[Dict[str, Any]], Result]] = {
+    'RunResult':
+    lambda d: RunResult(_decode_validity(d['valid']), _decode_trace(d['trace'])),
+    'ErrorResult': lambda d: ErrorResult(_decode_trace(d['trace'])),
+}
+
+_message_decoders: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    'Start':
+    lambda d: Start(dependencies=d['dependencies']),
+    'RequestAction':
+    lambda d: RequestAction(action=_decode_action(d['action']),
+                            version=d['version']),
+    'AwaitEvents':
+    lambda d: AwaitEvents(await_timeout=d['awaitTimeout'],
+                          version=d['version']),
+    'End':
+    lambda d: End(),
+    'Done':
+    lambda d: Done(results=[
+        _decode_tagged(_result_decoders, r) for r in d['results']
+    ]),
+}
+
+
+def _decode_tagged(decoders: Dict[str, Callable[[Dict[str, Any]], T]],
+                   d: Dict[str, Any]) -> T:
+    decoder = decoders.get(d['tag'])
+    if decoder is None:
+        raise Exception(f"Unsupported tagged JSON type: {d['tag']}")
+    return decoder(d)
+
+
+def _decode(d: Dict[str, Any]) -> Any:
+    """
+    Decodes a message from Specstrom. Only the parts of a message that the
+    protocol defines are decoded; states are left as they are.
+    """
+    return _decode_tagged(_message_decoders, d)
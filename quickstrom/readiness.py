@@ -0,0 +1,82 @@
+from dataclasses import dataclass
+from typing import Dict, List, Union
+from quickstrom.protocol import JsonLike
+
+default_timeout = 10000
+
+
+@dataclass
+class ReadyState():
+    """Wait until `document.readyState` is `complete`."""
+    timeout: int = default_timeout
+
+
+@dataclass
+class DomQuiescence():
+    """Wait until the DOM has not been mutated for `quiet` milliseconds."""
+    quiet: int = 200
+    timeout: int = default_timeout
+
+
+@dataclass
+class NetworkIdle():
+    """Wait until no network request has completed for `idle` milliseconds."""
+    idle: int = 500
+    timeout: int = default_timeout
+
+
+@dataclass
+class Predicate():
+    """Wait until a JavaScript expression evaluates to a truthy value."""
+    expression: str
+    timeout: int = default_timeout
+
+
+Strategy = Union[ReadyState, DomQuiescence, NetworkIdle, Predicate]
+
+default_strategies: List[Strategy] = [ReadyState()]
+
+
+def to_json(strategy: Strategy) -> Dict[str, JsonLike]:
+    if isinstance(strategy, ReadyState):
+        return {'tag': 'readyState', 'timeout': strategy.timeout}
+    elif isinstance(strategy, DomQuiescence):
+        return {
+            'tag': 'domQuiescence',
+            'quiet': strategy.quiet,
+            'timeout': strategy.timeout
+        }
+    elif isinstance(strategy, NetworkIdle):
+        return {
+            'tag': 'networkIdle',
+            'idle': strategy.idle,
+            'timeout': strategy.timeout
+        }
+    elif isinstance(strategy, Predicate):
+        return {
+            'tag': 'predicate',
+            'expression': strategy.expression,
+            'timeout': strategy.timeout
+        }
+    else:
+        raise TypeError(f"{strategy} is not a readiness strategy")
+
+
+def parse_strategy(s: str) -> Strategy:
+    """
+    Parses a strategy from the command line, on the form `NAME[:TIMEOUT]`,
+    e.g. `ready-state` or `dom-quiescence:5000`.
+    """
+    name, _, timeout_str = s.partition(':')
+    try:
+        timeout = int(timeout_str) if timeout_str else default_timeout
+    except ValueError:
+        raise ValueError(f"Invalid readiness timeout in `{s}`")
+    if name == 'ready-state':
+        return ReadyState(timeout=timeout)
+    elif name == 'dom-quiescence':
+        return DomQuiescence(timeout=timeout)
+    elif name == 'network-idle':
+        return NetworkIdle(timeout=timeout)
+    else:
+        raise ValueError(f"Unknown readiness strategy: `{name}`")
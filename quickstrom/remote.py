@@ -0,0 +1,146 @@
+"""
+Spreads browser sessions across several remote WebDriver endpoints, such
+as Selenium Grid nodes or standalone drivers on other hosts.
+"""
+
+import json
+import logging
+import threading
+import time
+import urllib.request
+import weakref
+from typing import Callable, List, Optional
+
+from selenium.webdriver.remote.webdriver import WebDriver
+
+
+class Endpoint():
+    """A remote WebDriver endpoint, with its load and health."""
+    def __init__(self, url: str):
+        self.url = url
+        self.active = 0
+        self.failures = 0
+        self.unavailable_until = 0.0
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.unavailable_until
+
+    def score(self) -> float:
+        """Lower is better: busy endpoints and failing ones are avoided."""
+        return (self.active + 1) * (1 + self.failures)
+
+    def __repr__(self):
+        return f"Endpoint({self.url!r}, active={self.active}, failures={self.failures})"
+
+
+class NoEndpointAvailable(Exception):
+    def __init__(self, errors: List[str]):
+        self.errors = errors
+
+    def __str__(self):
+        return "Could not start a session on any remote WebDriver endpoint:\n" + "\n".join(
+            self.errors)
+
+
+class EndpointPool(object):
+    """
+    Starts sessions on the least loaded, healthiest endpoint, and retries
+    on the next one if starting a session fails. An endpoint is failing if
+    it can't start a session, or a browser on it fails during one. It is
+    left alone for a cooldown period, doubling with each consecutive
+    failure, and its status is checked before it is used again.
+    """
+    def __init__(self,
+                 urls: List[str],
+                 new_remote_driver: Callable[[str], WebDriver],
+                 cooldown: float = 5.0,
+                 max_cooldown: float = 120.0,
+                 clock: Callable[[], float] = time.monotonic):
+        if len(urls) == 0:
+            raise ValueError("At least one remote WebDriver URL is required")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.new_remote_driver = new_remote_driver
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.clock = clock
+        self.drivers: 'weakref.WeakKeyDictionary[WebDriver, Endpoint]' = weakref.WeakKeyDictionary(
+        )
+        self.log = logging.getLogger('quickstrom.executor.remote')
+        self._lock = threading.Lock()
+
+    def reserve(self, tried: List[Endpoint]) -> Optional[Endpoint]:
+        """
+        Picks the best endpoint not tried yet and counts a session on it.
+        If all endpoints are cooling down, they are tried anyway, soonest
+        available first.
+        """
+        now = self.clock()
+        with self._lock:
+            untried = [e for e in self.endpoints if e not in tried]
+            available = [e for e in untried if e.is_available(now)]
+            if available:
+                endpoint = min(available, key=Endpoint.score)
+            elif untried:
+                endpoint = min(untried, key=lambda e: e.unavailable_until)
+            else:
+                return None
+            endpoint.active += 1
+            return endpoint
+
+    def new_driver(self) -> WebDriver:
+        tried: List[Endpoint] = []
+        errors: List[str] = []
+        while True:
+            endpoint = self.reserve(tried)
+            if endpoint is None:
+                raise NoEndpointAvailable(errors)
+            tried.append(endpoint)
+            try:
+                if endpoint.failures > 0 and not is_ready(endpoint.url):
+                    raise Exception("endpoint is not ready")
+                driver = self.new_remote_driver(endpoint.url)
+            except Exception as e:
+                with self._lock:
+                    endpoint.active -= 1
+                self.failed(endpoint, e)
+                errors.append(f"{endpoint.url}: {e}")
+                continue
+            with self._lock:
+                endpoint.failures = 0
+                endpoint.unavailable_until = 0.0
+                self.drivers[driver] = endpoint
+            self.log.debug("Started session on %s", endpoint)
+            return driver
+
+    def failed(self, endpoint: Endpoint, error: object):
+        with self._lock:
+            endpoint.failures += 1
+            cooldown = min(self.cooldown * 2**(endpoint.failures - 1),
+                           self.max_cooldown)
+            endpoint.unavailable_until = self.clock() + cooldown
+        self.log.warning("Session failed on %s, not using it for %.0fs: %s",
+                         endpoint.url, cooldown, error)
+
+    def released(self, driver: WebDriver, failed: bool = False):
+        """
+        Frees up the endpoint of a browser that is about to be closed. If
+        the browser failed during its session, the endpoint cools down as
+        if it had failed to start one.
+        """
+        with self._lock:
+            endpoint = self.drivers.pop(driver, None)
+            if endpoint is not None:
+                endpoint.active -= 1
+        if endpoint is not None and failed:
+            self.failed(endpoint, "the browser failed during a session")
+
+
+def is_ready(url: str, timeout: float = 5.0) -> bool:
+    """Checks the WebDriver status of an endpoint."""
+    try:
+        with urllib.request.urlopen(f"{url.rstrip('/')}/status",
+                                    timeout=timeout) as r:
+            status = json.load(r)
+        return bool(status.get('value', {}).get('ready', False))
+    except Exception:
+        return False
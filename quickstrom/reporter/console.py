@@ -42,7 +42,7 @@ def errored(s: str) -> str:
     return click.style(s, fg='red')
 
 
-def print_state_diff(transition: StateTransition[Diff[JsonLike], bytes],
+def print_state_diff(transition: StateTransition[Diff[JsonLike], StoredImage],
                      file: Optional[IO[Text]]):
     def without_internal_props(
             d: Dict[Selector, JsonLike]) -> Dict[Selector, JsonLike]:
@@ -116,7 +116,7 @@ class ConsoleReporter(Reporter):
     report_on_success: bool
     file: Optional[IO[Text]] = sys.stdout
 
-    def report_test(self, test: Test[Diff[protocol.JsonLike], bytes]):
+    def report_test(self, test: Test[Diff[protocol.JsonLike], StoredImage]):
         click.echo("Trace:", file=self.file)
         for i, transition in enumerate(test.transitions):
             click.echo(element_heading(f"\nTransition #{i}"), file=self.file)
@@ -2,6 +2,7 @@ from dataclasses import dataclass
 import dataclasses
 import json
 import os
+import shutil
 from typing import IO, Any, Dict
 import quickstrom.protocol as protocol
 from quickstrom.result import *
@@ -33,18 +34,37 @@ def write_screenshots(result: PlainResult,
     os.makedirs(dir)
     def on_state(
         state: State[protocol.JsonLike,
-                     bytes]) -> State[protocol.JsonLike, Path]:
+                     StoredImage]) -> State[protocol.JsonLike, Path]:
+
+        def write_image(image: StoredImage) -> Path:
+            p = dir / image.path.name
+            if not p.exists():
+                link_or_copy(image.path, p)
+            return p.relative_to(base)
 
         if state.screenshot:
-            p = dir / Path(f"{state.hash}.png")
-            p.write_bytes(state.screenshot.image)
-            return State(state.hash, state.queries, Screenshot(p.relative_to(base), state.screenshot.width, state.screenshot.height, state.screenshot.scale))
+            s = state.screenshot
+            return State(
+                state.hash, state.queries,
+                Screenshot(
+                    write_image(s.image), s.width, s.height, s.scale,
+                    write_image(s.thumbnail)
+                    if s.thumbnail is not None else None),
+                state.element_digests)
         else:
-            return State(state.hash, state.queries, None)
+            return State(state.hash, state.queries, None,
+                         state.element_digests)
 
     return map_states(result, on_state)
 
 
+def link_or_copy(src: Path, dst: Path):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
 def encode_str(report: Report) -> str:
     return json.dumps(report, cls=_ReporterEncoder)
 
@@ -120,6 +140,7 @@ class _ReporterEncoder(json.JSONEncoder):
         elif isinstance(o, Screenshot):
             return {
                 'url': o.image,
+                'thumbnailUrl': o.thumbnail,
                 'width': o.width,
                 'height': o.height,
                 'scale': o.scale,
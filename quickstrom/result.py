@@ -1,7 +1,8 @@
 import quickstrom.protocol as protocol
-from quickstrom.hash import dict_hash
+from quickstrom.hash import state_digests
 from dataclasses import dataclass
-from typing import Callable, Dict, Generic, List, Optional, Tuple, Type, TypeVar, Union
+from pathlib import Path
+from typing import IO, Callable, Dict, Generic, List, Optional, Tuple, Type, TypeVar, Union
 
 Selector = str
 
@@ -15,6 +16,20 @@ class Screenshot(Generic[I]):
     width: int
     height: int
     scale: int
+    thumbnail: Optional[I] = None
+
+
+@dataclass(frozen=True, eq=True)
+class StoredImage():
+    """An image file in a content-addressed screenshot store, read lazily."""
+    path: Path
+    digest: str
+
+    def open(self) -> IO[bytes]:
+        return open(self.path, 'rb')
+
+    def read_bytes(self) -> bytes:
+        return self.path.read_bytes()
 
 
 T = TypeVar('T')
@@ -78,6 +93,7 @@ class State(Generic[E, I]):
     hash: str
     queries: Dict[Selector, List[E]]
     screenshot: Optional[Screenshot[I]]
+    element_digests: Optional[Dict[Selector, List[str]]] = None
 
 
 @dataclass(frozen=True)
@@ -130,7 +146,7 @@ Result = Union[Failed[E, I], Passed[E, I], Errored]
 
 ResultWithScreenshots = Result[protocol.JsonLike, I]
 
-PlainResult = ResultWithScreenshots[bytes]
+PlainResult = ResultWithScreenshots[StoredImage]
 
 
 def map_states(r: Result[E, I], f: Callable[[State[E, I]],
@@ -157,13 +173,14 @@ def map_states(r: Result[E, I], f: Callable[[State[E, I]],
                        on_test(r.errored_test))
 
 
-def from_state(state: protocol.State) -> State[protocol.JsonLike, bytes]:
-    return State(dict_hash(state), state, None)
+def from_state(state: protocol.State) -> State[protocol.JsonLike, StoredImage]:
+    digests = state_digests(state)
+    return State(digests.state, state, None, digests.elements)
 
 
 def transitions_from_trace(
         full_trace: protocol.Trace
-) -> List[Transition[protocol.JsonLike, bytes]]:
+) -> List[Transition[protocol.JsonLike, StoredImage]]:
     A = TypeVar('A')
     B = TypeVar('B')
     trace = list(full_trace.copy())
@@ -177,7 +194,7 @@ def transitions_from_trace(
             raise TypeError(
                 f"Expected {a} or {b} in trace but got {type(first)}")
 
-    transitions: List[Transition[protocol.JsonLike, bytes]] = []
+    transitions: List[Transition[protocol.JsonLike, StoredImage]] = []
     last_state: Optional[State] = None
     while len(trace) > 0:
         actions = pop_either(protocol.TraceActions, protocol.TraceError)
@@ -235,41 +252,60 @@ def diff_states(
     old_result_queries = {}
     new_result_queries = {}
 
+    def element_keys(state: State[protocol.JsonLike, I],
+                     sel: Selector) -> List[protocol.JsonLike]:
+        # Elements are compared by digest when both states have them,
+        # and structurally otherwise.
+        if old.element_digests is not None and new.element_digests is not None:
+            return state.element_digests.get(sel, [])    # type: ignore
+        else:
+            return state.queries.get(sel, [])
+
     for sel in new.queries.keys():
         old_elements: List[Dict[str, protocol.JsonLike]] = old.queries.get(
             sel, [])    # type: ignore
         new_elements: List[Dict[str, protocol.JsonLike]] = new.queries.get(
             sel, [])    # type: ignore
-
-        old_by_ref = {el['ref']: el for el in old_elements}
-        new_by_ref = {el['ref']: el for el in new_elements}
-
-        def diff_old(
-                el: Dict[str, protocol.JsonLike]) -> Diff[protocol.JsonLike]:
+        old_keys = element_keys(old, sel)
+        new_keys = element_keys(new, sel)
+
+        old_by_ref = {
+            el['ref']: key
+            for el, key in zip(old_elements, old_keys)
+        }
+        new_by_ref = {
+            el['ref']: key
+            for el, key in zip(new_elements, new_keys)
+        }
+
+        def diff_old(el: Dict[str, protocol.JsonLike],
+                     key: protocol.JsonLike) -> Diff[protocol.JsonLike]:
             ref = el['ref']
             if ref in new_by_ref:
-                new_el = new_by_ref[ref]
-                if new_el == el:
+                if new_by_ref[ref] == key:
                     return Unmodified(el)
                 else:
                     return Modified(el)
             else:
                 return Removed(el)
 
-        def diff_new(
-                el: Dict[str, protocol.JsonLike]) -> Diff[protocol.JsonLike]:
+        def diff_new(el: Dict[str, protocol.JsonLike],
+                     key: protocol.JsonLike) -> Diff[protocol.JsonLike]:
             ref = el['ref']
             if ref in old_by_ref:
-                old_el = old_by_ref[ref]
-                if old_el == el:
+                if old_by_ref[ref] == key:
                     return Unmodified(el)
                 else:
                     return Modified(el)
             else:
                 return Added(el)
 
-        old_result_queries[sel] = [diff_old(el) for el in old_elements]
-        new_result_queries[sel] = [diff_new(el) for el in new_elements]
+        old_result_queries[sel] = [
+            diff_old(el, key) for el, key in zip(old_elements, old_keys)
+        ]
+        new_result_queries[sel] = [
+            diff_new(el, key) for el, key in zip(new_elements, new_keys)
+        ]
 
     return (State(old.hash, old_result_queries, old.screenshot),
             State(new.hash, new_result_queries, new.screenshot))
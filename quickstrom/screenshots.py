@@ -0,0 +1,180 @@
+import hashlib
+import io
+import logging
+import os
+import struct
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Literal, Optional, Set, Tuple, Union
+
+import quickstrom.result as result
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+
+ImageFormat = Union[Literal['png'], Literal['webp'], Literal['jpeg']]
+
+image_formats = ['png', 'webp', 'jpeg']
+
+
+@dataclass(frozen=True)
+class ImageEncoding():
+    """
+    How screenshots are stored. PNG screenshots are stored as captured,
+    other formats and thumbnails require Pillow. WebP images are lossless,
+    JPEG images use the given quality.
+    """
+    format: ImageFormat = 'png'
+    quality: int = 85
+    thumbnail_width: Optional[int] = None
+
+    def requires_pillow(self) -> bool:
+        return self.format != 'png' or self.thumbnail_width is not None
+
+
+def pillow_available() -> bool:
+    try:
+        import PIL.Image
+        return True
+    except ImportError:
+        return False
+
+
+def encode_image(image: bytes, encoding: ImageEncoding,
+                 width: Optional[int]) -> bytes:
+    """Re-encodes a PNG image, optionally downscaled to the given width."""
+    if encoding.format == 'png' and width is None:
+        return image
+
+    import PIL.Image
+
+    img = PIL.Image.open(io.BytesIO(image))
+    if width is not None and width < img.width:
+        img = img.resize((width, max(1, round(img.height * width / img.width))))
+    out = io.BytesIO()
+    if encoding.format == 'jpeg':
+        img.convert('RGB').save(out, 'JPEG', quality=encoding.quality)
+    elif encoding.format == 'webp':
+        img.save(out, 'WEBP', lossless=True)
+    else:
+        img.save(out, 'PNG', optimize=True)
+    return out.getvalue()
+
+
+def png_dimensions(image: bytes) -> Tuple[int, int]:
+    """Reads the width and height of a PNG image from its header."""
+    if image[:8] != png_signature or image[12:16] != b'IHDR':
+        raise ValueError("Screenshot is not a PNG image")
+    width, height = struct.unpack('>II', image[16:24])
+    return (width, height)
+
+
+class ScreenshotStore(object):
+    """
+    Collects screenshots by state hash. Images are encoded and written to a
+    directory, named by the digest of their captured content, on a
+    background thread. Only the metadata is kept in memory. The first
+    error in processing a screenshot is raised by `flush` or `close`.
+    """
+    def __init__(self,
+                 directory: Path,
+                 encoding: ImageEncoding = ImageEncoding()):
+        self.directory = directory
+        self.encoding = encoding
+        self.log = logging.getLogger('quickstrom.screenshots')
+        self._screenshots: Dict[str, result.Screenshot[result.StoredImage]] = {}
+        self._seen: Set[str] = set()
+        self._pending: Set[Future] = set()
+        self._error: Optional[Exception] = None
+        self._lock = threading.Lock()
+        self._worker = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='quickstrom-screenshots')
+        os.makedirs(directory, exist_ok=True)
+
+    def should_capture(self, hash: str) -> bool:
+        """Returns whether no screenshot has been added for the hash yet."""
+        with self._lock:
+            return hash not in self._seen
+
+    def add(self, hash: str, image: bytes, window_size: Tuple[int, int]):
+        with self._lock:
+            if hash in self._seen:
+                return
+            self._seen.add(hash)
+            future = self._worker.submit(self._process, hash, image,
+                                         window_size)
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future: Future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def _process(self, hash: str, image: bytes, window_size: Tuple[int,
+                                                                    int]):
+        try:
+            (width, height) = png_dimensions(image)
+            scale = round(width / window_size[0])
+            if scale != round(height / window_size[1]):
+                self.log.warning(
+                    "Width and height scales do not match for screenshot")
+            digest = hashlib.sha256(image).hexdigest()
+            stored = self._write(f"{digest}.{self.encoding.format}",
+                                 lambda: encode_image(image, self.encoding,
+                                                      None))
+            thumbnail = self._write(
+                f"{digest}.thumbnail.{self.encoding.format}",
+                lambda: encode_image(image, self.encoding, self.encoding.
+                                     thumbnail_width)
+            ) if self.encoding.thumbnail_width is not None else None
+            with self._lock:
+                self._screenshots[hash] = result.Screenshot(
+                    image=stored,
+                    width=width,
+                    height=height,
+                    scale=scale,
+                    thumbnail=thumbnail)
+        except Exception as e:
+            self.log.error(f"Could not process screenshot {hash}: {e}")
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+
+    def _write(self, name: str,
+               encode: Callable[[], bytes]) -> result.StoredImage:
+        """Writes an image unless already stored, digesting the stored bytes."""
+        path = self.directory / name
+        if path.exists():
+            data = path.read_bytes()
+        else:
+            data = encode()
+            tmp = self.directory / f"{name}.tmp"
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        return result.StoredImage(path, hashlib.sha256(data).hexdigest())
+
+    def get(self, hash: str) -> Optional[result.Screenshot[result.StoredImage]]:
+        with self._lock:
+            return self._screenshots.get(hash)
+
+    def flush(self):
+        """Waits for all added screenshots to be stored."""
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if len(pending) == 0:
+                break
+            for future in pending:
+                future.result()
+        self._raise_error()
+
+    def close(self):
+        self._worker.shutdown(wait=True)
+        self._raise_error()
+
+    def _raise_error(self):
+        with self._lock:
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
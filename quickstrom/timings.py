@@ -0,0 +1,97 @@
+"""
+Timings of the phases of a check, to see where the time goes: starting
+browsers, loading pages, performing actions, querying state, taking
+screenshots, and waiting for Specstrom.
+"""
+
+import contextlib
+import functools
+import json
+import math
+import threading
+import time
+from typing import (Any, Callable, Dict, Iterator, List, Optional, TypeVar,
+                    Union, Literal)
+
+from quickstrom.tracing import Tracer
+
+T = TypeVar('T')
+
+Phase = Union[Literal['check'], Literal['driver-start'],
+              Literal['driver-reuse'], Literal['driver-release'],
+              Literal['page-load'], Literal['action'], Literal['query'],
+              Literal['await-events'], Literal['screenshot'],
+              Literal['specstrom']]
+
+
+class PhaseTimings(object):
+    """
+    Durations in seconds, sampled per phase, from any thread. Measured
+    phases are traced as well, if a tracer is given.
+    """
+    def __init__(self, tracer: Optional[Tracer] = None):
+        self.samples: Dict[str, List[float]] = {}
+        self.tracer = tracer or Tracer()
+        self._lock = threading.Lock()
+
+    def record(self, phase: Phase, seconds: float):
+        with self._lock:
+            self.samples.setdefault(phase, []).append(seconds)
+
+    @contextlib.contextmanager
+    def measure(self, phase: Phase) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start)
+            self.tracer.complete(phase, 'phase', start)
+
+    def timed(self, phase: Phase) -> Callable[[Callable[..., T]], Callable[..., T]]:
+        """A decorator measuring each call of a function."""
+        def decorator(f: Callable[..., T]) -> Callable[..., T]:
+            @functools.wraps(f)
+            def g(*args: Any, **kwargs: Any) -> T:
+                with self.measure(phase):
+                    return f(*args, **kwargs)
+
+            return g
+
+        return decorator
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                phase: summarize(samples)
+                for phase, samples in self.samples.items()
+            }
+
+    def save(self, path: str):
+        with self._lock:
+            samples = {phase: list(s) for phase, s in self.samples.items()}
+        with open(path, 'w') as f:
+            json.dump({'samples': samples}, f, indent=2)
+
+
+def load_samples(path: str) -> Dict[str, List[float]]:
+    with open(path) as f:
+        return json.load(f)['samples']
+
+
+def percentile(samples: List[float], p: float) -> float:
+    """The nearest-rank percentile of samples, sorted or not."""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    return {
+        'count': len(samples),
+        'total': sum(samples),
+        'mean': sum(samples) / len(samples),
+        'p50': percentile(samples, 50),
+        'p90': percentile(samples, 90),
+        'p99': percentile(samples, 99),
+        'max': max(samples),
+    }
@@ -0,0 +1,95 @@
+"""
+Opt-in tracing of a check, written in the Chrome trace event format, to
+be opened in `chrome://tracing`, Perfetto, or speedscope.
+
+Spans are recorded for protocol messages, WebDriver commands, client-side
+script calls, screenshots, and reporters, on the thread they ran on.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class Tracer(object):
+    """Records spans when enabled, and does nothing otherwise."""
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.events: List[Dict[str, Any]] = []
+        self.thread_names: Dict[int, str] = {}
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def now(self) -> float:
+        return time.perf_counter()
+
+    def complete(self,
+                 name: str,
+                 category: str,
+                 start: float,
+                 args: Optional[Dict[str, Any]] = None):
+        """Records a span from `start`, as returned by `now`, until now."""
+        if not self.enabled:
+            return
+        end = time.perf_counter()
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': thread.ident,
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self.events.append(event)
+            self.thread_names[thread.ident or 0] = thread.name
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, **args: Any) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.complete(name, category, start, args)
+
+    def save(self, path: str):
+        with self._lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+        metadata = [{
+            'name': 'thread_name',
+            'ph': 'M',
+            'pid': os.getpid(),
+            'tid': tid,
+            'args': {
+                'name': name
+            }
+        } for tid, name in thread_names.items()]
+        with open(path, 'w') as f:
+            json.dump({
+                'traceEvents': metadata + events,
+                'displayTimeUnit': 'ms'
+            }, f)
+
+
+def trace_commands(driver: Any, tracer: Tracer):
+    """Records a span for each WebDriver command sent by the driver."""
+    if not tracer.enabled or not hasattr(driver, 'execute'):
+        return
+    execute = driver.execute
+
+    def traced_execute(command: str, params: Any = None) -> Any:
+        with tracer.span(command, 'webdriver'):
+            return execute(command, params)
+
+    driver.execute = traced_execute
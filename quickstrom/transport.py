@@ -0,0 +1,287 @@
+"""
+How the executor talks to a browser: running the client-side scripts,
+taking screenshots, and performing actions on elements by ref.
+"""
+
+import base64
+import json
+import threading
+import weakref
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, Union
+
+from selenium.common.exceptions import StaleElementReferenceException
+from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.webdriver.remote.webelement import WebElement
+
+from quickstrom.cdp import CdpClient, page_websocket_url
+
+Transport = Union[Literal['selenium'], Literal['cdp']]
+
+# Returned by scripts when the client-side bundle is not installed in the
+# current document.
+not_installed = {'quickstromNotInstalled': True}
+
+
+def bundle_call_script(name: str, is_async: bool = False) -> str:
+    """A script calling a function of the installed client-side bundle."""
+    if is_async:
+        return (
+            f"var q = window.quickstrom; if (q && q.{name}) {{ q.{name}.apply(null, arguments); }} "
+            f"else {{ arguments[arguments.length - 1]({json.dumps(not_installed)}); }}"
+        )
+    else:
+        return f"var q = window.quickstrom; return q && q.{name} ? q.{name}.apply(null, arguments) : {json.dumps(not_installed)};"
+
+
+def stale(ref: str) -> StaleElementReferenceException:
+    return StaleElementReferenceException(
+        f"Element {ref} is no longer in the document")
+
+
+class SeleniumTransport():
+    """
+    Talks to the browser through WebDriver, one HTTP request per call.
+    Elements are resolved by ref once and then reused, as a ref names the
+    same element for the lifetime of its document.
+    """
+    max_cached_elements = 1000
+
+    def __init__(self, driver: WebDriver):
+        self.driver = driver
+        self.elements: Dict[str, WebElement] = {}
+
+    def execute_script(self, script: str, *args: Any) -> Any:
+        return self.driver.execute_script(script, *args)
+
+    def execute_async_script(self, script: str, *args: Any) -> Any:
+        return self.driver.execute_async_script(script, *args)
+
+    def screenshot(self) -> bytes:
+        return self.driver.get_screenshot_as_png()    # type: ignore
+
+    def resolve(self, ref: str) -> WebElement:
+        r = self.driver.execute_script(bundle_call_script('resolveRef'), ref)
+        if not isinstance(r, WebElement):
+            raise stale(ref)
+        if len(self.elements) >= self.max_cached_elements:
+            self.elements.clear()
+        self.elements[ref] = r
+        return r
+
+    def with_element(self, ref: str, action: Callable[[WebElement], None]):
+        """
+        Performs an action on the element with the given ref. A cached
+        element that has gone stale (e.g. detached and attached again) is
+        resolved again before giving up.
+        """
+        element = self.elements.get(ref)
+        if element is not None:
+            try:
+                action(element)
+                return
+            except StaleElementReferenceException:
+                del self.elements[ref]
+        action(self.resolve(ref))
+
+    def click(self, ref: str):
+        self.with_element(
+            ref, lambda element: ActionChains(self.driver).move_to_element(
+                element).click(element).perform())
+
+    def double_click(self, ref: str):
+        self.with_element(
+            ref, lambda element: ActionChains(self.driver).move_to_element(
+                element).double_click(element).perform())
+
+    def focus(self, ref: str):
+        self.with_element(ref, lambda element: element.send_keys(""))
+
+    def send_keys(self, keys: str):
+        self.driver.switch_to.active_element.send_keys(keys)
+
+    def send_keys_to(self, ref: str, keys: str):
+        self.with_element(ref, lambda element: element.send_keys(keys))
+
+    def clear(self, ref: str):
+        self.with_element(ref, lambda element: element.clear())
+
+    def close(self):
+        self.elements.clear()
+
+
+# DevTools key definitions for the WebDriver special keys in
+# ulib/quickstrom/keys.strom: (key, code, virtual key code, text).
+cdp_keys: Dict[str, Tuple[str, str, int, Optional[str]]] = {
+    '\ue003': ('Backspace', 'Backspace', 8, None),
+    '\ue004': ('Tab', 'Tab', 9, None),
+    '\ue006': ('Enter', 'Enter', 13, '\r'),
+    '\ue007': ('Enter', 'Enter', 13, '\r'),
+    '\ue00c': ('Escape', 'Escape', 27, None),
+    '\ue00d': (' ', 'Space', 32, ' '),
+    '\ue00e': ('PageUp', 'PageUp', 33, None),
+    '\ue00f': ('PageDown', 'PageDown', 34, None),
+    '\ue010': ('End', 'End', 35, None),
+    '\ue011': ('Home', 'Home', 36, None),
+    '\ue012': ('ArrowLeft', 'ArrowLeft', 37, None),
+    '\ue013': ('ArrowUp', 'ArrowUp', 38, None),
+    '\ue014': ('ArrowRight', 'ArrowRight', 39, None),
+    '\ue015': ('ArrowDown', 'ArrowDown', 40, None),
+    '\ue016': ('Insert', 'Insert', 45, None),
+    '\ue017': ('Delete', 'Delete', 46, None),
+}
+
+
+class CdpTransport():
+    """
+    Talks to the page through the DevTools Protocol, over one persistent
+    WebSocket connection. Scripts are evaluated in the page, awaiting
+    promises for asynchronous scripts, and input is dispatched as mouse
+    and key events. Commands that don't depend on each other's results
+    are pipelined.
+    """
+    def __init__(self, client: CdpClient):
+        self.client = client
+
+    def execute_script(self, script: str, *args: Any) -> Any:
+        return self.client.evaluate(
+            f"(function() {{ {script} }}).apply(null, {json.dumps(list(args))})"
+        )
+
+    def execute_async_script(self, script: str, *args: Any) -> Any:
+        return self.client.evaluate(
+            f"new Promise(function(resolve) {{ (function() {{ {script} }}).apply(null, {json.dumps(list(args))}.concat([resolve])); }})",
+            await_promise=True)
+
+    def screenshot(self) -> bytes:
+        r = self.client.command('Page.captureScreenshot', format='png')
+        return base64.b64decode(r['data'])
+
+    def with_element(self, ref: str, body: str) -> Any:
+        """Runs a function body with the element as `el`, or fails if stale."""
+        r = self.execute_script(
+            "var q = window.quickstrom; var el = q && q.resolveRef(arguments[0]); "
+            f"if (!el) {{ return {{stale: true}}; }} {body}", ref)
+        if isinstance(r, dict) and r.get('stale'):
+            raise stale(ref)
+        return r
+
+    def click(self, ref: str, click_count: int = 1):
+        center = self.with_element(
+            ref, "el.scrollIntoView({block: 'center', inline: 'center'}); "
+            "var r = el.getBoundingClientRect(); "
+            "return {x: r.left + r.width / 2, y: r.top + r.height / 2};")
+        x, y = center['x'], center['y']
+        commands = [
+            self.client.submit('Input.dispatchMouseEvent',
+                               type='mouseMoved',
+                               x=x,
+                               y=y)
+        ]
+        for count in range(1, click_count + 1):
+            for type in ['mousePressed', 'mouseReleased']:
+                commands.append(
+                    self.client.submit('Input.dispatchMouseEvent',
+                                       type=type,
+                                       x=x,
+                                       y=y,
+                                       button='left',
+                                       clickCount=count))
+        for command in commands:
+            command.result()
+
+    def double_click(self, ref: str):
+        self.click(ref, click_count=2)
+
+    def focus(self, ref: str):
+        self.with_element(ref, "el.focus();")
+
+    def send_keys(self, keys: str):
+        commands: List[Any] = []
+
+        def insert_text(text: str):
+            if text:
+                commands.append(
+                    self.client.submit('Input.insertText', text=text))
+
+        text = ''
+        for char in keys:
+            if char not in cdp_keys:
+                text += char
+                continue
+            insert_text(text)
+            text = ''
+            key, code, virtual_key_code, key_text = cdp_keys[char]
+            for type in ['keyDown', 'keyUp']:
+                params: Dict[str, Any] = dict(
+                    type=type,
+                    key=key,
+                    code=code,
+                    windowsVirtualKeyCode=virtual_key_code)
+                if type == 'keyDown' and key_text is not None:
+                    params['text'] = key_text
+                commands.append(
+                    self.client.submit('Input.dispatchKeyEvent', **params))
+        insert_text(text)
+        for command in commands:
+            command.result()
+
+    def send_keys_to(self, ref: str, keys: str):
+        self.focus(ref)
+        self.send_keys(keys)
+
+    def clear(self, ref: str):
+        # The value is set through the native setter, bypassing any setter
+        # that a framework (e.g. React) defines on the element, so that the
+        # framework sees the input event as a change.
+        self.with_element(
+            ref, "el.focus(); "
+            "if (el.isContentEditable) { el.textContent = ''; } else { "
+            "var proto = el instanceof HTMLTextAreaElement ? HTMLTextAreaElement.prototype : HTMLInputElement.prototype; "
+            "Object.getOwnPropertyDescriptor(proto, 'value').set.call(el, ''); } "
+            "el.dispatchEvent(new Event('input', {bubbles: true})); "
+            "el.dispatchEvent(new Event('change', {bubbles: true}));")
+
+    def close(self):
+        self.client.close()
+
+
+BrowserTransport = Union[SeleniumTransport, CdpTransport]
+
+
+def connect_transport(driver: WebDriver,
+                      transport: Transport) -> BrowserTransport:
+    if transport == 'cdp':
+        address = driver.capabilities.get('goog:chromeOptions',
+                                          {}).get('debuggerAddress')
+        if address is None:
+            raise Exception("The cdp transport requires Chrome")
+        return CdpTransport(
+            CdpClient(page_websocket_url(address,
+                                         driver.current_window_handle)))
+    else:
+        return SeleniumTransport(driver)
+
+
+class Transports():
+    """The transport of each browser, connected on first use."""
+    def __init__(self, connect: Callable[[WebDriver], BrowserTransport]):
+        self.connect = connect
+        self.transports: 'weakref.WeakKeyDictionary[WebDriver, BrowserTransport]' = weakref.WeakKeyDictionary(
+        )
+        self._lock = threading.Lock()
+
+    def get(self, driver: WebDriver) -> BrowserTransport:
+        with self._lock:
+            transport = self.transports.get(driver)
+        if transport is None:
+            transport = self.connect(driver)
+            with self._lock:
+                self.transports[driver] = transport
+        return transport
+
+    def close(self, driver: WebDriver):
+        with self._lock:
+            transport = self.transports.pop(driver, None)
+        if transport is not None:
+            transport.close()
@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+import pytest
+
+from quickstrom.batch import (Job, load_manifest, run_jobs, save_durations,
+                              load_durations, schedule)
+from quickstrom.executor import StorageState
+
+
+def test_load_manifest_with_defaults(tmp_path):
+    path = tmp_path / 'manifest.json'
+    path.write_text(
+        json.dumps([{
+            'module': 'todomvc',
+            'origin': 'http://localhost/react'
+        }, {
+            'name': 'vue',
+            'module': 'todomvc',
+            'origin': 'http://localhost/vue',
+            'expected': 'failed'
+        }]))
+    assert load_manifest(str(path)) == [
+        Job('http://localhost/react', 'todomvc', 'http://localhost/react'),
+        Job('vue', 'todomvc', 'http://localhost/vue', 'failed'),
+    ]
+
+
+def test_load_manifest_rejects_unknown_results(tmp_path):
+    path = tmp_path / 'manifest.json'
+    path.write_text(
+        json.dumps([{
+            'module': 'm',
+            'origin': 'http://localhost',
+            'expected': 'flaky'
+        }]))
+    with pytest.raises(ValueError):
+        load_manifest(str(path))
+
+
+def test_load_manifest_rejects_names_sharing_a_log_file(tmp_path):
+    path = tmp_path / 'manifest.json'
+    path.write_text(
+        json.dumps([{
+            'name': name,
+            'module': 'm',
+            'origin': 'http://localhost'
+        } for name in ['a b', 'a_b']]))
+    with pytest.raises(ValueError, match='a b, a_b'):
+        load_manifest(str(path))
+
+
+def test_schedules_longest_and_unknown_jobs_first():
+    jobs = [Job(name, 'm', 'http://localhost') for name in 'abcd']
+    scheduled = schedule(jobs, {'a': 1.0, 'b': 10.0, 'd': 5.0})
+    assert [job.name for job in scheduled] == ['c', 'b', 'd', 'a']
+
+
+@pytest.mark.parametrize('reuse_browser', [True, False])
+def test_runs_jobs(tmp_path, reuse_browser, counting_check, created_drivers):
+    def make_check(job, ilog):
+        return counting_check(job.module, job.origin, 'chrome', [], True,
+                              False, StorageState([]), None, ilog,
+                              screenshot_directory=tmp_path,
+                              reuse_browser=reuse_browser)
+
+    jobs = [
+        Job('a', 'fake', 'http://localhost'),
+        Job('b', 'fake', 'http://localhost', 'failed'),
+        Job('c', 'fake', 'http://localhost'),
+    ]
+    job_results = asyncio.run(
+        run_jobs(jobs, make_check, str(tmp_path / 'logs'), max_jobs=2))
+    assert [(r.job.name, r.outcome, r.is_expected())
+            for r in job_results] == [('a', 'passed', True),
+                                      ('b', 'passed', False),
+                                      ('c', 'passed', True)]
+    if reuse_browser:
+        assert 1 <= len(created_drivers) <= 2
+        assert all(d.commands[-1] == 'quit' for d in created_drivers)
+    else:
+        assert len(created_drivers) == 3
+        assert all(d.commands[-1] == 'close' for d in created_drivers)
+
+    durations_file = str(tmp_path / 'durations.json')
+    save_durations(durations_file, job_results)
+    assert set(load_durations(durations_file)) == {'a', 'b', 'c'}
@@ -0,0 +1,182 @@
+import asyncio
+import base64
+import hashlib
+import http.server
+import json
+import struct
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+
+import pytest
+import websocket
+from selenium.common.exceptions import StaleElementReferenceException
+
+from quickstrom.cdp import CdpClient, CdpError, page_websocket_url
+from quickstrom.transport import CdpTransport
+
+
+def accept_key(key: str) -> str:
+    digest = hashlib.sha1(
+        (key + '258EAFA5-E914-47DA-95CA-C5AB0DC85B11').encode()).digest()
+    return base64.b64encode(digest).decode()
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    """Reads a masked frame sent by a client."""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        (length, ) = struct.unpack('>H', await reader.readexactly(2))
+    elif length == 127:
+        (length, ) = struct.unpack('>Q', await reader.readexactly(8))
+    key = await reader.readexactly(4)
+    payload = await reader.readexactly(length)
+    return (first & 0x0F, websocket.ABNF.mask(key, payload))
+
+
+def text_frame(text: str) -> bytes:
+    return websocket.ABNF(1, 0, 0, 0, websocket.ABNF.OPCODE_TEXT, 0,
+                          text.encode()).format()
+
+
+class StandInBrowser():
+    """
+    Plays the browser's side of a DevTools connection, answering commands
+    with recorded results.
+    """
+    def __init__(self, responses: Dict[str, Callable[[Any], Any]]):
+        self.responses = responses
+        self.received: List[Dict[str, Any]] = []
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self.serve, '127.0.0.1', 0, limit=2**26))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/devtools/page/1"
+
+    async def serve(self, reader: asyncio.StreamReader,
+                    writer: asyncio.StreamWriter):
+        request = (await reader.readuntil(b'\r\n\r\n')).decode()
+        key = next(
+            line.split(':', 1)[1].strip() for line in request.split('\r\n')
+            if line.lower().startswith('sec-websocket-key'))
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                      "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n"
+                      ).encode())
+        while True:
+            try:
+                opcode, payload = await read_frame(reader)
+            except asyncio.IncompleteReadError:
+                break
+            if opcode == 0x8:
+                break
+            msg = json.loads(payload)
+            self.received.append(msg)
+            respond = self.responses.get(msg['method'])
+            if respond is None:
+                reply = {'id': msg['id'], 'error': {'message': 'Unknown method'}}
+            else:
+                reply = {'id': msg['id'], 'result': respond(msg['params'])}
+            writer.write(text_frame(json.dumps(reply)))
+        writer.close()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+@pytest.fixture
+def browser():
+    # Element lookups find an element at (10, 20), and other expressions
+    # evaluate to themselves.
+    def evaluate(params):
+        if 'resolveRef' in params['expression']:
+            return {'result': {'type': 'object', 'value': {'x': 10, 'y': 20}}}
+        return {'result': {'type': 'string', 'value': params['expression']}}
+
+    b = StandInBrowser({
+        'Runtime.evaluate': evaluate,
+        'Page.captureScreenshot': lambda _: {'data': base64.b64encode(b'png').decode()},
+        'Input.dispatchMouseEvent': lambda _: {},
+    })
+    yield b
+    b.close()
+
+
+def test_evaluates_large_expressions(browser):
+    client = CdpClient(browser.url)
+    expression = 'x' * 100000
+    assert client.evaluate(expression) == expression
+    client.close()
+
+
+def test_reports_command_errors(browser):
+    client = CdpClient(browser.url)
+    with pytest.raises(CdpError):
+        client.command('Page.crash')
+    client.close()
+
+
+def test_pipelines_commands(browser):
+    client = CdpClient(browser.url)
+    futures = [client.submit('Runtime.evaluate', expression=str(i)) for i in range(10)]
+    assert [f.result()['result']['value'] for f in futures] == [str(i) for i in range(10)]
+    client.close()
+
+
+def test_transport_screenshots_and_clicks(browser):
+    transport = CdpTransport(CdpClient(browser.url))
+    assert transport.screenshot() == b'png'
+    transport.click('ref1')
+    mouse_events = [(m['params']['type'], m['params']['x'], m['params']['y'])
+                    for m in browser.received
+                    if m['method'] == 'Input.dispatchMouseEvent']
+    assert mouse_events == [('mouseMoved', 10, 20), ('mousePressed', 10, 20),
+                            ('mouseReleased', 10, 20)]
+    transport.close()
+
+
+def test_transport_raises_stale_for_missing_refs(browser):
+    transport = CdpTransport(CdpClient(browser.url))
+    browser.responses['Runtime.evaluate'] = lambda _: {
+        'result': {'type': 'object', 'value': {'stale': True}}
+    }
+    with pytest.raises(StaleElementReferenceException):
+        transport.focus('gone')
+    transport.close()
+
+
+def test_finds_the_page_of_the_driver_window():
+    targets = [{
+        'id': id,
+        'type': 'page',
+        'webSocketDebuggerUrl': f"ws://localhost/devtools/page/{id}"
+    } for id in ['A1', 'B2']]
+
+    class TargetList(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(targets).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = http.server.HTTPServer(('127.0.0.1', 0), TargetList)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    address = f"127.0.0.1:{server.server_address[1]}"
+    try:
+        assert page_websocket_url(address, 'B2').endswith('/B2')
+        assert page_websocket_url(address, 'CDwindow-b2').endswith('/B2')
+        with pytest.raises(CdpError):
+            page_websocket_url(address, 'C3')
+    finally:
+        server.shutdown()
+        server.server_close()
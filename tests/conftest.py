@@ -0,0 +1,23 @@
+from typing import List, Type
+
+import pytest
+
+from .executor_test import FakeDriver, FakeSpecstromCheck
+
+
+@pytest.fixture
+def created_drivers() -> List[FakeDriver]:
+    """The fake drivers started by `counting_check`, in order."""
+    return []
+
+
+@pytest.fixture
+def counting_check(
+        created_drivers: List[FakeDriver]) -> Type[FakeSpecstromCheck]:
+    """A fake check class recording every driver it starts."""
+    class CountingCheck(FakeSpecstromCheck):
+        def new_driver(self):
+            created_drivers.append(FakeDriver(len(created_drivers)))
+            return created_drivers[-1]
+
+    return CountingCheck
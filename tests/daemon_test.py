@@ -0,0 +1,95 @@
+import asyncio
+import os
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from quickstrom.daemon import (Daemon, UntrustedSocket, decode_result,
+                               encode_result, submit)
+from quickstrom.executor import StorageState
+import quickstrom.protocol as protocol
+import quickstrom.result as result
+
+
+def test_result_roundtrip():
+    image = result.StoredImage(Path('/tmp/screenshots/abc.png'), 'abc')
+    state = result.State('h1', {'.x': [{'text': 'x'}]},
+                         result.Screenshot(image, 10, 20, 2), {'.x': ['d1']})
+    r = result.Errored([
+        result.Test(protocol.Validity('Probably', True), [
+            result.StateTransition(None, state, [
+                protocol.Action('loaded', [], True, None)
+            ])
+        ])
+    ], result.Test(protocol.Validity('Definitely', False), [
+        result.ErrorTransition(state, [protocol.Action('click', ['.x'], False, 100)],
+                               'oops')
+    ]))
+    assert decode_result(encode_result(r)) == r
+
+
+def test_refuses_sockets_not_owned_by_user(tmp_path):
+    not_a_socket = tmp_path / 'quickstrom.sock'
+    not_a_socket.write_text('')
+    with pytest.raises(UntrustedSocket):
+        list(submit(str(not_a_socket), {}))
+
+
+def wait_for(path: Path, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while not path.exists():
+        assert time.monotonic() < deadline, f"{path} was not created in time"
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize('reuse_browser', [True, False])
+def test_runs_jobs_reusing_browsers_only_when_asked(tmp_path, reuse_browser,
+                                                    counting_check,
+                                                    created_drivers):
+    def make_check(request, ilog):
+        return counting_check(request['module'],
+                              request['origin'],
+                              'chrome',
+                              [],
+                              True,
+                              False,
+                              StorageState([]),
+                              None,
+                              ilog,
+                              screenshot_directory=tmp_path,
+                              reuse_browser=request['reuseBrowser'])
+
+    socket_path = str(tmp_path / 'quickstrom.sock')
+    daemon = Daemon(socket_path, make_check)
+    loop = asyncio.new_event_loop()
+    serving = loop.create_task(daemon.serve())
+    thread = threading.Thread(target=loop.run_until_complete,
+                              args=(asyncio.wait([serving]), ))
+    thread.start()
+    try:
+        wait_for(tmp_path / 'quickstrom.sock')
+        assert os.stat(socket_path).st_mode & 0o077 == 0
+        request = {
+            'module': 'fake',
+            'origin': 'http://localhost',
+            'interpreterLogFile': str(tmp_path / 'interpreter.log'),
+            'reuseBrowser': reuse_browser
+        }
+        for _ in range(2):
+            responses = list(submit(socket_path, request))
+            assert [r['tag'] for r in responses] == ['result', 'done']
+            assert isinstance(decode_result(responses[0]['result']),
+                              result.Passed)
+    finally:
+        loop.call_soon_threadsafe(serving.cancel)
+        thread.join()
+        loop.close()
+    if reuse_browser:
+        assert len(created_drivers) == 1
+        assert created_drivers[0].commands[-1] == 'quit'
+    else:
+        assert len(created_drivers) == 2
+        assert all(d.commands[-1] == 'close' for d in created_drivers)
+    assert not (tmp_path / 'quickstrom.sock').exists()
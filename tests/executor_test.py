@@ -0,0 +1,359 @@
+import asyncio
+import sys
+import tempfile
+from typing import Any, List, cast
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.remote.webdriver import WebDriver
+from quickstrom.executor import (Check, ClientSideEvents, Cookie, DriverPool,
+                                 Scripts, StorageState, apply_state_delta,
+                                 load_storage_state, save_storage_state)
+from quickstrom.transport import Transports
+import quickstrom.protocol as protocol
+import quickstrom.result as result
+
+from .screenshots_test import png_image
+
+
+class FakeDriver():
+    def __init__(self, n: int):
+        self.n = n
+        self.commands: List[str] = []
+
+    def execute_script(self, script: str, *args: Any):
+        self.commands.append('execute_script')
+
+    def delete_all_cookies(self):
+        self.commands.append('delete_all_cookies')
+
+    def add_cookie(self, cookie: Any):
+        self.commands.append('add_cookie')
+
+    def get(self, url: str):
+        self.commands.append(f"get {url}")
+
+    def set_window_size(self, width: int, height: int):
+        pass
+
+    def close(self):
+        self.commands.append('close')
+
+    def quit(self):
+        self.commands.append('quit')
+
+
+def fake_driver_factory(created: List[FakeDriver]):
+    def new_driver() -> WebDriver:
+        driver = FakeDriver(len(created))
+        created.append(driver)
+        return cast(WebDriver, driver)
+
+    return new_driver
+
+
+def test_pool_reuses_reset_browsers():
+    created: List[FakeDriver] = []
+    pool = DriverPool(fake_driver_factory(created), reuse=True)
+    first, first_reused = pool.acquire()
+    pool.release(first)
+    second, second_reused = pool.acquire()
+    assert second is first
+    assert not first_reused and second_reused
+    assert len(created) == 1
+    assert created[0].commands == [
+        'execute_script', 'delete_all_cookies', 'get about:blank'
+    ]
+    pool.release(second)
+    pool.close()
+    assert created[0].commands[-1] == 'quit'
+
+
+def test_pool_without_reuse_starts_fresh_browsers():
+    created: List[FakeDriver] = []
+    pool = DriverPool(fake_driver_factory(created), reuse=False)
+    first, _ = pool.acquire()
+    pool.release(first)
+    second, reused = pool.acquire()
+    assert second is not first and not reused
+    assert created[0].commands == ['close']
+
+
+def test_storage_state_roundtrip(tmp_path):
+    state = StorageState([Cookie('example.com', 'session', 'abc')],
+                         local_storage={'todos': '[]'},
+                         session_storage={'tab': '1'})
+    path = str(tmp_path / 'state.json')
+    save_storage_state(state, path)
+    assert load_storage_state(path) == state
+
+
+def test_apply_full_state_delta():
+    delta = {
+        'base': None,
+        'id': 1,
+        'unchanged': [],
+        'queries': {
+            'li': [{
+                'ref': 'a',
+                'textContent': 'foo'
+            }]
+        }
+    }
+    assert apply_state_delta(None, delta) == delta['queries']
+
+
+def test_apply_state_delta():
+    previous = {
+        'li': [{
+            'ref': 'a',
+            'textContent': 'foo'
+        }, {
+            'ref': 'b',
+            'textContent': 'bar'
+        }],
+        'button': [{
+            'ref': 'c',
+            'enabled': True
+        }],
+    }
+    delta = {
+        'base': 1,
+        'id': 2,
+        'unchanged': ['button'],
+        'queries': {
+            'li': [1, {
+                'ref': 'd',
+                'textContent': 'baz'
+            }]
+        }
+    }
+    state = apply_state_delta(previous, delta)
+    assert state == {
+        'li': [{
+            'ref': 'b',
+            'textContent': 'bar'
+        }, {
+            'ref': 'd',
+            'textContent': 'baz'
+        }],
+        'button': [{
+            'ref': 'c',
+            'enabled': True
+        }],
+    }
+    assert state['li'][0] is previous['li'][1]
+
+
+class RecordingTransport():
+    def __init__(self):
+        self.calls: List[Any] = []
+
+    def execute_script(self, script: str, *args: Any):
+        self.calls.append(args)
+        return {
+            'base': None,
+            'id': 1,
+            'seq': 41,
+            'unchanged': [],
+            'queries': {
+                '.foo': []
+            }
+        }
+
+    def execute_async_script(self, script: str, *args: Any):
+        self.calls.append(args)
+        return None
+
+
+def test_awaits_events_after_the_last_state(tmp_path, monkeypatch):
+    (tmp_path / 'quickstrom.js').write_text('')
+    monkeypatch.setenv('QUICKSTROM_CLIENT_SIDE_DIRECTORY', str(tmp_path))
+    transport = RecordingTransport()
+    check = Check('fake', 'http://localhost', 'chrome', [], True, False,
+                  StorageState([]), None, cast(Any, None))
+    scripts = check.load_scripts(Transports(lambda driver: transport))
+    driver = FakeDriver(0)
+    deps = {'.foo': {}}
+    scripts.await_events(driver, deps, 100)
+    assert transport.calls[-1] == (deps, 100, None, None)
+    assert scripts.observe(driver, deps) == {'.foo': []}
+    assert scripts.await_events(driver, deps, 100) is None
+    assert transport.calls[-1] == (deps, 100, 41, 1)
+
+
+# Plays Specstrom's part in a session: awaits the initial events,
+# performs an action, sends a stale request, and ends.
+fake_specstrom = """
+import json, sys
+def send(msg):
+    print(json.dumps(msg), flush=True)
+def receive():
+    return json.loads(sys.stdin.readline())
+noop = {'id': 'noop', 'args': [], 'isEvent': False, 'timeout': None}
+send({'tag': 'Start', 'dependencies': {'.foo': {}}})
+events = receive()
+assert events['tag'] == 'Events', events
+send({'tag': 'RequestAction', 'action': noop, 'version': 1})
+assert receive()['tag'] == 'Performed'
+send({'tag': 'RequestAction', 'action': noop, 'version': 1})
+assert receive()['tag'] == 'Stale'
+send({'tag': 'End'})
+state = events['contents'][1]
+send({'tag': 'Done', 'results': [{
+    'tag': 'RunResult',
+    'valid': {'tag': 'Definitely', 'contents': True},
+    'trace': [{'tag': 'TraceAction', 'contents': [noop]},
+              {'tag': 'TraceState', 'contents': state}]}]})
+"""
+
+
+class FakeSpecstromCheck(Check):
+    def load_scripts(self, transports) -> Scripts:
+        state = {'.foo': [{'ref': 'a'}]}
+        loaded = protocol.Action('loaded', [], True, None)
+        return Scripts(
+            query_state=lambda driver, deps: state,
+            observe=lambda driver, deps: state,
+            await_events=lambda driver, deps, timeout:
+            ClientSideEvents([loaded], state),
+            await_ready=lambda driver, strategy: True,
+        )
+
+    def new_driver(self):
+        return FakeDriver(0)
+
+    async def launch_specstrom(self, ilog):
+        return await asyncio.create_subprocess_exec(
+            sys.executable,
+            '-c',
+            fake_specstrom,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=ilog,
+            stdin=asyncio.subprocess.PIPE)
+
+
+def test_executes_sessions_against_specstrom(tmp_path):
+    with open(tmp_path / 'interpreter.log', 'w+') as ilog:
+        results = FakeSpecstromCheck('fake',
+                                     'http://localhost',
+                                     'chrome',
+                                     [],
+                                     True,
+                                     False,
+                                     StorageState([]),
+                                     None,
+                                     ilog,
+                                     screenshot_directory=tmp_path).execute()
+    [r] = results
+    assert isinstance(r, result.Passed)
+    [transition] = r.passed_tests[0].transitions
+    assert isinstance(transition, result.StateTransition)
+    assert transition.to_state.queries == {'.foo': [{'ref': 'a'}]}
+
+
+def test_retries_sessions_failing_to_start_in_another_browser(
+        tmp_path, counting_check, created_drivers):
+    class FirstBrowserFailsCheck(counting_check):
+        def new_driver(self):
+            driver = super().new_driver()
+            if driver.n == 0:
+
+                def get(url: str):
+                    raise WebDriverException("session deleted")
+
+                driver.get = get
+            return driver
+
+    with open(tmp_path / 'interpreter.log', 'w+') as ilog:
+        results = FirstBrowserFailsCheck('fake',
+                                         'http://localhost',
+                                         'chrome', [],
+                                         True,
+                                         False,
+                                         StorageState([]),
+                                         None,
+                                         ilog,
+                                         reuse_browser=True).execute()
+    [r] = results
+    assert isinstance(r, result.Passed)
+    [failed, started] = created_drivers
+    assert failed.commands == ['quit']
+    assert started.commands[-1] == 'quit'
+
+
+def test_attaches_screenshots_of_sent_states(tmp_path):
+    class ScreenshotDriver(FakeDriver):
+        def get_screenshot_as_png(self) -> bytes:
+            self.commands.append('screenshot')
+            return png_image(20, 10)
+
+        def get_window_size(self):
+            return {'width': 20, 'height': 10}
+
+    driver = ScreenshotDriver(0)
+
+    class ScreenshotCheck(FakeSpecstromCheck):
+        def new_driver(self):
+            return driver
+
+    with open(tmp_path / 'interpreter.log', 'w+') as ilog:
+        [r] = ScreenshotCheck('fake', 'http://localhost', 'chrome', [], True,
+                              True, StorageState([]), None, ilog,
+                              screenshot_directory=tmp_path).execute()
+    [transition] = r.passed_tests[0].transitions
+    assert isinstance(transition, result.StateTransition)
+    screenshot = transition.to_state.screenshot
+    assert screenshot is not None
+    assert screenshot.image.read_bytes() == png_image(20, 10)
+    assert driver.commands.count('screenshot') == 1
+
+
+def test_creates_no_screenshot_directory_without_screenshots(
+        tmp_path, monkeypatch):
+    temp = tmp_path / 'temp'
+    temp.mkdir()
+    monkeypatch.setattr(tempfile, 'tempdir', str(temp))
+    with open(tmp_path / 'interpreter.log', 'w+') as ilog:
+        FakeSpecstromCheck('fake', 'http://localhost', 'chrome', [], True,
+                           False, StorageState([]), None, ilog).execute()
+    assert list(temp.iterdir()) == []
+
+
+def test_restores_storage_state_at_the_origin_in_reused_browsers(
+        tmp_path, counting_check, created_drivers):
+    with open(tmp_path / 'interpreter.log', 'w+') as ilog:
+        check = counting_check('fake',
+                               'http://localhost',
+                               'chrome', [],
+                               True,
+                               False,
+                               StorageState([Cookie('localhost', 'a', 'b')]),
+                               None,
+                               ilog,
+                               reuse_browser=True,
+                               screenshot_directory=tmp_path)
+        browsers = check.browsers()
+        for _ in range(2):
+            asyncio.run(check.run(browsers))
+        browsers.close()
+    [driver] = created_drivers
+    restore = [
+        'get http://localhost', 'add_cookie', 'execute_script',
+        'get http://localhost'
+    ]
+    reset = ['execute_script', 'delete_all_cookies', 'get about:blank']
+    assert driver.commands == restore + reset + restore + reset + ['quit']
+
+
+def test_records_phase_timings(tmp_path):
+    with open(tmp_path / 'interpreter.log', 'w+') as ilog:
+        check = FakeSpecstromCheck('fake', 'http://localhost', 'chrome', [],
+                                   True, False, StorageState([]), None, ilog,
+                                   screenshot_directory=tmp_path)
+        check.execute()
+    summary = check.timings.summary()
+    assert summary['check']['count'] == 1
+    assert summary['driver-start']['count'] == 1
+    assert summary['page-load']['count'] == 1
+    assert summary['action']['count'] == 1
+    assert summary['query']['count'] == 1
+    assert summary['specstrom']['count'] >= 5
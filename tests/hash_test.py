@@ -0,0 +1,37 @@
+import quickstrom.hash as hash
+import quickstrom.result as result
+
+
+def test_digests_ignore_key_order():
+    a = {'.foo': [{'ref': 'a', 'text': 'x', 'enabled': True}]}
+    b = {'.foo': [{'enabled': True, 'text': 'x', 'ref': 'a'}]}
+    assert hash.state_digests(a) == hash.state_digests(b)
+
+
+def test_digests_differ_per_selector():
+    a = hash.state_digests({'.foo': [{'ref': 'a'}], '.bar': []})
+    b = hash.state_digests({'.foo': [], '.bar': [{'ref': 'a'}]})
+    assert a.state != b.state
+    assert a.selectors['.foo'] == b.selectors['.bar']
+
+
+def test_hasher_reuses_digests_of_shared_elements(monkeypatch):
+    unchanged = {'ref': 'a', 'text': 'x'}
+    first = {'.foo': [unchanged, {'ref': 'b', 'text': 'y'}]}
+    second = {'.foo': [unchanged, {'ref': 'b', 'text': 'z'}]}
+    hasher = hash.StateHasher()
+    hasher.digests(first)
+
+    hashed = []
+    element_digest = hash.element_digest
+    monkeypatch.setattr(hash, 'element_digest',
+                        lambda el: hashed.append(el) or element_digest(el))
+    assert hasher.digests(second) == hash.state_digests(second)
+    assert hashed == [second['.foo'][1], *second['.foo']]
+
+
+def test_diff_states_compares_digests():
+    old = result.from_state({'.foo': [{'ref': 'a', 'text': 'x'}, {'ref': 'b', 'text': 'y'}]})
+    new = result.from_state({'.foo': [{'ref': 'a', 'text': 'x'}, {'ref': 'b', 'text': 'z'}]})
+    (_, diffed) = result.diff_states(old, new)
+    assert [type(d) for d in diffed.queries['.foo']] == [result.Unmodified, result.Modified]
@@ -9,12 +9,12 @@ from hypothesis import given
 
 
 def protocol_result_from_result(r: result.PlainResult) -> protocol.Result:
-    def to_trace(test: result.Test[protocol.JsonLike, bytes]) -> protocol.Trace:
-        def to_state(state: result.State[protocol.JsonLike, bytes]) -> protocol.State:
+    def to_trace(test: result.Test[protocol.JsonLike, result.StoredImage]) -> protocol.Trace:
+        def to_state(state: result.State[protocol.JsonLike, result.StoredImage]) -> protocol.State:
             return state.queries
 
         def to_trace_elements(
-                transition: result.Transition[protocol.JsonLike, bytes]) -> List[protocol.TraceElement]:
+                transition: result.Transition[protocol.JsonLike, result.StoredImage]) -> List[protocol.TraceElement]:
             return [
                 protocol.TraceActions(transition.actions),
                 protocol.TraceState(to_state(transition.to_state))
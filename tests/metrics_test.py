@@ -0,0 +1,58 @@
+import urllib.request
+
+from quickstrom.executor import StorageState
+from quickstrom.metrics import (Histogram, HttpExporter, Metrics,
+                                TextfileExporter)
+
+from .executor_test import FakeSpecstromCheck
+
+
+def test_renders_cumulative_histogram_buckets():
+    h = Histogram('quickstrom_test', 'A test.', [1, 10])
+    for value in [0.5, 1, 5, 50]:
+        h.observe(value)
+    assert h.render() == [
+        '# TYPE quickstrom_test histogram',
+        '# HELP quickstrom_test A test.',
+        'quickstrom_test_bucket{le="1"} 2',
+        'quickstrom_test_bucket{le="10"} 3',
+        'quickstrom_test_bucket{le="+Inf"} 4',
+        'quickstrom_test_count 4',
+        'quickstrom_test_sum 56.5',
+    ]
+
+
+def test_counts_sessions_and_actions(tmp_path):
+    with open(tmp_path / 'interpreter.log', 'w+') as ilog:
+        check = FakeSpecstromCheck('fake', 'http://localhost', 'chrome', [],
+                                   True, False, StorageState([]), None, ilog,
+                                   screenshot_directory=tmp_path)
+        check.execute()
+    m = check.metrics
+    assert m.sessions_started.value == 1
+    assert m.sessions_finished.value == 1
+    assert m.actions.value == 1
+    assert m.stale.value == 1
+    assert m.state_elements.render()[-2] == 'quickstrom_state_elements_count 2'
+
+
+def test_exports_textfile_and_http(tmp_path):
+    m = Metrics()
+    m.actions.inc()
+    path = str(tmp_path / 'quickstrom.prom')
+    exporter = TextfileExporter(m, path, interval=60)
+    exporter.start()
+    exporter.stop()
+    with open(path) as f:
+        text = f.read()
+    assert 'quickstrom_actions_total 1\n' in text
+    assert text.endswith('# EOF\n')
+
+    server = HttpExporter(m, 0)
+    server.start()
+    try:
+        host, port = server.address()
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics") as r:
+            assert r.read().decode() == text
+    finally:
+        server.stop()
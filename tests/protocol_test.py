@@ -0,0 +1,94 @@
+import io
+import json
+import pytest
+import quickstrom.protocol as protocol
+
+available_codecs = []
+for name in protocol.codecs:
+    try:
+        available_codecs.append(protocol.codec_by_name(name))
+    except ImportError:
+        pass
+
+
+def write_and_read_back(codec, framing, messages):
+    buffer = io.BytesIO()
+    writer = protocol.message_writer(buffer, codec, framing)
+    for msg in messages:
+        writer.write(msg)
+    buffer.seek(0)
+    reader = protocol.message_reader(buffer, codec, framing)
+    received = []
+    frame = reader.read_frame()
+    while frame is not None:
+        received.append(frame)
+        frame = reader.read_frame()
+    return received
+
+
+@pytest.mark.parametrize('codec', available_codecs, ids=lambda c: c.name)
+@pytest.mark.parametrize('framing', ['lines', 'length-prefixed'])
+def test_encodes_outgoing_messages(codec, framing):
+    state = {'.foo': [{'ref': 'a', 'text': 'hällo\n'}]}
+    event = protocol.Action('loaded', [], True, None)
+    received = write_and_read_back(codec, framing, [
+        protocol.Performed(state),
+        protocol.Stale(),
+        protocol.Events([event], state),
+    ])
+    assert received == [
+        {'tag': 'Performed', 'contents': state},
+        {'tag': 'Stale'},
+        {'tag': 'Events', 'contents': [[{
+            'id': 'loaded',
+            'args': [],
+            'isEvent': True,
+            'timeout': None
+        }], state]},
+    ]
+
+
+@pytest.mark.parametrize('codec', available_codecs, ids=lambda c: c.name)
+def test_decodes_incoming_messages(codec):
+    stream = io.BytesIO(
+        b'{"tag":"Start","dependencies":{".foo":{"text":{}}}}\n'
+        b'{"tag":"RequestAction","action":{"id":"click","args":["a"],"isEvent":false,"timeout":null},"version":2}\n'
+        b'{"tag":"Done","results":[{"tag":"RunResult","valid":{"tag":"Definitely","contents":true},"trace":[]}]}\n'
+    )
+    reader = protocol.message_reader(stream, codec)
+    assert reader.read() == protocol.Start({'.foo': {'text': {}}})
+    assert reader.read() == protocol.RequestAction(
+        protocol.Action('click', ['a'], False, None), 2)
+    assert reader.read() == protocol.Done([
+        protocol.RunResult(protocol.Validity('Definitely', True), [])
+    ])
+    assert reader.read() is None
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        protocol.codec_by_name('yaml')
+
+
+def test_decodes_traces_without_touching_states():
+    action = {'id': 'click', 'args': ['a'], 'isEvent': False, 'timeout': None}
+    # A state element that happens to look like an action stays as it is.
+    state = {'.foo': [dict(action, ref='a')]}
+    stream = io.BytesIO(json.dumps({
+        'tag': 'Done',
+        'results': [{
+            'tag': 'ErrorResult',
+            'trace': [
+                {'tag': 'TraceAction', 'contents': [action]},
+                {'tag': 'TraceState', 'contents': state},
+                {'tag': 'TraceError', 'contents': 'oops'},
+            ]
+        }]
+    }).encode() + b'\n')
+    assert protocol.message_reader(stream).read() == protocol.Done([
+        protocol.ErrorResult([
+            protocol.TraceActions([protocol.Action('click', ['a'], False, None)]),
+            protocol.TraceState(state),
+            protocol.TraceError('oops'),
+        ])
+    ])
@@ -0,0 +1,20 @@
+import pytest
+import quickstrom.readiness as readiness
+
+
+def test_parse_strategy_with_default_timeout():
+    assert readiness.parse_strategy('ready-state') == readiness.ReadyState()
+
+
+def test_parse_strategy_with_timeout():
+    assert readiness.parse_strategy(
+        'dom-quiescence:5000') == readiness.DomQuiescence(timeout=5000)
+    assert readiness.parse_strategy(
+        'network-idle:100') == readiness.NetworkIdle(timeout=100)
+
+
+def test_parse_invalid_strategy():
+    with pytest.raises(ValueError):
+        readiness.parse_strategy('whenever')
+    with pytest.raises(ValueError):
+        readiness.parse_strategy('ready-state:soon')
@@ -0,0 +1,136 @@
+import json
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import pytest
+from selenium import webdriver
+import selenium.webdriver.chrome.options as chrome_options
+
+from quickstrom.remote import EndpointPool, NoEndpointAvailable
+
+# The pinned Selenium reads response headers through a deprecated urllib3
+# method, on every command sent to the stand-in.
+pytestmark = pytest.mark.filterwarnings(
+    'ignore:HTTPResponse.getheader:DeprecationWarning')
+
+
+class StandInWebDriver():
+    """A local server answering the WebDriver session commands."""
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.sessions: List[str] = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def reply(self, status: int, value):
+                body = json.dumps({'value': value}).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.reply(200, {'ready': not stand_in.fail})
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                if stand_in.fail:
+                    self.reply(500, {
+                        'error': 'session not created',
+                        'message': 'no browsers left',
+                        'stacktrace': ''
+                    })
+                else:
+                    session_id = str(uuid.uuid4())
+                    stand_in.sessions.append(session_id)
+                    self.reply(200, {
+                        'sessionId': session_id,
+                        'capabilities': {'browserName': 'chrome'}
+                    })
+
+            def do_DELETE(self):
+                stand_in.sessions.remove(self.path.split('/')[2])
+                self.reply(200, None)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def close(self):
+        self.server.shutdown()
+
+
+@pytest.fixture
+def stand_ins():
+    servers = [StandInWebDriver(), StandInWebDriver(), StandInWebDriver(fail=True)]
+    yield servers
+    for server in servers:
+        server.close()
+
+
+def new_remote_driver(url: str):
+    return webdriver.Remote(command_executor=url,
+                            options=chrome_options.Options())
+
+
+def test_spreads_sessions_across_endpoints(stand_ins):
+    pool = EndpointPool([s.url for s in stand_ins], new_remote_driver)
+    drivers = [pool.new_driver() for _ in range(4)]
+    assert [len(s.sessions) for s in stand_ins] == [2, 2, 0]
+
+    for driver in drivers[:2]:
+        pool.released(driver)
+        driver.quit()
+    pool.new_driver()
+    assert sorted(len(s.sessions) for s in stand_ins[:2]) == [1, 2]
+
+
+def test_avoids_failing_endpoints(stand_ins):
+    now = [0.0]
+    pool = EndpointPool([stand_ins[2].url, stand_ins[0].url],
+                        new_remote_driver,
+                        clock=lambda: now[0])
+    pool.new_driver()
+    assert len(stand_ins[0].sessions) == 1
+    [failing, _] = pool.endpoints
+    assert failing.failures == 1
+
+    # While cooling down, the failing endpoint is not tried again, even
+    # though the other one has more sessions.
+    pool.new_driver()
+    assert failing.failures == 1
+
+    # Once the cooldown is over, its status is checked first.
+    now[0] += 60
+    pool.new_driver()
+    assert failing.failures == 2
+    assert len(stand_ins[0].sessions) == 3
+
+
+def test_fails_when_no_endpoint_can_start_a_session(stand_ins):
+    pool = EndpointPool([stand_ins[2].url], new_remote_driver)
+    with pytest.raises(NoEndpointAvailable):
+        pool.new_driver()
+
+
+def test_avoids_endpoints_of_browsers_that_failed(stand_ins):
+    pool = EndpointPool([s.url for s in stand_ins[:2]], new_remote_driver)
+    driver = pool.new_driver()
+    [endpoint] = [e for e in pool.endpoints if e.active == 1]
+    pool.released(driver, failed=True)
+    driver.quit()
+    assert endpoint.active == 0 and endpoint.failures == 1
+
+    pool.new_driver()
+    assert endpoint.active == 0
@@ -0,0 +1,74 @@
+import hashlib
+import struct
+import zlib
+import pytest
+from quickstrom.screenshots import ImageEncoding, ScreenshotStore, png_dimensions
+
+
+def png_image(width: int, height: int) -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack(
+            '>I', zlib.crc32(kind + data))
+
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    rows = b''.join(b'\x00' + b'\x00' * width * 3 for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr) +
+            chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+def test_png_dimensions():
+    assert png_dimensions(png_image(30, 20)) == (30, 20)
+
+
+def test_screenshots_are_deduplicated_by_hash(tmp_path):
+    screenshots = ScreenshotStore(tmp_path)
+    assert screenshots.should_capture('a')
+    screenshots.add('a', png_image(20, 10), (10, 5))
+    assert not screenshots.should_capture('a')
+    screenshots.add('a', png_image(40, 20), (10, 5))
+    screenshots.flush()
+    s = screenshots.get('a')
+    assert s is not None
+    assert (s.width, s.height, s.scale) == (20, 10, 2)
+    assert s.image.read_bytes() == png_image(20, 10)
+    screenshots.close()
+
+
+def test_screenshots_are_stored_by_content(tmp_path):
+    screenshots = ScreenshotStore(tmp_path)
+    screenshots.add('a', png_image(20, 10), (20, 10))
+    screenshots.add('b', png_image(20, 10), (20, 10))
+    screenshots.close()
+    a = screenshots.get('a')
+    b = screenshots.get('b')
+    assert a is not None and b is not None
+    assert a.image == b.image
+    assert list(tmp_path.iterdir()) == [a.image.path]
+
+
+def test_screenshot_errors_are_raised_when_flushing(tmp_path):
+    screenshots = ScreenshotStore(tmp_path)
+    screenshots.add('a', b'not a png', (20, 10))
+    with pytest.raises(ValueError):
+        screenshots.flush()
+    assert screenshots.get('a') is None
+    screenshots.add('b', b'not a png', (20, 10))
+    with pytest.raises(ValueError):
+        screenshots.close()
+
+
+def test_screenshots_are_encoded_with_thumbnails(tmp_path):
+    pytest.importorskip('PIL')
+    screenshots = ScreenshotStore(
+        tmp_path, ImageEncoding('jpeg', quality=50, thumbnail_width=10))
+    screenshots.add('a', png_image(40, 20), (40, 20))
+    screenshots.close()
+    s = screenshots.get('a')
+    assert s is not None and s.thumbnail is not None
+    assert s.image.path.suffix == '.jpeg'
+    assert s.image.read_bytes()[:2] == b'\xff\xd8'
+    for image in [s.image, s.thumbnail]:
+        assert image.digest == hashlib.sha256(image.read_bytes()).hexdigest()
+    import PIL.Image
+    with PIL.Image.open(s.thumbnail.path) as thumbnail:
+        assert thumbnail.size == (10, 5)
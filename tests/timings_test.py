@@ -0,0 +1,27 @@
+from quickstrom.timings import PhaseTimings, load_samples, percentile, summarize
+
+
+def test_percentiles_by_nearest_rank():
+    samples = [float(n) for n in range(10, 0, -1)]
+    assert percentile(samples, 50) == 5.0
+    assert percentile(samples, 90) == 9.0
+    assert percentile(samples, 99) == 10.0
+    assert percentile([3.0], 50) == 3.0
+
+
+def test_records_timed_calls(tmp_path):
+    timings = PhaseTimings()
+
+    @timings.timed('action')
+    def act(n: int) -> int:
+        return n + 1
+
+    assert act(1) == 2
+    assert act(2) == 3
+    timings.record('query', 0.5)
+    assert timings.summary()['action']['count'] == 2
+    assert timings.summary()['query'] == summarize([0.5])
+
+    path = str(tmp_path / 'timings.json')
+    timings.save(path)
+    assert load_samples(path)['query'] == [0.5]
@@ -0,0 +1,61 @@
+import json
+
+from quickstrom.executor import StorageState
+from quickstrom.timings import PhaseTimings
+from quickstrom.tracing import Tracer, trace_commands
+
+from .executor_test import FakeSpecstromCheck
+
+
+class CommandDriver():
+    def execute(self, command, params=None):
+        return {'value': command}
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer()
+    with tracer.span('send', 'protocol'):
+        pass
+    driver = CommandDriver()
+    trace_commands(driver, tracer)
+    driver.execute('getTitle')
+    assert tracer.events == []
+
+
+def test_writes_trace_events(tmp_path):
+    tracer = Tracer(enabled=True)
+    with tracer.span('outer', 'test', n=1):
+        driver = CommandDriver()
+        trace_commands(driver, tracer)
+        assert driver.execute('getTitle') == {'value': 'getTitle'}
+    path = tmp_path / 'trace.json'
+    tracer.save(str(path))
+    events = json.loads(path.read_text())['traceEvents']
+    spans = [e for e in events if e['ph'] == 'X']
+    assert [(e['name'], e['cat']) for e in spans] == [('getTitle',
+                                                       'webdriver'),
+                                                      ('outer', 'test')]
+    inner, outer = spans
+    assert outer['args'] == {'n': 1}
+    assert outer['ts'] <= inner['ts']
+    assert inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+    assert any(e['ph'] == 'M' and e['name'] == 'thread_name' for e in events)
+
+
+def test_traces_checks(tmp_path):
+    tracer = Tracer(enabled=True)
+    with open(tmp_path / 'interpreter.log', 'w+') as ilog:
+        FakeSpecstromCheck('fake',
+                           'http://localhost',
+                           'chrome', [],
+                           True,
+                           False,
+                           StorageState([]),
+                           None,
+                           ilog,
+                           screenshot_directory=tmp_path,
+                           timings=PhaseTimings(tracer),
+                           tracer=tracer).execute()
+    names = {e['name'] for e in tracer.events}
+    assert {'receive Start', 'send Events', 'send Performed', 'action',
+            'page-load', 'check'} <= names
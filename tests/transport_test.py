@@ -0,0 +1,63 @@
+from typing import Any, List, Optional, cast
+
+import pytest
+from selenium.common.exceptions import StaleElementReferenceException
+from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.webdriver.remote.webelement import WebElement
+
+from quickstrom.transport import SeleniumTransport
+
+
+class FakeElement(WebElement):
+    def __init__(self, id: str):
+        super().__init__(None, id)
+        self.keys: List[str] = []
+        self.is_stale = False
+
+    def send_keys(self, *keys: str):
+        if self.is_stale:
+            raise StaleElementReferenceException()
+        self.keys.extend(keys)
+
+
+class ResolvingDriver():
+    """Resolves refs to the current element, counting the round trips."""
+    def __init__(self):
+        self.current: Optional[FakeElement] = FakeElement('a')
+        self.resolved = 0
+
+    def execute_script(self, script: str, *args: Any) -> Any:
+        self.resolved += 1
+        return self.current
+
+
+def test_resolves_each_ref_once():
+    driver = ResolvingDriver()
+    transport = SeleniumTransport(cast(WebDriver, driver))
+    transport.send_keys_to('r1', 'x')
+    transport.send_keys_to('r1', 'y')
+    assert driver.resolved == 1
+    assert driver.current is not None and driver.current.keys == ['x', 'y']
+
+
+def test_resolves_stale_elements_again():
+    driver = ResolvingDriver()
+    transport = SeleniumTransport(cast(WebDriver, driver))
+    transport.send_keys_to('r1', 'x')
+    assert driver.current is not None
+    driver.current.is_stale = True
+    driver.current = FakeElement('b')
+    transport.send_keys_to('r1', 'y')
+    assert driver.resolved == 2
+    assert driver.current.keys == ['y']
+
+
+def test_fails_for_refs_no_longer_in_the_document():
+    driver = ResolvingDriver()
+    transport = SeleniumTransport(cast(WebDriver, driver))
+    transport.send_keys_to('r1', 'x')
+    assert driver.current is not None
+    driver.current.is_stale = True
+    driver.current = None
+    with pytest.raises(StaleElementReferenceException):
+        transport.send_keys_to('r1', 'y')